@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+gj_bench: measure gj's speed and memory usage with synthetic data.
+
+The source benchmarks generate a source tree whose tokens follow a Zipf
+distribution, build the native text index of it once per scale and run the
+queries in it. The ELF benchmarks generate the output of nm and readelf.
+The data only depend on the options and the seed, so the results of
+different commits are comparable.
+'''
+
+import bisect
+import contextlib
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import gj_bulk
+import gj_index
+import gj_util
+
+
+__author__ = 'fcamel'
+
+LANGUAGES = ('cc', 'py', 'go', 'java')
+# The number of runs of each command in bench_startup(). Use the fastest one.
+STARTUP_RUNS = 10
+
+# The options of the synthetic source tree.
+corpus_config = {
+    'languages': LANGUAGES,
+    'lines_per_file': 100,
+    'files_per_dir': 50,
+    'vocabulary': 20000,
+    'zipf': 1.1,
+    'seed': 0,
+    'jobs': None,
+}
+
+#------------------------------------------------------------------------------
+# Synthetic data
+#------------------------------------------------------------------------------
+def write_readelf_dump(filename, n_rows, rows_per_cu=1000, seed=0):
+    '''
+    Write the output of "readelf --debug-dump=decodedline --wide" with
+    |n_rows| rows. Return the addresses of the rows.
+    '''
+    rnd = random.Random(seed)
+    addresses = []
+    address = 0x400000
+    with open(filename, 'w') as fw:
+        fw.write('Contents of the .debug_line section:\n\n')
+        for i in range(n_rows):
+            if i % rows_per_cu == 0:
+                cu = i // rows_per_cu
+                fw.write('CU: ./src/dir%d/file%d.cc:\n' % (cu % 100, cu))
+                fw.write('File name                            Line number    Starting address\n')
+            address += rnd.randint(1, 16)
+            addresses.append('0x%x' % address)
+            fw.write('file%d.cc %30d %18s\n' % (i // rows_per_cu, rnd.randint(1, 5000), addresses[-1]))
+    return addresses
+
+def write_nm_dump(filename, addresses, seed=0):
+    rnd = random.Random(seed)
+    with open(filename, 'w') as fw:
+        for i, address in enumerate(addresses):
+            fw.write('%016x %s ns%d::Class%d::Method%d(int, char const*)\n'
+                     % (int(address, 16), rnd.choice('tTwW'), i % 10, i % 1000, i))
+
+def get_word(rank):
+    '''
+    Return the token of |rank| in the synthetic source tree. Rank 0 is the
+    most frequent one.
+    '''
+    return 'sym%d' % rank
+
+def write_source_tree(root, n_lines, languages=LANGUAGES, lines_per_file=100, files_per_dir=50,
+                      vocabulary=20000, zipf=1.1, seed=0):
+    '''
+    Write about |n_lines| lines of source codes under |root|. The files of
+    |languages| are spread over dir0/, dir1/, ... and each file defines a
+    few functions. The tokens are drawn from |vocabulary| words whose
+    frequencies follow a Zipf distribution with the exponent |zipf|.
+    Return the number of files.
+    '''
+    rnd = random.Random(seed)
+    cum_weights = []
+    total = 0.0
+    for rank in range(vocabulary):
+        total += 1.0 / (rank + 1) ** zipf
+        cum_weights.append(total)
+
+    def draw():
+        return get_word(bisect.bisect_left(cum_weights, rnd.random() * total))
+
+    n_files = max(1, n_lines // lines_per_file)
+    for i in range(n_files):
+        language = languages[i % len(languages)]
+        dirpath = os.path.join(root, 'dir%d' % (i // files_per_dir))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        templates = _TEMPLATES[language]
+        lines = []
+        while len(lines) < lines_per_file:
+            lines.append(templates[0] % (draw(), draw()))
+            for _ in range(rnd.randint(3, 12)):
+                lines.append(templates[1] % (draw(), draw(), draw()))
+            lines.extend(templates[2:])
+        filename = os.path.join(dirpath, 'file%d.%s' % (i, language))
+        with open(filename, 'w') as fw:
+            fw.write('\n'.join(lines) + '\n')
+    return n_files
+
+# The definition, the statement and the end of a function.
+_TEMPLATES = {
+    'cc': ('void %s(int %s) {', '  %s = %s(%s);', '}'),
+    'py': ('def %s(%s):', '    %s = %s(%s)'),
+    'go': ('func %s(%s int) {', '\t%s := %s(%s)', '}'),
+    'java': ('public void %s(int %s) {', '    %s = %s(%s);', '}'),
+}
+
+def make_symbol_infos(n_symbols, seed=0):
+    '''
+    Return |n_symbols| SymbolInfo like the ones read from a C++ binary.
+    '''
+    rnd = random.Random(seed)
+    infos = []
+    for i in range(n_symbols):
+        symbol = 'Method%d' % i
+        full = 'ns%d::Class%d::%s(int, char const*)' % (i % 10, i % 1000, symbol)
+        fileline = gj_util.FileLine('src/dir%d/file%d.cc' % (i % 100, i % 5000),
+                                    rnd.randint(1, 5000))
+        infos.append(gj_util.SymbolInfo(symbol, full, fileline))
+    return infos
+
+#------------------------------------------------------------------------------
+# Benchmarks
+#------------------------------------------------------------------------------
+def bench_parse_readelf(workdir, scale):
+    '''
+    Stream the synthetic readelf output through a pipe and keep 1000 addresses.
+    The peak memory should not grow with the scale.
+    '''
+    filename = os.path.join(workdir, 'readelf.txt')
+    addresses = write_readelf_dump(filename, scale)
+    wanted = set(addresses[::max(1, len(addresses) // 1000)])
+    def run():
+        lines = gj_index._iter_output_lines(['cat', filename])
+        return len(dict(gj_index._parse_decoded_lines(lines, wanted)))
+    return _measure(run)
+
+def bench_parse_nm(workdir, scale):
+    filename = os.path.join(workdir, 'nm.txt')
+    write_nm_dump(filename, ['0x%x' % (0x400000 + i * 16) for i in range(scale)])
+    def run():
+        return len(list(gj_index._parse_nm_lines(gj_index._iter_output_lines(['cat', filename]))))
+    return _measure(run)
+
+def bench_build_index(workdir, scale):
+    '''
+    Build the native text index, the symbol index and the definition index
+    of |scale| lines.
+    '''
+    root = _prepare_source_tree(workdir, scale, build=False)
+    def run():
+        with _chdir(root), _quiet():
+            gj_util.build_index('bench.ID', gj_util.ENGINE_NATIVE, corpus_config['jobs'])
+        return scale
+    return _measure(run)
+
+def bench_find_matches_1(workdir, scale):
+    return _measure_query(workdir, scale, lambda: gj_util.find_matches([get_word(10)]))
+
+def bench_find_matches_2(workdir, scale):
+    return _measure_query(workdir, scale,
+                          lambda: gj_util.find_matches([get_word(10), get_word(0)]))
+
+def bench_find_matches_3(workdir, scale):
+    return _measure_query(workdir, scale,
+                          lambda: gj_util.find_matches([get_word(10), get_word(0), get_word(1)]))
+
+def bench_find_matches_filter(workdir, scale):
+    '''
+    gj -f: a common word in the files of a less common word.
+    '''
+    return _measure_query(workdir, scale,
+                          lambda: gj_util.find_matches([get_word(1)], filter_=get_word(100)))
+
+def bench_find_matches_path(workdir, scale):
+    '''
+    gj -p: a common word under one directory.
+    '''
+    return _measure_query(workdir, scale,
+                          lambda: gj_util.find_matches([get_word(1)], path_prefix='dir0/'))
+
+def bench_find_matches_extended(workdir, scale):
+    '''
+    gj -e 3: two words within three lines.
+    '''
+    def run():
+        gj_util.config['search_extended_lines'] = 3
+        try:
+            return gj_util.find_matches([get_word(10), get_word(0)])
+        finally:
+            gj_util.config['search_extended_lines'] = 0
+    return _measure_query(workdir, scale, run)
+
+def bench_find_declaration_or_definition(workdir, scale):
+    return _measure_query(workdir, scale,
+                          lambda: gj_util.find_declaration_or_definition(get_word(10)))
+
+def bench_find_symbols(workdir, scale):
+    return _measure_query(workdir, scale, lambda: gj_util.find_symbols(get_word(12)))
+
+def bench_save_definitions(workdir, scale):
+    '''
+    Save |scale| symbols to gj.index like gj -I.
+    '''
+    infos = make_symbol_infos(scale)
+    filename = os.path.join(workdir, gj_util.DEFINITION_INDEX_FILE)
+    def run():
+        gj_index._save_infos(infos, filename)
+        return len(infos)
+    return _measure(run)
+
+def bench_index_definitions(workdir, scale):
+    '''
+    Collect |scale| symbols from 10 synthetic ELF files like gj -I and save
+    them. The ELF files share 20% of the symbols like the shared libraries.
+    '''
+    filename = os.path.join(workdir, gj_util.DEFINITION_INDEX_FILE)
+    n_elves = 10
+    def read_elf(k):
+        rnd = random.Random(k)
+        symbols_and_addresses = []
+        addresses_and_filelines = []
+        for j in range(scale // n_elves):
+            i = j if j < scale // 50 else k * scale + j
+            symbol = 'Method%d' % i
+            address = '0x%x' % (4096 + 16 * j)
+            symbols_and_addresses.append(
+                ('ns%d::Class%d::%s(int, char const*)' % (i % 10, i % 1000, symbol), address))
+            fileline = gj_util.FileLine('/src/dir%d/file%d.cc' % (i % 100, i % 5000),
+                                        rnd.randint(1, 5000))
+            addresses_and_filelines.append((address, fileline))
+        return symbols_and_addresses, addresses_and_filelines
+    def run():
+        collector = gj_index._Collector()
+        for k in range(n_elves):
+            symbols_and_addresses, addresses_and_filelines = read_elf(k)
+            infos = gj_index._to_symbol_infos(symbols_and_addresses, addresses_and_filelines,
+                                              ('/src/', ''))
+            collector.add_infos(infos)
+        gj_index._save(collector, filename)
+        return scale
+    return _measure(run)
+
+def bench_find_definition(workdir, scale):
+    '''
+    Look up 100 symbols in gj.index of |scale| symbols.
+    '''
+    root = os.path.join(workdir, 'definitions-%d' % scale)
+    if not os.path.isdir(root):
+        os.makedirs(root)
+        infos = make_symbol_infos(scale)
+        gj_index._save_infos(infos, os.path.join(root, gj_util.DEFINITION_INDEX_FILE))
+    symbols = ['Method%d' % i for i in range(0, scale, max(1, scale // 100))]
+    def run():
+        with _chdir(root):
+            return sum(len(gj_util.find_definition(s)) for s in symbols)
+    return _measure(run)
+
+def bench_bulk(workdir, scale):
+    '''
+    Answer 100 words and their -d queries by "gj --bulk" in this process.
+    '''
+    root = _prepare_source_tree(workdir, scale, build=True)
+    queries = os.path.join(root, 'bulk-queries')
+    with open(queries, 'w') as fw:
+        for rank in range(1, 101):
+            fw.write('%s\n-d %s\n' % (get_word(rank), get_word(rank)))
+    def run():
+        with _chdir(root), _quiet():
+            gj_bulk.run(queries, 'ID')
+        return 200
+    return _measure(run)
+
+def bench_startup(workdir, scale):
+    '''
+    Run "gj -b" in new processes like the editor plugins do.
+    baseline_seconds is the start-up time of Python itself and lookup_seconds
+    is the time of the same query in this process, so overhead_seconds is
+    about the time spent in importing the modules and parsing the options.
+    cached_seconds uses the result cache.
+    '''
+    root = _prepare_source_tree(workdir, scale, build=True)
+    word = get_word(10)
+    gj = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gj')
+    baseline = _time_command([sys.executable, '-c', 'pass'], root)
+    wall = _time_command([sys.executable, gj, '-b', '--no-cache', word], root)
+    cached = _time_command([sys.executable, gj, '-b', word], root)
+    with _chdir(root):
+        lookup = _measure(lambda: len(gj_util.query(gj_util.Q_MATCHES, [word])))
+    return {
+        'wall_seconds': round(wall, 6),
+        'cpu_seconds': 0.0,
+        'peak_memory_bytes': 0,
+        'items': STARTUP_RUNS,
+        'baseline_seconds': round(baseline, 6),
+        'cached_seconds': round(cached, 6),
+        'lookup_seconds': lookup['wall_seconds'],
+        'overhead_seconds': round(max(0.0, wall - baseline - lookup['wall_seconds']), 6),
+    }
+
+BENCHMARKS = {
+    'parse_readelf': bench_parse_readelf,
+    'parse_nm': bench_parse_nm,
+    'build_index': bench_build_index,
+    'find_matches_1': bench_find_matches_1,
+    'find_matches_2': bench_find_matches_2,
+    'find_matches_3': bench_find_matches_3,
+    'find_matches_filter': bench_find_matches_filter,
+    'find_matches_path': bench_find_matches_path,
+    'find_matches_extended': bench_find_matches_extended,
+    'find_declaration_or_definition': bench_find_declaration_or_definition,
+    'find_symbols': bench_find_symbols,
+    'save_definitions': bench_save_definitions,
+    'index_definitions': bench_index_definitions,
+    'find_definition': bench_find_definition,
+    'bulk': bench_bulk,
+    'startup': bench_startup,
+}
+
+#------------------------------------------------------------------------------
+# helper methods
+#------------------------------------------------------------------------------
+def _measure(func):
+    '''
+    Return the wall time, CPU time and Python peak memory of func().
+    Run func() twice because tracing the memory slows it down.
+    '''
+    wall_begin = time.time()
+    cpu_begin = time.process_time()
+    count = func()
+    wall = time.time() - wall_begin
+    cpu = time.process_time() - cpu_begin
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_seconds': round(wall, 6),
+        'cpu_seconds': round(cpu, 6),
+        'peak_memory_bytes': peak,
+        'items': count,
+    }
+
+def _measure_query(workdir, scale, query):
+    '''
+    Measure query() in the indexed source tree of |scale| lines.
+    '''
+    root = _prepare_source_tree(workdir, scale, build=True)
+    def run():
+        with _chdir(root):
+            return len(query())
+    return _measure(run)
+
+def _prepare_source_tree(workdir, scale, build):
+    '''
+    Write the source tree of |scale| lines once and share it between the
+    benchmarks. Build the index if |build| is True.
+    '''
+    root = os.path.join(workdir, 'src-%d' % scale)
+    if not os.path.isdir(root):
+        options = dict(corpus_config)
+        del options['jobs']
+        write_source_tree(root, scale, **options)
+    gj_util.config['db_path'] = 'ID'
+    if build and not os.path.exists(os.path.join(root, 'ID')):
+        with _chdir(root), _quiet():
+            gj_util.build_index('ID', gj_util.ENGINE_NATIVE, corpus_config['jobs'])
+    return root
+
+def _time_command(args, cwd):
+    '''
+    Return the shortest wall time of running |args| STARTUP_RUNS times.
+    '''
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(STARTUP_RUNS):
+            begin = time.time()
+            subprocess.call(args, cwd=cwd, stdout=devnull)
+            elapsed = time.time() - begin
+            if best is None or elapsed < best:
+                best = elapsed
+    return best
+
+@contextlib.contextmanager
+def _chdir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+@contextlib.contextmanager
+def _quiet():
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+#------------------------------------------------------------------------------
+# main
+#------------------------------------------------------------------------------
+def main():
+    '''\
+    %prog [options] [<benchmark> ...]
+
+    Run the benchmarks (default: all) with synthetic data and output the
+    results as JSON, so the results of different commits can be compared.
+
+    The scale is the number of lines of the source tree for the source
+    benchmarks, the number of symbols for save_definitions and
+    find_definition, and the number of rows for the others.
+    '''
+    parser = optparse.OptionParser(usage=main.__doc__)
+    parser.add_option('-s', '--scales', dest='scales',
+                      type='string', default='1000,10000,100000',
+                      help='Comma-separated sizes of the synthetic data (default: %default).')
+    parser.add_option('-o', '--output', dest='output',
+                      type='string', default='',
+                      help='Write the JSON to the file instead of stdout.')
+    parser.add_option('-l', '--list', dest='list',
+                      action='store_true', default=False,
+                      help='List the benchmarks.')
+    parser.add_option('--languages', dest='languages',
+                      type='string', default=','.join(LANGUAGES),
+                      help='Comma-separated languages of the source tree (default: %default).')
+    parser.add_option('--lines-per-file', dest='lines_per_file',
+                      type=int, default=corpus_config['lines_per_file'],
+                      help='The number of lines of each source file (default: %default).')
+    parser.add_option('--vocabulary', dest='vocabulary',
+                      type=int, default=corpus_config['vocabulary'],
+                      help='The number of distinct tokens in the source tree (default: %default).')
+    parser.add_option('--zipf', dest='zipf',
+                      type=float, default=corpus_config['zipf'],
+                      help=('The exponent of the Zipf distribution of the tokens. The larger,'
+                            ' the more skewed (default: %default).'))
+    parser.add_option('--seed', dest='seed',
+                      type=int, default=corpus_config['seed'],
+                      help='The random seed of the source tree (default: %default).')
+    parser.add_option('-j', '--jobs', dest='jobs',
+                      type=int, default=None,
+                      help='The number of processes to build the index (default: #CPUs).')
+    options, args = parser.parse_args()
+
+    if options.list:
+        for name in sorted(BENCHMARKS):
+            print(name)
+        return 0
+
+    names = args or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark: %s' % name)
+            return 1
+    languages = tuple(options.languages.split(','))
+    for language in languages:
+        if language not in LANGUAGES:
+            print('Unknown language: %s' % language)
+            return 1
+    scales = [int(s) for s in options.scales.split(',')]
+    corpus_config.update({
+        'languages': languages,
+        'lines_per_file': options.lines_per_file,
+        'vocabulary': options.vocabulary,
+        'zipf': options.zipf,
+        'seed': options.seed,
+        'jobs': options.jobs,
+    })
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='gj_bench_')
+    try:
+        for name in names:
+            for scale in scales:
+                result = BENCHMARKS[name](workdir, scale)
+                result.update({'benchmark': name, 'scale': scale})
+                results.append(result)
+                sys.stderr.write('%-30s %10d %10.3fs %12d bytes\n'
+                                 % (name, scale, result['wall_seconds'], result['peak_memory_bytes']))
+    finally:
+        shutil.rmtree(workdir)
+
+    text = json.dumps({'corpus': corpus_config, 'results': results}, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as fw:
+            fw.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
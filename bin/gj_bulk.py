@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+Answer many batch queries in one process: "gj --bulk FILE".
+
+Each line of FILE (stdin if FILE is "-") is a query in gj's arguments, e.g.,
+"Foo", "-d Foo", "-D Foo", "-a Foo", "-s foo" or "-p src -f Bar Foo". "-b"
+is implied. A line may start with "TAG<TAB>" to name the query. The empty
+lines and the lines starting with "#" are skipped.
+
+Each result is written in one line after its tag (default: the query itself):
+"TAG<TAB>path:line_num:column:text", or a JSON object whose "query" is the
+tag with --json.
+
+The scripts used to run gj once per symbol. Here starting Python, checking
+the installation and opening the indexes are done once for all queries, the
+results of the recent queries are reused by the same queries, and the
+recently read source files are kept in memory because the queries often read
+the same files. The result cache is not used; saving thousands of results
+would evict the editor's ones. "--db" in a query is an error unless it's the
+database of "gj --bulk".
+'''
+
+import collections
+import os
+import shlex
+import sys
+
+import gj_server
+import gj_text_index
+import gj_util
+
+
+__author__ = 'fcamel'
+
+# The total size of the source files kept in memory.
+FILE_CACHE_BYTES = 256 * 1024 * 1024
+# The number of the recent results kept for the same queries.
+ANSWERED_QUERIES = 64
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def run(path, db_path, json_lines=False):
+    '''
+    Answer the queries in the file |path| and print the results. Return 1 if
+    any query is invalid or fails, otherwise 0.
+    '''
+    gj_util.config['db_path'] = db_path
+    if gj_text_index.is_native(db_path):
+        gj_text_index.open_index(db_path).cache_files(FILE_CACHE_BYTES)
+
+    if path == '-':
+        return _run(sys.stdin, json_lines)
+    with open(path) as fr:
+        return _run(fr, json_lines)
+
+def parse_line(line):
+    '''
+    Return (tag, argv) of a line of the queries. Return (None, None) if the
+    line is empty or a comment.
+    '''
+    line = line.rstrip('\r\n')
+    if not line.strip() or line.lstrip().startswith('#'):
+        return None, None
+    tag, sep, args = line.partition('\t')
+    if not sep:
+        args = tag
+    return tag, shlex.split(args)
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _run(lines, json_lines):
+    code = 0
+    # argv -> (kind, result) of the recently answered queries.
+    answered = collections.OrderedDict()
+    for line_num, line in enumerate(lines, 1):
+        try:
+            tag, argv = parse_line(line)
+            if argv is None:
+                continue
+            key = tuple(argv)
+            if key in answered:
+                # Move it to the end as the most recently used one.
+                answered[key] = answered.pop(key)
+            else:
+                answered[key] = _query(argv)
+                if len(answered) > ANSWERED_QUERIES:
+                    answered.popitem(last=False)
+        except ValueError as e:
+            sys.stderr.write('Skip line %d: %s\n' % (line_num, e))
+            code = 1
+            continue
+        except (IOError, OSError) as e:
+            sys.stderr.write('Failed to answer line %d: %s\n' % (line_num, e))
+            code = 1
+            continue
+
+        kind, result = answered[key]
+        for item in result:
+            print(gj_util.format_result(kind, item, json_lines, tag))
+    return code
+
+def _query(argv):
+    '''
+    Return (kind, result) of the query |argv|.
+    '''
+    options, patterns = gj_server.parse_query(['-b'] + argv)
+    if options is None:
+        raise ValueError('Not a batch query: %s' % ' '.join(argv))
+    if (any(arg == '--db' or arg.startswith('--db=') for arg in argv)
+            and os.path.abspath(options.db_path) != os.path.abspath(gj_util.config['db_path'])):
+        raise ValueError('Only the database "%s" is queried: %s'
+                         % (gj_util.config['db_path'], ' '.join(argv)))
+
+    gj_util.config['verbose'] = options.verbose
+    gj_util.config['search_extended_lines'] = options.extended
+    kind = gj_server.get_kind(options)
+    result = gj_util.query(kind, patterns, path_prefix=options.path, filter_=options.filter_,
+                           limit=options.limit, first_file_only=options.first_file_only,
+                           sort=not options.unsorted)
+    return kind, list(result)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import gj_bulk
+import gj_text_index
+import gj_util
+
+
+class BulkTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._config = dict(gj_util.config)
+        self._root = tempfile.mkdtemp(prefix='gj_bulk_test_')
+        os.chdir(self._root)
+        with open('id-lang.map', 'w') as fw:
+            fw.write('**  IGNORE\n*.cc  text\n')
+        with open('a.cc', 'w') as fw:
+            fw.write('class Foo {\n};\nFoo foo;\nBar bar;\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+
+    def tearDown(self):
+        gj_util.config.clear()
+        gj_util.config.update(self._config)
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _run(self, queries, json_lines=False):
+        with open('queries', 'w') as fw:
+            fw.write(queries)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        try:
+            code = gj_bulk.run('queries', 'ID', json_lines)
+            return code, sys.stdout.getvalue().splitlines(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_parse_line(self):
+        self.assertEqual(('Foo', ['Foo']), gj_bulk.parse_line('Foo\n'))
+        self.assertEqual(('q1', ['-d', 'Foo']), gj_bulk.parse_line('q1\t-d Foo\n'))
+        self.assertEqual(('-f "a b" Foo', ['-f', 'a b', 'Foo']),
+                         gj_bulk.parse_line('-f "a b" Foo'))
+        self.assertEqual((None, None), gj_bulk.parse_line('  \n'))
+        self.assertEqual((None, None), gj_bulk.parse_line('# Foo\n'))
+
+    def test_run(self):
+        code, lines, errors = self._run('Foo\n\nq1\t-d Foo\n-s ba\nBar\nFoo\n')
+        self.assertEqual(0, code)
+        self.assertEqual('', errors)
+        self.assertEqual([
+            'Foo\ta.cc:1:6:class Foo {',
+            'Foo\ta.cc:3:0:Foo foo;',
+            'q1\ta.cc:1:6:class Foo {',
+            '-s ba\tBar',
+            '-s ba\tbar',
+            'Bar\ta.cc:4:0:Bar bar;',
+            'Foo\ta.cc:1:6:class Foo {',
+            'Foo\ta.cc:3:0:Foo foo;',
+        ], lines)
+
+    def test_json(self):
+        _, lines, _ = self._run('q1\tBar\n', json_lines=True)
+        self.assertEqual([{'query': 'q1', 'filename': 'a.cc', 'line': 4, 'column': 0,
+                           'text': 'Bar bar;'}], [json.loads(line) for line in lines])
+
+    def test_invalid_query(self):
+        code, lines, errors = self._run('--unknown Foo\n-i\n--db other Bar\n--db=ID Bar\n')
+        self.assertEqual(1, code)
+        self.assertEqual(['--db=ID Bar\ta.cc:4:0:Bar bar;'], lines)
+        self.assertEqual(3, len(errors.splitlines()))
+
+    def test_reuse_recent_results(self):
+        queries = []
+        query = gj_bulk._query
+        def fake_query(argv):
+            queries.append(argv)
+            return query(argv)
+        gj_bulk._query = fake_query
+        answered_queries = gj_bulk.ANSWERED_QUERIES
+        gj_bulk.ANSWERED_QUERIES = 2
+        try:
+            _, lines, _ = self._run('Foo\nBar\nFoo\n-s ba\nFoo\nBar\n')
+        finally:
+            gj_bulk._query = query
+            gj_bulk.ANSWERED_QUERIES = answered_queries
+        self.assertEqual(10, len(lines))
+        # The result of Bar is dropped after "-s ba" is answered.
+        self.assertEqual([['Foo'], ['Bar'], ['-s', 'ba'], ['Bar']], queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
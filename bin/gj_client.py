@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+gj_client: send a batch query to the server started by "gj --serve".
+
+Run gj instead if no server is running or the server can't answer the query.
+This module is imported at each lookup from the editor, so keep its
+dependencies minimal.
+'''
+
+import json
+import os
+import socket
+import sys
+
+
+__author__ = 'fcamel'
+
+SOCKET_NAME = '.gj.sock'
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def get_socket_path(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), SOCKET_NAME)
+
+def get_db_path(argv):
+    db_path = 'ID'
+    for i, arg in enumerate(argv):
+        if arg == '--db' and i + 1 < len(argv):
+            db_path = argv[i + 1]
+        elif arg.startswith('--db='):
+            db_path = arg[len('--db='):]
+    return db_path
+
+def request(argv):
+    '''
+    Return the response of the server: {'code': int, 'output': str}.
+    Return None if there is no running server or the server can't answer.
+    '''
+    path = get_socket_path(get_db_path(argv))
+    if not os.path.exists(path):
+        return None
+
+    message = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'tty': sys.stdout.isatty(),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode('utf8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(b''.join(chunks).decode('utf8'))
+    except ValueError:
+        return None
+    if response.get('fallback'):
+        return None
+    return response
+
+#------------------------------------------------------------------------------
+# main
+#------------------------------------------------------------------------------
+def main():
+    argv = sys.argv[1:]
+    response = request(argv)
+    if response is None:
+        gj = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gj')
+        os.execv(gj, [gj] + argv)
+
+    sys.stdout.write(response['output'])
+    return response['code']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+The on-disk format of the definition index (gj.index).
+
+The file is saved in the gj_storage format with these sections:
+
+    syms, syms_o  the sorted unique symbols.
+    rec_o         rec_o[i]:rec_o[i + 1] is the range of the records of syms[i].
+    records       (full name id, path id, line) per record, sorted by the full name.
+    strs, strs_o  the string pool of the full names and paths.
+
+A lookup maps the file, finds the symbol with bisect and only decodes the
+matched records. The old pickle format is detected by the magic and still
+readable (see gj_util.find_definition() and "gj_index.py --migrate").
+'''
+
+import os
+from array import array
+
+import gj_storage
+
+
+__author__ = 'fcamel'
+
+MAGIC = b'GJDEFIDX'
+VERSION = 1
+
+_RECORD_WIDTH = 3
+
+_opened_indexes = {}
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def is_compact(filename):
+    return gj_storage.has_magic(filename, MAGIC)
+
+def save(filename, records, extra_sections=()):
+    '''
+    |records| is an iterable of (symbol, full, path, line) sorted by
+    symbol. The records of a symbol are saved in the given order, e.g.,
+    gj_index sorts them by (full, path, line) and gj_source_index by
+    (path, line). It's iterated once.
+    |extra_sections| is a list of (name, data) saved by the other indexes
+    which use this format.
+    '''
+    string_ids = {}
+    strings = []
+    symbols = []
+    record_offsets = array('Q', [0])
+    data = array('I')
+    for symbol, full, path, line in records:
+        if not symbols or symbols[-1] != symbol:
+            if symbols:
+                record_offsets.append(len(data) // _RECORD_WIDTH)
+            symbols.append(symbol)
+        for s in (full, path):
+            # Add the new string to the pool.
+            i = string_ids.setdefault(s, len(strings))
+            if i == len(strings):
+                strings.append(s.encode('utf8'))
+            data.append(i)
+        data.append(line)
+    if symbols:
+        record_offsets.append(len(data) // _RECORD_WIDTH)
+
+    symbol_offsets, symbol_pool = gj_storage.pack_strings([s.encode('utf8') for s in symbols])
+    string_offsets, string_pool = gj_storage.pack_strings(strings)
+    gj_storage.write_sections(filename, MAGIC, VERSION, [
+        ('syms_o', symbol_offsets),
+        ('syms', symbol_pool),
+        ('rec_o', record_offsets),
+        ('records', data),
+        ('strs_o', string_offsets),
+        ('strs', string_pool),
+    ] + list(extra_sections))
+
+def open_index(filename):
+    '''
+    Return the DefinitionIndex of |filename|. The opened index is reused
+    until the file is rewritten.
+    '''
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size, st.st_ino)
+    cached = _opened_indexes.get(path)
+    if cached is None or cached[0] != key:
+        cached = _opened_indexes[path] = (key, DefinitionIndex(path))
+    return cached[1]
+
+
+class DefinitionIndex(object):
+    def __init__(self, filename):
+        self._file = gj_storage.SectionFile(filename, MAGIC)
+        if self._file.version > VERSION:
+            raise gj_storage.FormatError('%s is saved by a newer version of gj.' % filename)
+        self._symbols = self._file.strings('syms')
+        self._record_offsets = self._file.array('rec_o', 'Q')
+        self._records = self._file.array('records', 'I')
+        self._strings = self._file.strings('strs')
+
+    @property
+    def file(self):
+        '''
+        The SectionFile, which has the extra sections passed to save().
+        '''
+        return self._file
+
+    def __len__(self):
+        return len(self._records) // _RECORD_WIDTH
+
+    def find(self, symbol):
+        '''
+        Return [(full, path, line)] of |symbol|.
+        '''
+        i = self._symbols.find(symbol.encode('utf8'))
+        if i < 0:
+            return []
+        return self._records_of(i)
+
+    def records(self):
+        '''
+        Yield all (symbol, full, path, line) in the saved order.
+        '''
+        for i in range(len(self._symbols)):
+            symbol = self._symbols[i].decode('utf8')
+            for full, path, line in self._records_of(i):
+                yield symbol, full, path, line
+
+    def _records_of(self, i):
+        result = []
+        for r in range(self._record_offsets[i], self._record_offsets[i + 1]):
+            full_id, path_id, line = self._records[r * _RECORD_WIDTH:(r + 1) * _RECORD_WIDTH]
+            result.append((self._strings[full_id].decode('utf8'),
+                           self._strings[path_id].decode('utf8'),
+                           line))
+        return result
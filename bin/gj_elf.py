@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+A minimal ELF reader for indexing the definitions of functions.
+
+It maps the file and reads the function symbols in .symtab and the line
+tables in .debug_line (DWARF 2-5) directly, so the output of nm and readelf
+doesn't need to be printed and parsed. Relocations are not applied, so
+the addresses of relocatable object files (*.o) are not meaningful.
+'''
+
+import binascii
+import mmap
+import struct
+import subprocess
+import zlib
+
+
+__author__ = 'fcamel'
+
+# ELF constants.
+_ELFCLASS64 = 2
+_ELFDATA2MSB = 2
+_SHF_EXECINSTR = 0x4
+_SHF_COMPRESSED = 0x800
+_ELFCOMPRESS_ZLIB = 1
+_SHN_UNDEF = 0
+_SHN_XINDEX = 0xffff
+_STB_WEAK = 2
+_STT_OBJECT = 1
+_STT_SECTION = 3
+_STT_FILE = 4
+_STT_GNU_IFUNC = 10
+_NT_GNU_BUILD_ID = 3
+_SKIPPED_TYPES = (_STT_SECTION, _STT_FILE, _STT_GNU_IFUNC)
+
+# DWARF constants.
+_DW_LNS_copy = 1
+_DW_LNS_advance_pc = 2
+_DW_LNS_advance_line = 3
+_DW_LNS_set_file = 4
+_DW_LNS_set_column = 5
+_DW_LNS_const_add_pc = 8
+_DW_LNS_fixed_advance_pc = 9
+_DW_LNE_end_sequence = 1
+_DW_LNE_set_address = 2
+_DW_LNE_define_file = 3
+_DW_LNCT_path = 1
+_DW_LNCT_directory_index = 2
+
+_DW_FORM_block = 0x09
+_DW_FORM_block1 = 0x0a
+_DW_FORM_block2 = 0x03
+_DW_FORM_block4 = 0x04
+_DW_FORM_data1 = 0x0b
+_DW_FORM_data2 = 0x05
+_DW_FORM_data4 = 0x06
+_DW_FORM_data8 = 0x07
+_DW_FORM_data16 = 0x1e
+_DW_FORM_string = 0x08
+_DW_FORM_strp = 0x0e
+_DW_FORM_udata = 0x0f
+_DW_FORM_line_strp = 0x1f
+
+_FIXED_FORM_SIZES = {
+    _DW_FORM_data1: 1,
+    _DW_FORM_data2: 2,
+    _DW_FORM_data4: 4,
+    _DW_FORM_data8: 8,
+    _DW_FORM_data16: 16,
+}
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+class FormatError(Exception):
+    pass
+
+
+def is_elf(filename):
+    try:
+        with open(filename, 'rb') as fr:
+            return fr.read(4) == b'\x7fELF'
+    except (IOError, OSError):
+        return False
+
+def demangle(names):
+    '''
+    Return the demangled |names| like "nm -C". Run c++filt once for all names.
+    Return |names| if c++filt is not available.
+    '''
+    indexes = [i for i, name in enumerate(names) if name.startswith('_Z')]
+    if not indexes:
+        return list(names)
+
+    data = '\n'.join(names[i] for i in indexes) + '\n'
+    try:
+        proc = subprocess.Popen(['c++filt'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    except OSError:
+        return list(names)
+    output = proc.communicate(data.encode('utf8'))[0].decode('utf8', 'replace')
+    lines = output.split('\n')
+    if proc.returncode != 0 or len(lines) < len(indexes):
+        return list(names)
+
+    result = list(names)
+    for i, line in zip(indexes, lines):
+        result[i] = line
+    return result
+
+
+class ElfFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fr:
+            try:
+                self._mmap = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise FormatError('%s is empty.' % filename)
+        if self._mmap[:4] != b'\x7fELF':
+            raise FormatError('%s is not an ELF file.' % filename)
+
+        self._is_64 = self._mmap[4] == _ELFCLASS64
+        self._endian = '>' if self._mmap[5] == _ELFDATA2MSB else '<'
+        self._sections = self._read_section_headers()
+        self._cache = {}
+
+    def has_section(self, name):
+        return name in self._sections
+
+    def build_id(self):
+        '''
+        Return the GNU build-id in hex, or None if there is no build-id.
+        '''
+        if '.note.gnu.build-id' not in self._sections:
+            return None
+        data = self._section_data('.note.gnu.build-id')
+        pos = 0
+        while pos + 12 <= len(data):
+            namesz, descsz, type_ = struct.unpack_from(self._endian + 'III', data, pos)
+            pos += 12
+            name = bytes(data[pos:pos + namesz])
+            pos += _align4(namesz)
+            desc = bytes(data[pos:pos + descsz])
+            pos += _align4(descsz)
+            if type_ == _NT_GNU_BUILD_ID and name == b'GNU\0':
+                return binascii.hexlify(desc).decode('ascii')
+        return None
+
+    def function_symbols(self):
+        '''
+        Return [(name, address)] of the symbols "nm" shows as t, T or W:
+        the symbols defined in the executable sections and the weak symbols
+        which are not objects.
+        '''
+        if '.symtab' not in self._sections:
+            return []
+        symtab = self._sections['.symtab']
+        strtab = self._string_table(symtab['link'])
+        data = self._section_data('.symtab')
+        if self._is_64:
+            entry = struct.Struct(self._endian + 'IBBHQQ')
+        else:
+            entry = struct.Struct(self._endian + 'IIIBBH')
+        executable = set(i for i, s in enumerate(self._section_list)
+                         if s['flags'] & _SHF_EXECINSTR)
+
+        result = []
+        # Skip the first entry, which is always empty.
+        data = data[entry.size:len(data) // entry.size * entry.size]
+        for fields in entry.iter_unpack(data):
+            if self._is_64:
+                name, info, _, shndx, value, _ = fields
+            else:
+                name, value, _, info, _, shndx = fields
+            type_ = info & 0xf
+            if type_ in _SKIPPED_TYPES or name == 0 or shndx == _SHN_UNDEF:
+                continue
+            if info >> 4 == _STB_WEAK:
+                if type_ == _STT_OBJECT:
+                    continue
+            elif shndx not in executable:
+                continue
+            result.append((_read_cstring(strtab, name).decode('utf8', 'replace'), value))
+        return result
+
+    def line_program_offsets(self):
+        '''
+        Return the offsets of the line number programs in .debug_line.
+        Usually there is one program per compilation unit.
+        '''
+        data = self._section_data('.debug_line')
+        result = []
+        offset = 0
+        while offset < len(data):
+            length, header_size = self._read_unit_length(data, offset)
+            version = struct.unpack_from(self._endian + 'H', data, offset + header_size)[0]
+            if version < 2 or version > 5:
+                raise FormatError('%s: DWARF %d is not supported.' % (self.filename, version))
+            result.append(offset)
+            offset += header_size + length
+        return result
+
+    def line_rows(self, offsets=None, addresses=None):
+        '''
+        Yield (address, path, line) of the rows in the line number programs
+        at |offsets| (default: all). The end of the sequences is excluded.
+        Only yield the rows of |addresses| if it's not None.
+        The paths are the same as the ones printed by
+        "readelf --debug-dump=decodedline --wide".
+        '''
+        if offsets is None:
+            offsets = self.line_program_offsets()
+        data = self._section_data('.debug_line')
+        for offset in offsets:
+            for row in self._run_line_program(data, offset, addresses):
+                yield row
+
+    #--------------------------------------------------------------------------
+    # ELF
+    #--------------------------------------------------------------------------
+    def _read_section_headers(self):
+        if self._is_64:
+            shoff = self._unpack('Q', 0x28)
+            shentsize, shnum, shstrndx = struct.unpack_from(self._endian + 'HHH', self._mmap, 0x3a)
+            header = struct.Struct(self._endian + 'IIQQQQIIQQ')
+        else:
+            shoff = self._unpack('I', 0x20)
+            shentsize, shnum, shstrndx = struct.unpack_from(self._endian + 'HHH', self._mmap, 0x2e)
+            header = struct.Struct(self._endian + 'IIIIIIIIII')
+        if shoff == 0:
+            self._section_list = []
+            return {}
+
+        def read_header(i):
+            fields = header.unpack_from(self._mmap, shoff + i * shentsize)
+            return {
+                'name': fields[0],
+                'type': fields[1],
+                'flags': fields[2],
+                'offset': fields[4],
+                'size': fields[5],
+                'link': fields[6],
+            }
+
+        first = read_header(0)
+        if shnum == 0:
+            shnum = first['size']
+        if shstrndx == _SHN_XINDEX:
+            shstrndx = first['link']
+        self._section_list = [read_header(i) for i in range(shnum)]
+
+        names = self._section_list[shstrndx]
+        result = {}
+        for i, section in enumerate(self._section_list):
+            name = _read_cstring(self._mmap, names['offset'] + section['name']).decode('utf8', 'replace')
+            section['index'] = i
+            result.setdefault(name, section)
+        return result
+
+    def _section_data(self, name):
+        section = self._sections.get(name)
+        if section is None:
+            raise FormatError('%s has no %s.' % (self.filename, name))
+        return self._section_data_by_index(section['index'])
+
+    def _section_data_by_index(self, index):
+        data = self._cache.get(index)
+        if data is not None:
+            return data
+
+        section = self._section_list[index]
+        begin = section['offset']
+        data = memoryview(self._mmap)[begin:begin + section['size']]
+        if section['flags'] & _SHF_COMPRESSED:
+            if self._is_64:
+                ch_type, _, ch_size = struct.unpack_from(self._endian + 'IIQ', data, 0)
+                header_size = 24
+            else:
+                ch_type, ch_size = struct.unpack_from(self._endian + 'II', data, 0)
+                header_size = 12
+            if ch_type != _ELFCOMPRESS_ZLIB:
+                raise FormatError('%s: The compression type %d is not supported.'
+                                  % (self.filename, ch_type))
+            data = zlib.decompress(data[header_size:])
+        self._cache[index] = data
+        return data
+
+    def _string_table(self, index):
+        '''
+        Return the section as bytes, which supports find() to read the strings.
+        '''
+        key = ('strings', index)
+        data = self._cache.get(key)
+        if data is None:
+            data = self._cache[key] = bytes(self._section_data_by_index(index))
+        return data
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self._endian + fmt, self._mmap, offset)[0]
+
+    #--------------------------------------------------------------------------
+    # DWARF
+    #--------------------------------------------------------------------------
+    def _read_unit_length(self, data, offset):
+        '''
+        Return (length, the size of the length field).
+        '''
+        length = struct.unpack_from(self._endian + 'I', data, offset)[0]
+        if length == 0xffffffff:
+            return struct.unpack_from(self._endian + 'Q', data, offset + 4)[0], 12
+        return length, 4
+
+    def _run_line_program(self, data, offset, addresses):
+        endian = self._endian
+        length, size = self._read_unit_length(data, offset)
+        offset_size = 8 if size == 12 else 4
+        data = bytes(data[offset:offset + size + length])
+        end = len(data)
+        pos = size
+        version = struct.unpack_from(endian + 'H', data, pos)[0]
+        pos += 2
+        address_size = None
+        if version >= 5:
+            address_size = data[pos]
+            pos += 2  # Skip segment_selector_size.
+        header_length = struct.unpack_from(endian + ('Q' if offset_size == 8 else 'I'), data, pos)[0]
+        pos += offset_size
+        program = pos + header_length
+        min_inst_length = data[pos]
+        pos += 1
+        if version >= 4:
+            pos += 1  # Skip maximum_operations_per_instruction.
+        default_is_stmt, line_base, line_range, opcode_base = struct.unpack_from('BbBB', data, pos)
+        pos += 4
+        opcode_lengths = bytes(data[pos:pos + opcode_base - 1])
+        pos += opcode_base - 1
+
+        if version >= 5:
+            paths = self._read_v5_file_table(data, pos, offset_size)
+        else:
+            paths = _read_v4_file_table(data, pos)
+
+        # Run the state machine. Operation indexes (VLIW) are not supported.
+        code = data[program:end]
+        const_add_pc = min_inst_length * ((255 - opcode_base) // line_range)
+        address = 0
+        file_ = 1
+        line = 1
+        pos = 0
+        n = len(code)
+        while pos < n:
+            op = code[pos]
+            pos += 1
+            if op >= opcode_base:
+                op -= opcode_base
+                address += (op // line_range) * min_inst_length
+                line += line_base + op % line_range
+                if addresses is None or address in addresses:
+                    yield address, paths.get(file_), line
+            elif op == _DW_LNS_set_column:
+                # The most frequent standard opcode. Skip the argument.
+                if code[pos] < 0x80:
+                    pos += 1
+                else:
+                    _, pos = _read_uleb128(code, pos)
+            elif op == 0:
+                size, pos = _read_uleb128(code, pos)
+                next_pos = pos + size
+                sub_op = code[pos]
+                if sub_op == _DW_LNE_end_sequence:
+                    address = 0
+                    file_ = 1
+                    line = 1
+                elif sub_op == _DW_LNE_set_address:
+                    width = address_size or size - 1
+                    address = int.from_bytes(code[pos + 1:pos + 1 + width],
+                                             'big' if endian == '>' else 'little')
+                elif sub_op == _DW_LNE_define_file:
+                    name = _read_cstring(code, pos + 1).decode('utf8', 'replace')
+                    paths[len(paths) + 1] = name
+                pos = next_pos
+            elif op == _DW_LNS_copy:
+                if addresses is None or address in addresses:
+                    yield address, paths.get(file_), line
+            elif op == _DW_LNS_advance_pc:
+                value, pos = _read_uleb128(code, pos)
+                address += value * min_inst_length
+            elif op == _DW_LNS_advance_line:
+                value, pos = _read_sleb128(code, pos)
+                line += value
+            elif op == _DW_LNS_set_file:
+                file_, pos = _read_uleb128(code, pos)
+            elif op == _DW_LNS_const_add_pc:
+                address += const_add_pc
+            elif op == _DW_LNS_fixed_advance_pc:
+                address += struct.unpack_from(endian + 'H', code, pos)[0]
+                pos += 2
+            else:
+                # Skip the arguments of the other standard opcodes.
+                for _ in range(opcode_lengths[op - 1]):
+                    _, pos = _read_uleb128(code, pos)
+
+    def _read_v5_file_table(self, data, pos, offset_size):
+        directories, pos = self._read_v5_entries(data, pos, offset_size)
+        files, pos = self._read_v5_entries(data, pos, offset_size)
+        directories = [d.get(_DW_LNCT_path, '') for d in directories]
+        paths = {}
+        for i, f in enumerate(files):
+            name = f.get(_DW_LNCT_path, '')
+            d = f.get(_DW_LNCT_directory_index, 0)
+            directory = directories[d] if d < len(directories) else ''
+            paths[i] = _join_path(directory, name)
+        return paths
+
+    def _read_v5_entries(self, data, pos, offset_size):
+        n_formats = data[pos]
+        pos += 1
+        formats = []
+        for _ in range(n_formats):
+            content_type, pos = _read_uleb128(data, pos)
+            form, pos = _read_uleb128(data, pos)
+            formats.append((content_type, form))
+        count, pos = _read_uleb128(data, pos)
+
+        entries = []
+        for _ in range(count):
+            entry = {}
+            for content_type, form in formats:
+                value, pos = self._read_form(data, pos, form, offset_size)
+                entry[content_type] = value
+            entries.append(entry)
+        return entries, pos
+
+    def _read_form(self, data, pos, form, offset_size):
+        if form == _DW_FORM_string:
+            value = _read_cstring(data, pos)
+            return value.decode('utf8', 'replace'), pos + len(value) + 1
+        if form in (_DW_FORM_line_strp, _DW_FORM_strp):
+            fmt = self._endian + ('Q' if offset_size == 8 else 'I')
+            offset = struct.unpack_from(fmt, data, pos)[0]
+            name = '.debug_line_str' if form == _DW_FORM_line_strp else '.debug_str'
+            if name not in self._sections:
+                raise FormatError('%s has no %s.' % (self.filename, name))
+            strings = self._string_table(self._sections[name]['index'])
+            return _read_cstring(strings, offset).decode('utf8', 'replace'), pos + offset_size
+        if form == _DW_FORM_udata:
+            return _read_uleb128(data, pos)
+        if form in _FIXED_FORM_SIZES:
+            size = _FIXED_FORM_SIZES[form]
+            if size > 8:
+                return None, pos + size
+            value = int.from_bytes(data[pos:pos + size], 'big' if self._endian == '>' else 'little')
+            return value, pos + size
+        if form == _DW_FORM_block:
+            size, pos = _read_uleb128(data, pos)
+            return None, pos + size
+        if form == _DW_FORM_block1:
+            return None, pos + 1 + data[pos]
+        if form == _DW_FORM_block2:
+            return None, pos + 2 + struct.unpack_from(self._endian + 'H', data, pos)[0]
+        if form == _DW_FORM_block4:
+            return None, pos + 4 + struct.unpack_from(self._endian + 'I', data, pos)[0]
+        raise FormatError('%s: DW_FORM 0x%x is not supported in .debug_line.'
+                          % (self.filename, form))
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _read_v4_file_table(data, pos):
+    directories = ['']
+    while data[pos] != 0:
+        value = _read_cstring(data, pos)
+        directories.append(value.decode('utf8', 'replace'))
+        pos += len(value) + 1
+    pos += 1
+
+    paths = {}
+    while data[pos] != 0:
+        value = _read_cstring(data, pos)
+        name = value.decode('utf8', 'replace')
+        pos += len(value) + 1
+        d, pos = _read_uleb128(data, pos)
+        _, pos = _read_uleb128(data, pos)  # mtime
+        _, pos = _read_uleb128(data, pos)  # length
+        # The index 0 is the compilation directory, which is not in .debug_line.
+        directory = directories[d] if 0 < d < len(directories) else ''
+        paths[len(paths) + 1] = _join_path(directory, name)
+    return paths
+
+def _align4(n):
+    return (n + 3) // 4 * 4
+
+def _join_path(directory, name):
+    if directory and not name.startswith('/'):
+        return directory + '/' + name
+    return name
+
+def _read_cstring(data, pos):
+    '''
+    |data| is bytes or mmap.
+    '''
+    return data[pos:data.find(b'\0', pos)]
+
+def _read_uleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _read_sleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            if b & 0x40:
+                result -= 1 << shift
+            return result, pos
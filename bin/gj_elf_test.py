@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import gj_elf
+import gj_index
+
+
+_SOURCE = '''\
+#include <string>
+#include <vector>
+
+namespace ns {
+struct K {
+  int f(int x) const;
+  template <class T> T g(T t) { return t; }
+};
+
+int K::f(int x) const {
+  return x * 2;
+}
+}  // namespace ns
+
+int main(int argc, char**) {
+  ns::K k;
+  std::vector<std::string> v(argc, "x");
+  return k.f(argc) + k.g(1) + v.size();
+}
+'''
+
+
+def _has_compiler():
+    try:
+        return subprocess.call(['g++', '--version'], stdout=subprocess.PIPE) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(_has_compiler(), 'g++ is required.')
+class ElfFileTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._root = tempfile.mkdtemp(prefix='gj_elf_test_')
+        os.chdir(self._root)
+        with open('main.cc', 'w') as fw:
+            fw.write(_SOURCE)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _compile(self, *flags):
+        subprocess.check_call(['g++', '-g', '-o', 'main', 'main.cc'] + list(flags))
+        return gj_elf.ElfFile('main')
+
+    def _check_same_as_binutils(self, elf_file):
+        symbols = elf_file.function_symbols()
+        names = gj_elf.demangle([name for name, _ in symbols])
+        actual = sorted((name, '0x%x' % address) for name, (_, address) in zip(names, symbols))
+        expected = sorted(gj_index._get_symbols_and_address_in_code_section('main'))
+        self.assertEqual(expected, actual)
+        self.assertTrue('ns::K::f(int) const' in names)
+
+        actual = set(('0x%x' % address, '%s:%d' % (os.path.abspath(path), line))
+                     for address, path, line in elf_file.line_rows())
+        expected = set((address, '%s:%d' % (os.path.abspath(fl.path), fl.line))
+                       for address, fl in gj_index._get_addresses_and_file_lines('main'))
+        # readelf skips the header of the file in some rows, which are skipped
+        # by gj_index._parse_decoded_lines() but not by gj_elf.
+        self.assertTrue(expected)
+        self.assertTrue(expected.issubset(actual))
+
+    def test_dwarf5(self):
+        self._check_same_as_binutils(self._compile('-gdwarf-5'))
+
+    def test_dwarf4(self):
+        self._check_same_as_binutils(self._compile('-gdwarf-4', '-O2'))
+
+    def test_compressed_sections(self):
+        elf_file = self._compile('-gz')
+        self._check_same_as_binutils(elf_file)
+
+    def test_line_program_offsets(self):
+        elf_file = self._compile()
+        offsets = elf_file.line_program_offsets()
+        self.assertEqual(0, offsets[0])
+        rows = []
+        for offset in offsets:
+            rows.extend(elf_file.line_rows([offset]))
+        self.assertEqual(list(elf_file.line_rows()), rows)
+        self.assertTrue(('main.cc', 11) in [(os.path.basename(p), l) for _, p, l in rows])
+
+    def test_not_elf(self):
+        self.assertFalse(gj_elf.is_elf('main.cc'))
+        self.assertRaises(gj_elf.FormatError, gj_elf.ElfFile, 'main.cc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,19 +9,61 @@ except Exception as e:
 
 import sys
 import os
+import hashlib
+import itertools
+import multiprocessing
 import optparse
-import shutil
+import struct
 import subprocess
 import tempfile
+from array import array
 
+import gj_definition_index
+import gj_elf
+import gj_trace
 import gj_util
 
 DEBUG = False
 
+# Read the ELF files in process by gj_elf or by the output of nm and readelf.
+READER_NATIVE = 'native'
+READER_BINUTILS = 'binutils'
+READERS = (READER_NATIVE, READER_BINUTILS)
+
+# The cache of the results of the ELF files is saved in gj.index.cache/.
+CACHE_SUFFIX = '.cache'
+
+_TASKS_PER_JOB = 4
+_CACHE_VERSION = 2
+_LDD_CACHE_FILE = 'ldd'
+# ldd's result also depends on them. ld.so.cache is rebuilt by ldconfig
+# after ld.so.conf or the system's libraries are changed.
+_LDD_ENVIRONMENT_VARIABLES = ('LD_LIBRARY_PATH', 'LD_PRELOAD')
+_LDD_CONFIG_FILES = ('/etc/ld.so.cache', '/etc/ld.so.conf')
+
+# The addresses of the functions in the last ELF file read by this process.
+_function_addresses = {}
+
+def _iter_output_lines(args):
+    '''
+    Yield the lines of the command's stdout as they arrive, so the whole
+    output (e.g., the debug info of a large binary) is never held in memory.
+    '''
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+    try:
+        for line in proc.stdout:
+            yield line.decode('utf8', 'replace').rstrip('\r\n')
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
 def _get_symbols_and_address_in_code_section(binary):
-    proc = subprocess.Popen(['nm', '-C', binary], stdout=subprocess.PIPE)
-    result = []
-    lines = proc.stdout.read().split('\n')
+    with gj_trace.stage('nm') as stage:
+        result = list(_parse_nm_lines(_iter_output_lines(['nm', '-C', binary])))
+        stage.items = len(result)
+    return result
+
+def _parse_nm_lines(lines):
     for line in lines:
         tokens = line.strip().split(' ', 2)
         if len(tokens) == 3 and len(tokens[1]) == 1 and tokens[1] in 'tTwW':
@@ -32,17 +74,20 @@ def _get_symbols_and_address_in_code_section(binary):
                     break
             # Match the address format of objdump.
             address = '0x' + address[i:]
-            result.append((symbol, address))
-    return result
+            yield symbol, address
 
 def _get_addresses_and_file_lines(binary, addresses=None):
     # objdump (2.24 and 2.28) has a bug that "--wide" doesn't work because it never sets the flag "do_wide".
     # On the other hand, "readelf --wide" works.
     # Reference: binutils/dwarf.c display_debug_lines_decoded() and "const unsigned int MAX_FILENAME_LENGTH = 35;"
-    #proc = subprocess.Popen(['objdump', '--dwarf=decodedline', '--wide', binary], stdout=subprocess.PIPE)
-    proc = subprocess.Popen(['readelf', '--debug-dump=decodedline', '--wide', binary], stdout=subprocess.PIPE)
-    result = []
-    lines = proc.stdout.read().split('\n')
+    #args = ['objdump', '--dwarf=decodedline', '--wide', binary]
+    args = ['readelf', '--debug-dump=decodedline', '--wide', binary]
+    return _parse_decoded_lines(_iter_output_lines(args), addresses)
+
+def _parse_decoded_lines(lines, addresses=None):
+    '''
+    Yield (address, FileLine) in the output of "readelf --debug-dump=decodedline".
+    '''
     cu_path = cu_filename = path = filename = None
     for line in lines:
         if len(line) > 0 and line[-1] == ':':
@@ -60,15 +105,18 @@ def _get_addresses_and_file_lines(binary, addresses=None):
                 cu_filename = filename
             continue
 
+        # Newer readelf appends the columns "View" and "Stmt".
         tokens = line.split()
-        if len(tokens) != 3:
+        if len(tokens) < 3 or not tokens[2].startswith('0x'):
             continue
 
-        target_filename, line, address = tokens
-        line = int(line)
+        target_filename, line, address = tokens[:3]
         # We'll end up OOM if there are too many addresses. Only keep the necessary addresses.
         if addresses is not None and address not in addresses:
             continue
+        if not line.isdigit():
+            continue
+        line = int(line)
         if target_filename != filename:
             if target_filename == cu_filename:
                 path = cu_path
@@ -78,9 +126,7 @@ def _get_addresses_and_file_lines(binary, addresses=None):
                      % (target_filename, cu_path, path))
                 continue
 
-        result.append((address, gj_util.FileLine(path, line)))
-
-    return result
+        yield address, gj_util.FileLine(path, line)
 
 def _remove_nested_parenthesis(string, left, right, keep_top):
     valid_tokens = []
@@ -135,12 +181,121 @@ def _get_symbol(full_symbol):
     target = ts[-2] if len(ts) > 2 else ts[0]
     return target.split('::')[-1]
 
-def _update_index(binary, path_substituion, mapping):
+def _make_tasks(elves, reader, jobs):
+    '''
+    Return the tasks (binary, offsets, with_symbols) of _read_elf().
+    For the native reader, the compilation units of a binary are split into
+    several tasks, so a large binary is read by several processes.
+    offsets is None to read the binary by binutils.
+    '''
+    tasks = []
+    for elf in elves:
+        chunks = None
+        if reader == READER_NATIVE:
+            chunks = _split_line_programs(elf, jobs)
+        if chunks is None:
+            tasks.append((elf, None, True))
+            continue
+        for i, offsets in enumerate(chunks):
+            tasks.append((elf, offsets, i == 0))
+    return tasks
+
+def _split_line_programs(binary, jobs):
+    try:
+        elf_file = gj_elf.ElfFile(binary)
+        if not elf_file.has_section('.debug_line'):
+            # E.g., the debug info is in a separate file. Let readelf find it.
+            return None
+        offsets = elf_file.line_program_offsets()
+    except (gj_elf.FormatError, struct.error) as e:
+        sys.stderr.write('Warning: Read %s by binutils: %s\n' % (binary, e))
+        return None
+
+    n = _TASKS_PER_JOB * jobs if jobs > 1 else 1
+    size = max(1, (len(offsets) + n - 1) // n)
+    return [offsets[i:i + size] for i in range(0, len(offsets), size)] or [[]]
+
+def _read_elf(task):
+    '''
+    Return (symbols_and_addresses, addresses_and_filelines) of a task made by
+    _make_tasks(). symbols_and_addresses is None if the other task of the same
+    binary returns them. This is run in the worker processes.
+    '''
+    binary, offsets, with_symbols = task
+    if offsets is None:
+        symbols_and_addresses = _get_symbols_and_address_in_code_section(binary)
+        addresses = set(a for _, a in symbols_and_addresses)
+        with gj_trace.stage('readelf') as stage:
+            addresses_and_filelines = list(_get_addresses_and_file_lines(binary, addresses))
+            stage.items = len(addresses_and_filelines)
+        return symbols_and_addresses, addresses_and_filelines
+
+    elf_file = gj_elf.ElfFile(binary)
+    symbols = symbols_and_addresses = None
+    if with_symbols:
+        with gj_trace.stage('symtab') as stage:
+            symbols = elf_file.function_symbols()
+            stage.items = len(symbols)
+        with gj_trace.stage('demangle'):
+            names = gj_elf.demangle([name for name, _ in symbols])
+        symbols_and_addresses = [(name, '0x%x' % address)
+                                 for name, (_, address) in zip(names, symbols)]
+
+    # Keep the last row of each address as _to_symbol_infos() does,
+    # so less data is sent back to the main process.
+    rows = {}
+    line_rows = elf_file.line_rows(offsets, _get_function_addresses(elf_file, symbols))
+    for address, path, line in gj_trace.iterate('line_rows', line_rows):
+        if path is not None:
+            rows[address] = (path, line)
+
+    normalized_paths = {}
+    addresses_and_filelines = []
+    for address, (path, line) in rows.items():
+        normalized = normalized_paths.get(path)
+        if normalized is None:
+            normalized = path
+            if path.startswith('/'):
+                normalized = os.path.abspath(path)  # The same as _parse_decoded_lines().
+            normalized_paths[path] = normalized
+        addresses_and_filelines.append(('0x%x' % address, gj_util.FileLine(normalized, line)))
+    return symbols_and_addresses, addresses_and_filelines
+
+def _get_function_addresses(elf_file, symbols=None):
+    '''
+    Return the addresses of the functions. Reuse the result for the other
+    tasks of the same file run in this process. |symbols| is the result of
+    elf_file.function_symbols() if it's already read.
+    '''
+    st = os.stat(elf_file.filename)
+    key = (os.path.abspath(elf_file.filename), st.st_mtime, st.st_size)
+    addresses = _function_addresses.get(key)
+    if addresses is None:
+        if symbols is None:
+            symbols = elf_file.function_symbols()
+        addresses = set(address for _, address in symbols)
+        _function_addresses.clear()
+        _function_addresses[key] = addresses
+    return addresses
+
+def _collect_results(group):
+    '''
+    Return (symbols_and_addresses, addresses_and_filelines) of one ELF
+    from the results of its tasks.
+    '''
+    symbols_and_addresses = []
+    addresses_and_filelines = []
+    for _, (symbols, filelines) in group:
+        if symbols is not None:
+            symbols_and_addresses = symbols
+        addresses_and_filelines.extend(filelines)
+    return symbols_and_addresses, addresses_and_filelines
+
+def _to_symbol_infos(symbols_and_addresses, addresses_and_filelines, path_substituion):
+    '''
+    Return the SymbolInfo of the functions defined in one ELF.
+    '''
     path_from, path_to = path_substituion
-    # Load the debug info.
-    symbols_and_addresses = _get_symbols_and_address_in_code_section(binary)
-    addresses = set(a for _, a in symbols_and_addresses)
-    addresses_and_filelines = _get_addresses_and_file_lines(binary, addresses)
     addresses_to_filelines = {}
     for addr, fl in addresses_and_filelines:
         if path_from is not None and fl.path.startswith(path_from):
@@ -150,6 +305,8 @@ def _update_index(binary, path_substituion, mapping):
     # Map the debug info. Note that this is much faster than using "nm -l".
     # In my test case (167M binary with 250,000+ symbols),
     # "nm -l -C" hasn't finished after several minutes, while this approach takes <10s.
+    get_symbol = gj_trace.wrap('get_symbol', _get_symbol)
+    infos = []
     for full_symbol, address in symbols_and_addresses:
         if full_symbol.startswith('non-virtual thunk'):
             continue
@@ -157,107 +314,352 @@ def _update_index(binary, path_substituion, mapping):
         fl = addresses_to_filelines.get(address, None)
         if fl is None:
             continue
-        symbol = _get_symbol(full_symbol)
-        info = gj_util.SymbolInfo(symbol, full_symbol, fl)
-        data = mapping.get(symbol, None)
-        if data is None:
-            # First time.
-            mapping[symbol] = info
-            continue
-
-        if type(data) is gj_util.SymbolInfo:
-            # Second time.
-            mapping[symbol] = set((data,))
+        symbol = get_symbol(full_symbol)
+        infos.append(gj_util.SymbolInfo(symbol, full_symbol, fl))
+    return infos
 
-        mapping[symbol].add(info)
+class _Collector(object):
+    '''
+    Collect the records (symbol, full, path, line) of the ELF files.
 
-def _find_shared_libraries(binary, shared_lib_sub_path):
-    if not shared_lib_sub_path:
-        return []
+    There may be hundreds of thousands of symbols. Keep each string once in
+    a pool and each record as four integers in an array, instead of one
+    SymbolInfo and one FileLine per record. The same record read from
+    several ELF files (e.g., the inline functions in the headers) is only
+    saved once.
+    '''
+    _WIDTH = 4
+
+    def __init__(self):
+        self._string_ids = {}
+        self._strings = []
+        # (symbol id, full id, path id, line) per record.
+        self._records = array('I')
+
+    def __len__(self):
+        return len(self._records) // self._WIDTH
+
+    def add_infos(self, infos):
+        string_ids = self._string_ids
+        strings = self._strings
+        records = self._records
+        for info in infos:
+            for s in (info.symbol, info.full, info.fileline.path):
+                # Add the new string to the pool.
+                i = string_ids.setdefault(s, len(strings))
+                if i == len(strings):
+                    strings.append(s)
+                records.append(i)
+            records.append(info.fileline.line)
+
+    def iter_records(self):
+        '''
+        Yield the unique records sorted by (symbol, full, path, line). No
+        record can be added after calling it.
+        '''
+        # Free the memory for saving.
+        self._string_ids = None
+        strings = self._strings
+        records = self._records
+        # Compare the records by the ranks of their strings, which is one
+        # integer per record instead of a tuple of the strings.
+        ranks = array('I', [0]) * len(strings)
+        for rank, string_id in enumerate(sorted(range(len(strings)), key=strings.__getitem__)):
+            ranks[string_id] = rank
+        n = len(strings)
+        def get_key(i):
+            i *= self._WIDTH
+            key = (ranks[records[i]] * n + ranks[records[i + 1]]) * n + ranks[records[i + 2]]
+            return (key << 32) | records[i + 3]
+
+        previous = None
+        for i in sorted(range(len(self)), key=get_key):
+            record = records[i * self._WIDTH:(i + 1) * self._WIDTH]
+            if record == previous:
+                continue
+            previous = record
+            yield strings[record[0]], strings[record[1]], strings[record[2]], record[3]
 
+def _list_elf_files(binaries, cache=None):
+    '''
+    Return the binaries and their shared libraries in order. A shared library
+    used by several binaries is listed once.
+    '''
     result = []
-    proc = subprocess.Popen(['ldd', binary], stdout=subprocess.PIPE)
-    lines = proc.stdout.read().split('\n')
-    for line in lines:
-        # Example: "libcc.so => /path/to/libcc.so (0x00007fa842a83000)"
-        if ' => ' not in line:
-            continue
-
-        shared_lib_path = line.strip().split()[2]
-        if shared_lib_sub_path in shared_lib_path:
-            result.append(shared_lib_path)
+    seen = set()
+    for binary, shared_lib_sub_path in binaries:
+        for path in [binary] + _find_shared_libraries(binary, shared_lib_sub_path, cache):
+            key = os.path.realpath(path)
+            if key not in seen:
+                seen.add(key)
+                result.append(path)
     return result
 
-def _save(mapping, filename):
-    infos = []
-    for symbol in mapping:
-        data = mapping[symbol]
-        if type(data) is gj_util.SymbolInfo:
-            infos.append(data)
-            continue
+def _map(func, items, jobs):
+    '''
+    Yield func(item) of each item in order. Run in |jobs| processes
+    (default: #CPUs) if there are more than one item.
+    '''
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # imap() keeps the order, so merging the results is deterministic.
+        for result in pool.imap(func, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
 
-        for info in data:
-            infos.append(info)
+def _find_shared_libraries(binary, shared_lib_sub_path, cache=None):
+    if not shared_lib_sub_path:
+        return []
+
+    paths = cache.get_shared_libraries(binary) if cache else None
+    if paths is None:
+        paths = []
+        for line in _iter_output_lines(['ldd', binary]):
+            # Example: "libcc.so => /path/to/libcc.so (0x00007fa842a83000)"
+            if ' => ' not in line:
+                continue
+            paths.append(line.strip().split()[2])
+        if cache:
+            cache.set_shared_libraries(binary, paths)
+    return [path for path in paths if shared_lib_sub_path in path]
 
-    infos.sort(key=gj_util.SymbolInfo.sort_key)
 
+class _ElfCache(object):
+    '''
+    The results of _read_elf() and ldd of each ELF file, saved in the
+    directory |dirpath|. The results are identified by the GNU build-id,
+    or by the path, mtime and size if there is no build-id. The results of
+    ldd are also identified by the environment and the configurations of
+    the dynamic linker, and are dropped once any listed library changes.
+    Only the results used in the last run are kept.
+    '''
+    def __init__(self, dirpath, reader):
+        self._dirpath = dirpath
+        self._reader = reader
+        self._used = set()
+        self._shared_libraries = self._load(_LDD_CACHE_FILE) or {}
+        self._used_shared_libraries = {}
+
+    def get_shared_libraries(self, binary):
+        key = self._get_ldd_key(binary)
+        data = self._shared_libraries.get(key)
+        if data is None:
+            return None
+        paths, stats = data
+        if [_stat(path) for path in paths] != stats:
+            return None
+        self._used_shared_libraries[key] = data
+        return paths
+
+    def set_shared_libraries(self, binary, paths):
+        key = self._get_ldd_key(binary)
+        if key is not None:
+            self._used_shared_libraries[key] = (paths, [_stat(path) for path in paths])
+
+    def load(self, binary):
+        '''
+        Return (symbols_and_addresses, addresses_and_filelines) of |binary|
+        or None if it's not cached.
+        '''
+        key = self._get_key(binary)
+        data = self._load(key) if key else None
+        if data is None:
+            return None
+        self._used.add(key)
+        symbols_and_addresses, rows = data
+        return symbols_and_addresses, [(a, gj_util.FileLine(p, l)) for a, p, l in rows]
+
+    def save(self, binary, symbols_and_addresses, addresses_and_filelines):
+        key = self._get_key(binary)
+        if key is None:
+            return
+        rows = [(a, fl.path, fl.line) for a, fl in addresses_and_filelines]
+        self._save(key, (symbols_and_addresses, rows))
+        self._used.add(key)
+
+    def flush(self):
+        '''
+        Save the results of ldd and remove the results not used in this run.
+        '''
+        self._save(_LDD_CACHE_FILE, self._used_shared_libraries)
+        for filename in os.listdir(self._dirpath):
+            if filename != _LDD_CACHE_FILE and filename not in self._used:
+                os.unlink(os.path.join(self._dirpath, filename))
+
+    def _get_key(self, binary):
+        try:
+            build_id = gj_elf.ElfFile(binary).build_id()
+        except (gj_elf.FormatError, struct.error, IOError, OSError):
+            build_id = None
+        if build_id:
+            return '%s-%s' % (self._reader, build_id)
+
+        key = self._get_stat_key(binary)
+        if key is None:
+            return None
+        digest = hashlib.sha1(repr(key).encode('utf8')).hexdigest()
+        return '%s-%s' % (self._reader, digest)
+
+    def _get_stat_key(self, binary):
+        st = _stat(binary)
+        if st is None:
+            return None
+        return (os.path.realpath(binary),) + st
+
+    def _get_ldd_key(self, binary):
+        key = self._get_stat_key(binary)
+        if key is None:
+            return None
+        return (key,
+                tuple(os.environ.get(name) for name in _LDD_ENVIRONMENT_VARIABLES),
+                tuple(_stat(path) for path in _LDD_CONFIG_FILES))
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self._dirpath, key), 'rb') as fr:
+                version, data = pickle.load(fr)
+        except Exception:
+            # Missing or broken.
+            return None
+        return data if version == _CACHE_VERSION else None
+
+    def _save(self, key, data):
+        if not os.path.isdir(self._dirpath):
+            os.makedirs(self._dirpath)
+        fd, tmp_path = tempfile.mkstemp(prefix='.gj_', dir=self._dirpath)
+        with os.fdopen(fd, 'wb') as fw:
+            pickle.dump((_CACHE_VERSION, data), fw, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, os.path.join(self._dirpath, key))
+
+
+def _stat(path):
+    '''
+    Return (mtime, size) of |path|, or None if it doesn't exist.
+    '''
     try:
-        # The mapping may be very large (e.g., 300MB) and loading the whole file is slow.
-        # Build the index, so we can only load necessary parts when searching.
-        dirpath = tempfile.mkdtemp(prefix='gj_index_')
-        info_index = []
-        block_size = 1000
-        n_filename = 0
-        byte_offset = 0
-        for i in range(0, len(infos), block_size):
-            n_filename += 1
-            path = os.path.join(dirpath, str(n_filename))
-            with open(path, 'wb') as fw:
-                pickle.dump(infos[i : i + block_size], fw)
-            info_index.append((infos[i].symbol, byte_offset))
-            byte_offset += os.stat(path).st_size
-
-        with open(gj_util.DEFINITION_INDEX_FILE, 'wb') as fw:
-            # Write the index first. Then write the data.
-            pickle.dump(info_index, fw)
-
-            # Write the info blocks in order.
-            for i in range(1, n_filename + 1):
-                path = os.path.join(dirpath, str(i))
-                with open(path, 'rb') as fr:
-                    fw.write(fr.read())
-    finally:
-        shutil.rmtree(dirpath)
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def _save(collector, filename):
+    # The records also are sorted by the locations, so the result doesn't
+    # depend on the order the binaries are indexed.
+    # The index may be very large (e.g., 300MB) and loading the whole file is slow.
+    # Save it in a format which can be searched without loading the whole file.
+    gj_definition_index.save(filename, collector.iter_records())
+
+def _save_infos(infos, filename):
+    collector = _Collector()
+    collector.add_infos(infos)
+    _save(collector, filename)
+
+def _load_pickle(filename):
+    '''
+    Return the SymbolInfo saved in the old pickle format.
+    '''
+    infos = []
+    with open(filename, 'rb') as fr:
+        # Skip the index of blocks. The blocks are saved in order.
+        pickle.load(fr)
+        while True:
+            try:
+                infos.extend(pickle.load(fr))
+            except EOFError:
+                break
+    return infos
+
+def migrate(filename):
+    '''
+    Convert the index saved in the old pickle format to the current format.
+    '''
+    if gj_definition_index.is_compact(filename):
+        print('%s is already in the current format.' % filename)
+        return True
 
-def index_elf_binaries(binaries, substitution):
+    infos = _load_pickle(filename)
+    _save_infos(infos, filename)
+    print('Convert %s (%d symbols).' % (filename, len(infos)))
+    return True
+
+def index_elf_binaries(binaries, substitution, jobs=None, reader=READER_NATIVE, use_cache=True):
+    '''
+    Index the binaries and their shared libraries in |jobs| processes
+    (default: #CPUs) and save the result to gj.index. |reader| is one of READERS.
+    If |use_cache| is True, only read the ELF files changed since the last run.
+    '''
     for value in binaries:
-        print(value, len(value))
         if len(value) != 2:
             print('Format error: expect each value in "binaries"'
                   ' is like ("out/debug/myprog", "out/debug")'
                   ' or ("out/debug/myprog", "")')
             return False
 
-    mapping = {}
-    for binary, shared_lib_sub_path in binaries:
-        print('Index [%s] ...' % binary)
-        _update_index(binary, substitution, mapping)
-        for shared_lib in _find_shared_libraries(binary, shared_lib_sub_path):
-            print('> Index shared library [%s] ...' % shared_lib)
-            _update_index(shared_lib, substitution, mapping)
-
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    cache = None
+    if use_cache:
+        cache = _ElfCache(gj_util.DEFINITION_INDEX_FILE + CACHE_SUFFIX, reader)
+    with gj_trace.stage('list_elf_files') as stage:
+        elves = _list_elf_files(binaries, cache)
+        stage.items = len(elves)
+
+    cached_results = {}
+    if cache:
+        with gj_trace.stage('cache_load'):
+            for elf in elves:
+                result = cache.load(elf)
+                if result is not None:
+                    cached_results[elf] = result
+    tasks = _make_tasks([elf for elf in elves if elf not in cached_results], reader, jobs)
+    # The tasks of the same binary are consecutive.
+    read_results = gj_trace.iterate('read_elf', _map(_read_elf, tasks, jobs))
+    results = itertools.groupby(zip(tasks, read_results), key=lambda result: result[0][0])
+
+    collector = _Collector()
+    for elf in elves:
+        result = cached_results.get(elf)
+        status = 'cached'
+        if result is None:
+            _, group = next(results)
+            result = _collect_results(group)
+            status = 'read'
+            if cache:
+                with gj_trace.stage('cache_save'):
+                    cache.save(elf, *result)
+        with gj_trace.stage('to_symbol_infos') as stage:
+            infos = _to_symbol_infos(result[0], result[1], substitution)
+            stage.items = len(infos)
+        print('Index [%s] (%d symbols, %s) ...' % (elf, len(infos), status))
+        with gj_trace.stage('merge'):
+            collector.add_infos(infos)
+        del infos
+    if cache:
+        cache.flush()
 
     if DEBUG:
         print('-' * 80)
         print('DEBUG: (Begin) Dump the result.')
         print('-' * 80)
-        for symbol in mapping:
-            print(mapping[symbol])
+        for record in collector.iter_records():
+            print(record)
         print('-' * 80)
         print('DEBUG: (End  ) Dump the result.')
         print('-' * 80)
 
-    _save(mapping, gj_util.DEFINITION_INDEX_FILE)
+    with gj_trace.stage('save') as stage:
+        stage.items = len(collector)
+        _save(collector, gj_util.DEFINITION_INDEX_FILE)
 
     print('Save the index to %s' % gj_util.DEFINITION_INDEX_FILE)
 
@@ -279,7 +681,27 @@ def main():
                       type='string', default='',
                       help=('Given FROM=TO and substitue the prefix FROM in the path to TO.'
                             'For example, "../../=" removes the prefix "../../"'))
+    parser.add_option('-m', '--migrate', dest='migrate',
+                      action='store_true', default=False,
+                      help='Convert %s saved by the old version to the current format.'
+                           % gj_util.DEFINITION_INDEX_FILE)
+    parser.add_option('-j', '--jobs', dest='jobs',
+                      type=int, default=None,
+                      help='The number of processes to index the binaries (default: #CPUs).')
+    parser.add_option('-r', '--reader', dest='reader',
+                      type='choice', choices=READERS, default=READER_NATIVE,
+                      help=('How to read the symbols and the line tables: %s (default: %%default).'
+                            ' "binutils" runs nm and readelf.' % ', '.join(READERS)))
+    parser.add_option('--no-cache', dest='use_cache',
+                      action='store_false', default=True,
+                      help=('Read all ELF files again instead of reusing the results'
+                            ' in %s%s.' % (gj_util.DEFINITION_INDEX_FILE, CACHE_SUFFIX)))
+    gj_trace.add_options(parser)
     options, args = parser.parse_args()
+    gj_trace.start(options.profile, options.profile_output)
+
+    if options.migrate:
+        return 0 if migrate(gj_util.DEFINITION_INDEX_FILE) else 1
 
     if len(args) < 1:
         parser.print_help()
@@ -290,7 +712,10 @@ def main():
     if options.substitution:
          path_substitution = options.substitution.split('=')
 
-    index_elf_binaries(args, path_substitution)
+    # The shared libraries are not searched for the binaries given in the command line.
+    binaries = [(binary, '') for binary in args]
+    index_elf_binaries(binaries, path_substitution, options.jobs, options.reader,
+                       options.use_cache)
 
     return 0
 
@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 # -*- encoding: utf8 -*-
 
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
 import unittest
+
+import gj_definition_index
 import gj_index
+import gj_util
 
 class TestGetSymbol(unittest.TestCase):
     def test_get_symbol(self):
@@ -53,6 +61,277 @@ class TestGetSymbol(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class TestParseOutput(unittest.TestCase):
+    def test_parse_nm_lines(self):
+        lines = [
+            '0000000000401000 T main',
+            '0000000000401020 t A::B(int)',
+            '0000000000402000 W C<int>::D()',
+            '0000000000601000 D data',
+            '                 U puts',
+        ]
+        expected = [
+            ('main', '0x401000'),
+            ('A::B(int)', '0x401020'),
+            ('C<int>::D()', '0x402000'),
+        ]
+        self.assertEqual(expected, list(gj_index._parse_nm_lines(lines)))
+
+    def test_parse_decoded_lines(self):
+        lines = iter([
+            'Contents of the .debug_line section:',
+            '',
+            'CU: ./a.cc:',
+            'File name                            Line number    Starting address',
+            'a.cc                                           3            0x401000',
+            'a.cc                                           4            0x401008',
+            '',
+            '/usr/include/b.h:',
+            'b.h                                           10            0x401010',
+            'a.cc                                           5            0x401018',
+            'c.h                                            1            0x401020',
+        ])
+        actual = [(a, str(fl)) for a, fl in gj_index._parse_decoded_lines(lines)]
+        expected = [
+            ('0x401000', './a.cc:3'),
+            ('0x401008', './a.cc:4'),
+            ('0x401010', '/usr/include/b.h:10'),
+            ('0x401018', './a.cc:5'),
+        ]
+        self.assertEqual(expected, actual)
+
+        lines = ['CU: ./a.cc:', 'a.cc 3 0x401000', 'a.cc 4 0x401008']
+        actual = [(a, str(fl)) for a, fl in gj_index._parse_decoded_lines(lines, set(['0x401008']))]
+        self.assertEqual([('0x401008', './a.cc:4')], actual)
+
+        lines = ['CU: ./a.cc:',
+                 'File name                            Line number    Starting address    View    Stmt',
+                 'a.cc                                           3            0x401000               x',
+                 'a.cc                                           4            0x401008       1       x',
+                 'a.cc                                           -            0x401010']
+        actual = [(a, str(fl)) for a, fl in gj_index._parse_decoded_lines(lines)]
+        self.assertEqual([('0x401000', './a.cc:3'), ('0x401008', './a.cc:4')], actual)
+
+
+class TestDefinitionIndex(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._root = tempfile.mkdtemp(prefix='gj_index_test_')
+        os.chdir(self._root)
+
+        self._mapping = {}
+        for i in range(50):
+            symbol = 'f%02d' % i
+            self._add(symbol, 'A::%s()' % symbol, 'a.cc', i + 1)
+        self._add('f10', 'B::f10(int)', 'b.cc', 3)
+        self._add('f10', 'B::f10(char)', 'b.cc', 5)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _add(self, symbol, full, path, line):
+        info = gj_util.SymbolInfo(symbol, full, gj_util.FileLine(path, line))
+        self._mapping.setdefault(symbol, set()).add(info)
+
+    def _save_pickle(self, filename, block_size):
+        # The old format: [(symbol, offset)] and then the blocks of SymbolInfo.
+        infos = sorted((i for s in self._mapping.values() for i in s),
+                       key=gj_util.SymbolInfo.sort_key)
+        info_index = []
+        blocks = []
+        offset = 0
+        for i in range(0, len(infos), block_size):
+            block = pickle.dumps(infos[i:i + block_size])
+            info_index.append((infos[i].symbol, offset))
+            offset += len(block)
+            blocks.append(block)
+        with open(filename, 'wb') as fw:
+            pickle.dump(info_index, fw)
+            for block in blocks:
+                fw.write(block)
+
+    def _find(self, symbol):
+        return [str(m) for m in gj_util.find_definition(symbol)]
+
+    def test_find_definition(self):
+        infos = [info for infos in self._mapping.values() for info in infos]
+        gj_index._save_infos(infos, gj_util.DEFINITION_INDEX_FILE)
+        self.assertTrue(gj_definition_index.is_compact(gj_util.DEFINITION_INDEX_FILE))
+
+        self.assertEqual(['a.cc:1:3:A::f00()'], self._find('f00'))
+        self.assertEqual(['a.cc:11:3:A::f10()', 'b.cc:3:3:B::f10(int)', 'b.cc:5:3:B::f10(char)'],
+                         self._find('f10'))
+        self.assertEqual(['a.cc:50:3:A::f49()'], self._find('f49'))
+        self.assertEqual([], self._find('f5'))
+        self.assertEqual([], self._find('g'))
+
+    def test_collector(self):
+        collector = gj_index._Collector()
+        collector.add_infos(self._mapping['f10'])
+        # The same records read from another ELF file.
+        collector.add_infos(self._mapping['f10'])
+        collector.add_infos(self._mapping['f00'])
+        self.assertEqual(7, len(collector))
+        self.assertEqual([
+            ('f00', 'A::f00()', 'a.cc', 1),
+            ('f10', 'A::f10()', 'a.cc', 11),
+            ('f10', 'B::f10(char)', 'b.cc', 5),
+            ('f10', 'B::f10(int)', 'b.cc', 3),
+        ], list(collector.iter_records()))
+
+    def test_unpickle_old_objects(self):
+        # The objects pickled before __slots__ is used keep the states in dicts.
+        info = gj_util.SymbolInfo.__new__(gj_util.SymbolInfo)
+        fileline = gj_util.FileLine.__new__(gj_util.FileLine)
+        fileline.__setstate__({'path': 'a.cc', 'line': 3})
+        info.__setstate__({'symbol': 'f', 'full': 'A::f()', 'fileline': fileline})
+        expected = gj_util.SymbolInfo('f', 'A::f()', gj_util.FileLine('a.cc', 3))
+        self.assertEqual(expected, info)
+        self.assertEqual(expected, pickle.loads(pickle.dumps(expected)))
+
+    def test_migrate(self):
+        self._save_pickle(gj_util.DEFINITION_INDEX_FILE, block_size=7)
+        self.assertFalse(gj_definition_index.is_compact(gj_util.DEFINITION_INDEX_FILE))
+        expected = [self._find(s) for s in ('f00', 'f10', 'f49')]
+
+        gj_index.migrate(gj_util.DEFINITION_INDEX_FILE)
+        self.assertTrue(gj_definition_index.is_compact(gj_util.DEFINITION_INDEX_FILE))
+        actual = [self._find(s) for s in ('f00', 'f10', 'f49')]
+        self.assertEqual(expected, actual)
+
+
+def _has_compiler():
+    try:
+        return subprocess.call(['gcc', '--version'], stdout=subprocess.PIPE) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(_has_compiler(), 'gcc is required.')
+class TestIndexElfBinaries(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._root = os.path.realpath(tempfile.mkdtemp(prefix='gj_index_test_'))
+        os.chdir(self._root)
+
+        os.mkdir('lib')
+        self._write('lib/common.c', 'int common_func(int x) {\n  return x + 1;\n}\n')
+        self._compile('-shared', '-fPIC', '-o', 'lib/libcommon.so', 'lib/common.c')
+        for name in ('a', 'b'):
+            self._write('%s.c' % name, ('int common_func(int x);\n'
+                                        'int %s_func(void) {\n'
+                                        '  return common_func(1);\n'
+                                        '}\n'
+                                        'int main(void) {\n'
+                                        '  return %s_func();\n'
+                                        '}\n' % (name, name)))
+            self._compile('-o', name, '%s.c' % name, '-Llib', '-lcommon',
+                          '-Wl,-rpath,%s' % os.path.abspath('lib'))
+        lib_path = os.path.abspath('lib') + '/'
+        self._binaries = [('a', lib_path), ('b', lib_path)]
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        with open(path, 'w') as fw:
+            fw.write(content)
+
+    def _compile(self, *args):
+        subprocess.check_call(['gcc', '-g', '-O0'] + list(args))
+
+    def _load(self):
+        with open(gj_util.DEFINITION_INDEX_FILE, 'rb') as fr:
+            return fr.read()
+
+    def test_list_elf_files(self):
+        elves = gj_index._list_elf_files(self._binaries)
+        self.assertEqual(3, len(elves))
+        self.assertEqual('a', elves[0])
+        self.assertTrue(elves[1].endswith('libcommon.so'))
+        self.assertEqual('b', elves[2])
+
+    def test_parallel_index(self):
+        # Some versions of gcc save the absolute paths.
+        substitution = [self._root + '/', '']
+        self.assertTrue(gj_index.index_elf_binaries(self._binaries, substitution, jobs=1))
+        serial = self._load()
+        self.assertEqual(['lib/common.c:1:0:common_func'],
+                         [str(m) for m in gj_util.find_definition('common_func')])
+        self.assertEqual(['a.c:2:0:a_func'], [str(m) for m in gj_util.find_definition('a_func')])
+
+        self.assertTrue(gj_index.index_elf_binaries(list(reversed(self._binaries)),
+                                                    substitution, jobs=3))
+        self.assertEqual(serial, self._load())
+
+    def test_cache(self):
+        substitution = [self._root + '/', '']
+        read = []
+        commands = []
+        original_read_elf = gj_index._read_elf
+        original_iter_output_lines = gj_index._iter_output_lines
+        def read_elf(task):
+            read.append(os.path.basename(task[0]))
+            return original_read_elf(task)
+        def iter_output_lines(args):
+            commands.append(args[0])
+            return original_iter_output_lines(args)
+        gj_index._read_elf = read_elf
+        gj_index._iter_output_lines = iter_output_lines
+        ld_library_path = os.environ.get('LD_LIBRARY_PATH')
+        try:
+            gj_index.index_elf_binaries(self._binaries, substitution, jobs=1)
+            self.assertEqual(['a', 'libcommon.so', 'b'], read)
+            self.assertEqual(['ldd', 'ldd'], commands)
+            expected = self._load()
+
+            del read[:]
+            del commands[:]
+            gj_index.index_elf_binaries(self._binaries, substitution, jobs=1)
+            self.assertEqual([], read)
+            self.assertEqual([], commands)
+            self.assertEqual(expected, self._load())
+
+            # Only read the changed one. ldd runs again since the library is changed.
+            self._write('lib/common.c', '\nint common_func(int x) {\n  return x + 2;\n}\n')
+            self._compile('-shared', '-fPIC', '-o', 'lib/libcommon.so', 'lib/common.c')
+            gj_index.index_elf_binaries(self._binaries, substitution, jobs=1)
+            self.assertEqual(['libcommon.so'], read)
+            self.assertEqual(['ldd', 'ldd'], commands)
+            self.assertEqual(['lib/common.c:2:0:common_func'],
+                             [str(m) for m in gj_util.find_definition('common_func')])
+
+            # The libraries found by ldd depend on the environment.
+            del commands[:]
+            os.environ['LD_LIBRARY_PATH'] = self._root
+            gj_index.index_elf_binaries(self._binaries, substitution, jobs=1)
+            self.assertEqual(['ldd', 'ldd'], commands)
+        finally:
+            gj_index._read_elf = original_read_elf
+            gj_index._iter_output_lines = original_iter_output_lines
+            if ld_library_path is None:
+                os.environ.pop('LD_LIBRARY_PATH', None)
+            else:
+                os.environ['LD_LIBRARY_PATH'] = ld_library_path
+
+        expected = self._load()
+        gj_index.index_elf_binaries(self._binaries, substitution, jobs=1, use_cache=False)
+        self.assertEqual(expected, self._load())
+        # The result of the old libcommon.so is removed.
+        cache_dir = gj_util.DEFINITION_INDEX_FILE + gj_index.CACHE_SUFFIX
+        self.assertEqual(4, len(os.listdir(cache_dir)))
+
+    def test_readers(self):
+        substitution = [self._root + '/', '']
+        gj_index.index_elf_binaries(self._binaries, substitution, jobs=1,
+                                    reader=gj_index.READER_BINUTILS)
+        expected = self._load()
+        gj_index.index_elf_binaries(self._binaries, substitution, jobs=3,
+                                    reader=gj_index.READER_NATIVE)
+        self.assertEqual(expected, self._load())
+
 
 if __name__ == '__main__':
     unittest.main()
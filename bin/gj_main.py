@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+The main function of gj: an interactive tool to find out symbols.
+
+Most runs are lookups, so the modules to build the indexes (e.g., gj_index)
+are only imported when they are needed.
+'''
+
+import sys
+import optparse
+import os
+
+import gj_shard
+import gj_util
+import gj_trace
+
+
+__author__ = 'fcamel'
+
+
+#------------------------------------------------------------------------------
+# Configuration
+#------------------------------------------------------------------------------
+def _gen_vim_command(matches, patterns):
+    p = patterns[0]
+    # Support searching "FUNCTION(" or "FUNCTION()".
+    # Passing "()" to vim results in syntax error. Filter out them.
+    if p.endswith('('):
+        p = p[:-1]
+    elif p.endswith('()'):
+        p = p[:-2]
+    if len(matches) == 1:
+        m = matches[0]
+        return 'vim "%s" -c/%s +%s' % (m.filename, p, m.line_num)
+    else:
+        fs = [m.filename for m in matches]
+        return 'vim %s -c/%s -p' % (' '.join(sorted(set(fs))), p)
+
+def _gen_general_editor_command(matches, patterns):
+    m = matches[0]
+    editor = os.environ['EDITOR']
+    return '%s %s' % (editor, m.filename)
+
+def _gen_subl_command(matches, patterns):
+    m = matches[0]
+    return 'subl %s:%d' % (m.filename, m.line_num)
+
+def _gen_code_command(matches, patterns):
+    m = matches[0]
+    return 'code -g %s:%d' % (m.filename, m.line_num)
+
+# Add your _gen_*_command if you use some other editor.
+_gen_edit_commands = {
+    'vi': _gen_vim_command,
+    'vim': _gen_vim_command,
+    'subl': _gen_subl_command,
+    'code': _gen_code_command,
+}
+
+# Use vim by default.
+_gen_edit_command = _gen_vim_command
+
+if 'EDITOR' in os.environ:
+    editor = os.environ['EDITOR']
+    if editor in _gen_edit_commands:
+        _gen_edit_command = _gen_edit_commands[editor]
+    else:
+        # Don't know how to jump to the line and highglight the pattern.
+        # Only open the file.
+        _gen_edit_command = _gen_general_editor_command
+
+#------------------------------------------------------------------------------
+# main
+#------------------------------------------------------------------------------
+def main():
+    '''\
+    %prog [options] <pattern> [<pattern> ...]
+
+    Grep pattern in source codes using id-utils.
+    Before starting, type 'mkid' in your source root first.
+
+    Example of usages:
+        $ gj MyClient         # find any snippet which contains MyClient
+        $ gj MyClient class   # find the definition. MyClient and class must appear in the same line.
+    '''
+    parser = optparse.OptionParser(usage=main.__doc__)
+    parser.add_option('-c', '--config', dest='config',
+                      action='store_true', default=False,
+                      help=('Generate the config file ".gjconfig" in current directory.'))
+    parser.add_option('-d', '--decdef', dest='decdef',
+                      action='store_true', default=False,
+                      help=('Find possible declarations or definitions.'))
+    parser.add_option('-D', '--definition', dest='definition',
+                      action='store_true', default=False,
+                      help=('Find possible definitions.'))
+    parser.add_option('-f', '--filter', dest='filter_',
+                      type='string', default='',
+                      help='Only keep the files which contain the target symbol. '
+                            'Useful to help filter common name such as "Start". '
+                            'For example, "Start -f MySuperThread" will find out files which '
+                            'contain MySuperThread and Start simultaneously.')
+    parser.add_option('-a', '--assignment', dest='assignment',
+                      action='store_true', default=False,
+                      help='Find where the first pattern is assigned (experimental feature for Go)')
+    parser.add_option('-b', '--batch', dest='batch',
+                      action='store_true', default=False,
+                      help='Run in batch mode (i.e., no interaction).')
+    parser.add_option('--limit', dest='limit',
+                      type=int, default=0,
+                      help='Output at most N matches (default: 0, no limit).')
+    parser.add_option('--first-file-only', dest='first_file_only',
+                      action='store_true', default=False,
+                      help='Only output the matches in the first file.')
+    parser.add_option('--unsorted', dest='unsorted',
+                      action='store_true', default=False,
+                      help=('Used with -b. Output the matches once they are found instead of'
+                            ' sorting them. With --limit or --first-file-only, the search stops'
+                            ' once enough matches are found.'))
+    parser.add_option('--json', dest='json_lines',
+                      action='store_true', default=False,
+                      help=('Used with -b. Output one JSON object per match:'
+                            ' {"filename", "line", "column", "text"}. Used by gj.vim.'))
+    parser.add_option('--no-cache', dest='use_cache',
+                      action='store_false', default=True,
+                      help=('Don\'t load or save the results in the result cache beside the'
+                            ' database. The cache is cleared by -i and -I.'))
+    parser.add_option('--bulk', dest='bulk',
+                      type='string', default='',
+                      help=('Answer the batch queries in the file (- for stdin) in one process.'
+                            ' Each line is a query in the arguments of gj (e.g., "-d Foo"),'
+                            ' optionally after "TAG<TAB>". Each result is output after its tag.'))
+    parser.add_option('-i', '--index', dest='index',
+                      action='store_true', default=False,
+                      help='Build index.')
+    parser.add_option('-I', '--binary-index', dest='binary_index',
+                      action='store_true', default=False,
+                      help='Build binary index only.')
+    parser.add_option('--shard', dest='shards',
+                      action='append', default=[],
+                      help=('Used with -i or -I of a sharded index. Only rebuild the shard'
+                            ' (a subtree in "<db>.shards"). Can be given several times.'))
+    parser.add_option('-s', '--symbol', dest='symbol',
+                      action='store_true', default=False,
+                      help=('Find symbols given sub-string (case-insensitive match).'
+                            ' Display filenames when -v is applied.'
+                            ' NOTE: This option is kept for backward compatibility.'
+                            ' Use gj_symbol to get better results.'))
+    parser.add_option('-v', '--verbose', dest='verbose',
+                      action='store_true', default=False,
+                      help='Display more information (default: False).')
+    parser.add_option('-p', '--path', dest='path',
+                      type='string', default='',
+                      help='Search symbols under specific path.')
+    parser.add_option('-e', '--extended', dest='extended',
+                      type=int, default=0,
+                      help=('Used for multiple pattern search. By default all patterns are searched'
+                            ' in the same line. With this flag, use the first pattern to fine target line'
+                            ' and search the rest patterns in the +/- N lines (default: 0).'))
+    parser.add_option('--db', dest='db_path',
+                      type='string', default='ID',
+                      help='Specify text index database path')
+    parser.add_option('--engine', dest='engine',
+                      type='choice', choices=gj_util.ENGINES, default=gj_util.ENGINE_MKID,
+                      help=('The engine to build the text index with -i: %s (default: %%default).'
+                            ' "native" indexes the files in parallel and needs no id-utils.'
+                            % ', '.join(gj_util.ENGINES)))
+    parser.add_option('-j', '--jobs', dest='jobs',
+                      type=int, default=None,
+                      help=('The number of processes to build the native text index with -i'
+                            ' and to index the ELF binaries with -I (default: #CPUs).'))
+    parser.add_option('-u', '--incremental', dest='incremental',
+                      action='store_true', default=False,
+                      help=('Used with -i. Only re-tokenize the files changed since the last build.'
+                            ' This implies "--engine native".'))
+    parser.add_option('--serve', dest='serve',
+                      action='store_true', default=False,
+                      help=('Run a server which answers the batch queries of the database.'
+                            ' gj_without_interaction (used by gj.vim) sends the queries to'
+                            ' the server if it is running.'))
+    gj_trace.add_options(parser)
+    options, args = parser.parse_args()
+    gj_trace.start(options.profile, options.profile_output)
+
+    if options.incremental:
+        options.engine = gj_util.ENGINE_NATIVE
+
+    if options.index:
+        gj_util.check_install(engine=options.engine)
+    elif not options.config and not options.binary_index and not options.definition:
+        gj_util.check_install(db_path=options.db_path)
+
+    if options.config:
+        filename = gj_util.CONFIG_FILE
+        if os.path.exists(filename):
+            print('%s exists. Please delete it and try again.' % filename)
+            return 5
+        with open(gj_util.CONFIG_FILE, 'w') as fw:
+            example = [
+                'config = {',
+                '    # Each line is an ELF binary to be indexed.',
+                '    # Example:',
+                '    #   ("out/debug/myprog", "out/debug")',
+                '    #',
+                '    #   Index out/debug/myprog and dynamic libraries used by myprog with sub-path "out/debug".',
+                '    #   Index no extra dynamic libraries if the second argument is an empty string.',
+                '    "binaries": [',
+                '    ],',
+                '    # FROM=TO. E.g., "../../=" removes the prefix "../../".',
+                '    "path_substitution": "",',
+                '}',
+                '',
+            ]
+            fw.write('\n'.join(example))
+        print('%s is created.' % filename)
+        return 0
+
+    index_source = options.index
+    index_binary = options.index or options.binary_index
+    if (index_source or index_binary) and gj_shard.get_shards(options.db_path) is not None:
+        print('> Index the shards in %s ...' % (options.db_path + gj_shard.SUFFIX))
+        print('')
+        if index_source:
+            args = ['-i', '--engine', options.engine] + (['-u'] if options.incremental else [])
+        else:
+            args = ['-I']
+        result = gj_shard.build(options.db_path, args, options.shards, options.jobs)
+        print('> Done')
+        return 0 if result else 1
+
+    if index_source or index_binary:
+        result = True
+        gj_util.clear_cache(options.db_path)
+        if index_source:
+            print('> Index source codes ...')
+            print('')
+            result = gj_util.build_index(options.db_path, options.engine, options.jobs,
+                                         options.incremental)
+
+        filename = gj_util.CONFIG_FILE
+        if os.path.exists(filename):
+            print('> Index ELF binaries ...')
+            try:
+                sandbox = {}
+                with open(filename) as fr:
+                    exec(compile(fr.read(), filename, 'exec'), sandbox)
+                config = sandbox['config']
+                binaries = config['binaries']
+                if not binaries:
+                    print('Skip beause "binaries" is empty.')
+                else:
+                    path_substitution = [None, None]
+                    if config['path_substitution']:
+                        tmp = config['path_substitution'].split('=')
+                        if len(tmp) == 2:
+                            path_substitution = tmp
+                        else:
+                            raise Exception('The format of "path_substitution" is wrong.')
+                    import gj_index
+                    gj_index.index_elf_binaries(binaries, path_substitution, options.jobs)
+            except Exception as e:
+                print('Failed to index ELF: %s: %s' % (type(e).__name__, e))
+
+        print('\n> Done')
+        return 0 if result else 1
+
+    if options.serve:
+        import gj_server
+        return gj_server.serve(options.db_path)
+
+    if options.bulk:
+        import gj_bulk
+        return gj_bulk.run(options.bulk, options.db_path, options.json_lines)
+
+    if len(args) < 1:
+        parser.print_help()
+        return 2
+
+    if (not options.definition and not os.path.exists(options.db_path)
+            and gj_shard.get_shards(options.db_path) is None):
+        print('Database file "%s" is not found. Have you run "gj -i"?' % options.db_path)
+        return 3
+
+    patterns = gj_util.process_args(args)
+
+    # Set config.
+    gj_util.config['verbose'] = options.verbose
+    gj_util.config['search_extended_lines'] = options.extended
+    gj_util.config['db_path'] = options.db_path
+
+    # Find the initial matched set.
+    if options.symbol:
+        kind = gj_util.Q_SYMBOLS
+    elif options.decdef:
+        kind = gj_util.Q_DECDEF
+    elif options.definition:
+        kind = gj_util.Q_DEFINITION
+    elif options.assignment:
+        kind = gj_util.Q_ASSIGNMENT
+    else:
+        kind = gj_util.Q_MATCHES
+    batch = options.batch or kind == gj_util.Q_SYMBOLS
+    matches = gj_util.query(kind, patterns, path_prefix=options.path, filter_=options.filter_,
+                            limit=options.limit, first_file_only=options.first_file_only,
+                            sort=not (batch and options.unsorted),
+                            use_cache=options.use_cache)
+
+    # Run in batch mode?
+    if batch:
+        gj_util.print_result(kind, matches, options.json_lines)
+        return 0
+
+    # Enter interactive mode.
+    # Filter the rest or view the selected file.
+    while True:
+        selections, matches, patterns = gj_util.choose_matches_interactively(matches, patterns)
+        if not selections:
+            return 0
+
+        # Edit the chosen one.
+        cmd = _gen_edit_command(selections, patterns)
+        ret = os.system(cmd)
+        if ret != 0:
+            print('Failed to execute: %s' % cmd)
+
+        if ret != 0:
+            return 4
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
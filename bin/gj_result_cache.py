@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+An on-disk cache of the query results beside the text index.
+
+The editor plugins and the scripts often ask for the same symbols. Each
+result is saved compressed by marshal and zlib in "<db>.cache/", named by
+the checksums of its key. marshal is built in and loads faster than pickle,
+which matters to the start-up time of each lookup. The key contains the
+generation of the indexes (the stats of the index files), so the results
+become unreachable once "gj -i" or "gj -I" rewrites an index. "gj -i" and
+"gj -I" also clear the cache. The matches are read from the source files,
+so gj_util also saves the stats of the files in the matches and drops the
+result once any of them is edited.
+
+The least recently used results are removed when the cache holds more than
+MAX_ENTRIES results or MAX_BYTES bytes.
+'''
+
+import marshal
+import os
+import sys
+import zlib
+
+
+__author__ = 'fcamel'
+
+SUFFIX = '.cache'
+MAX_ENTRIES = 512
+MAX_BYTES = 64 * 1024 * 1024
+
+# The format of marshal depends on the version of Python.
+_VERSION = (3, sys.version_info[:2])
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def get_generation(paths):
+    '''
+    Return a value which changes when any file in |paths| is rewritten.
+    '''
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            result.append(None)
+            continue
+        result.append((st.st_mtime, st.st_size, st.st_ino))
+    return tuple(result)
+
+def clear(db_path):
+    '''
+    Remove all results of the text index |db_path|.
+    '''
+    import shutil
+
+    dirpath = db_path + SUFFIX
+    if os.path.isdir(dirpath):
+        shutil.rmtree(dirpath, ignore_errors=True)
+
+
+class ResultCache(object):
+    def __init__(self, db_path, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self._dirpath = db_path + SUFFIX
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+    def get(self, key):
+        '''
+        Return the result of |key| or None if it's not cached.
+        '''
+        path = os.path.join(self._dirpath, self._get_filename(key))
+        try:
+            with open(path, 'rb') as fr:
+                version, saved_key, data = marshal.loads(zlib.decompress(fr.read()))
+        except Exception:
+            # Missing or broken.
+            return None
+        if version != _VERSION or saved_key != key:
+            return None
+        try:
+            # Mark it as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        '''
+        Save |data| as the result of |key|. Return False if it isn't saved.
+        |key| and |data| are made of the built-in types supported by marshal.
+        '''
+        import tempfile
+
+        blob = zlib.compress(marshal.dumps((_VERSION, key, data)), 1)
+        if len(blob) > self._max_bytes // 4:
+            # Don't let one result evict most of the others.
+            return False
+        try:
+            if not os.path.isdir(self._dirpath):
+                os.makedirs(self._dirpath)
+            fd, tmp_path = tempfile.mkstemp(prefix='.gj_', dir=self._dirpath)
+            with os.fdopen(fd, 'wb') as fw:
+                fw.write(blob)
+            os.rename(tmp_path, os.path.join(self._dirpath, self._get_filename(key)))
+            self._evict()
+        except (IOError, OSError):
+            # E.g., the directory is read-only. Caching is optional.
+            return False
+        return True
+
+    def _get_filename(self, key):
+        # get() checks the saved key, so the rare collisions are only misses.
+        data = repr(key).encode('utf8')
+        return '%08x%08x' % (zlib.crc32(data) & 0xffffffff, zlib.adler32(data) & 0xffffffff)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for filename in os.listdir(self._dirpath):
+            if filename.startswith('.gj_'):
+                continue
+            path = os.path.join(self._dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+
+        # Remove the least recently used ones first.
+        entries.sort()
+        n = len(entries)
+        for _, path, size in entries:
+            if n <= self._max_entries and total <= self._max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            n -= 1
+            total -= size
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import gj_result_cache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp(prefix='gj_result_cache_test_')
+        self._db_path = os.path.join(self._root, 'ID')
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def test_get_and_put(self):
+        cache = gj_result_cache.ResultCache(self._db_path)
+        self.assertTrue(cache.get(('matches', 'Foo')) is None)
+        self.assertTrue(cache.put(('matches', 'Foo'), ['a.cc:1:0:Foo']))
+        self.assertEqual(['a.cc:1:0:Foo'], cache.get(('matches', 'Foo')))
+        self.assertTrue(cache.get(('matches', 'Bar')) is None)
+
+        # A broken file is a miss.
+        for filename in os.listdir(self._db_path + gj_result_cache.SUFFIX):
+            with open(os.path.join(self._db_path + gj_result_cache.SUFFIX, filename), 'wb') as fw:
+                fw.write(b'broken')
+        self.assertTrue(cache.get(('matches', 'Foo')) is None)
+
+        gj_result_cache.clear(self._db_path)
+        self.assertFalse(os.path.exists(self._db_path + gj_result_cache.SUFFIX))
+
+    def test_evict_least_recently_used(self):
+        cache = gj_result_cache.ResultCache(self._db_path, max_entries=2)
+        cache.put('a', 1)
+        time.sleep(0.01)
+        cache.put('b', 2)
+        time.sleep(0.01)
+        # Use "a", so "b" is the least recently used one.
+        self.assertEqual(1, cache.get('a'))
+        time.sleep(0.01)
+        cache.put('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertTrue(cache.get('b') is None)
+        self.assertEqual(3, cache.get('c'))
+
+    def test_max_bytes(self):
+        cache = gj_result_cache.ResultCache(self._db_path, max_bytes=4096)
+        # Too large to be cached.
+        self.assertFalse(cache.put('a', os.urandom(2048)))
+        self.assertTrue(cache.get('a') is None)
+
+    def test_generation(self):
+        path = os.path.join(self._root, 'a')
+        generation = gj_result_cache.get_generation([path])
+        with open(path, 'w') as fw:
+            fw.write('a')
+        self.assertNotEqual(generation, gj_result_cache.get_generation([path]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+A resident server which answers gj's batch queries over a Unix socket.
+
+Each lookup from the editor used to start Python, check the installation and
+load the indexes. The server does all of these once. The opened text index and
+the header of gj.index are kept in memory and reloaded only after they are
+rewritten. Use gj_client.py to send the queries.
+'''
+
+import io
+import json
+import optparse
+import os
+import signal
+import socket
+import sys
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    # Python 2.
+    import SocketServer as socketserver
+
+import gj_client
+import gj_util
+
+
+__author__ = 'fcamel'
+
+DEBUG = False
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def serve(db_path):
+    db_path = os.path.abspath(db_path)
+    socket_path = gj_client.get_socket_path(db_path)
+    if _is_serving(socket_path):
+        print('A server is already running at %s.' % socket_path)
+        return 1
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socketserver.UnixStreamServer(socket_path, _Handler)
+    server.db_path = db_path
+    # Remove the socket when being killed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Serve %s at %s. Press Ctrl+C to stop.' % (db_path, socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('')
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return 0
+
+def handle(message, db_path):
+    '''
+    Run the query in |message| and return the response for gj_client.
+    '''
+    options, patterns = parse_query(message['argv'])
+    if options is None:
+        return {'fallback': True}
+
+    os.chdir(message['cwd'])
+    if os.path.abspath(options.db_path) != db_path:
+        # Serve one database only.
+        return {'fallback': True}
+
+    gj_util.config['verbose'] = options.verbose
+    gj_util.config['search_extended_lines'] = options.extended
+    gj_util.config['db_path'] = db_path
+
+    stdout = sys.stdout
+    output = _Output(message.get('tty', False))
+    sys.stdout = output
+    try:
+        kind = get_kind(options)
+        result = gj_util.query(kind, patterns, path_prefix=options.path, filter_=options.filter_,
+                               limit=options.limit, first_file_only=options.first_file_only,
+                               sort=not options.unsorted, use_cache=not options.no_cache)
+        gj_util.print_result(kind, result, options.json_lines)
+    finally:
+        sys.stdout = stdout
+    return {'code': 0, 'output': output.getvalue()}
+
+def parse_query(argv):
+    '''
+    Return (options, patterns) of a batch query. Return (None, None) for
+    the other commands (e.g., building the index).
+    '''
+    parser = optparse.OptionParser(add_help_option=False)
+    for short, long_, dest in (('-d', '--decdef', 'decdef'),
+                               ('-D', '--definition', 'definition'),
+                               ('-a', '--assignment', 'assignment'),
+                               ('-b', '--batch', 'batch'),
+                               ('-s', '--symbol', 'symbol'),
+                               ('-v', '--verbose', 'verbose'),
+                               (None, '--first-file-only', 'first_file_only'),
+                               (None, '--unsorted', 'unsorted'),
+                               (None, '--json', 'json_lines'),
+                               (None, '--no-cache', 'no_cache')):
+        flags = [short, long_] if short else [long_]
+        parser.add_option(*flags, dest=dest, action='store_true', default=False)
+    parser.add_option('--limit', dest='limit', type=int, default=0)
+    parser.add_option('-f', '--filter', dest='filter_', type='string', default='')
+    parser.add_option('-p', '--path', dest='path', type='string', default='')
+    parser.add_option('-e', '--extended', dest='extended', type=int, default=0)
+    parser.add_option('--db', dest='db_path', type='string', default='ID')
+    parser.error = _raise_error
+    try:
+        options, args = parser.parse_args(argv)
+    except ValueError:
+        return None, None
+
+    if not args or not (options.batch or options.symbol):
+        return None, None
+    return options, gj_util.process_args(args)
+
+def get_kind(options):
+    if options.symbol:
+        return gj_util.Q_SYMBOLS
+    if options.decdef:
+        return gj_util.Q_DECDEF
+    if options.definition:
+        return gj_util.Q_DEFINITION
+    if options.assignment:
+        return gj_util.Q_ASSIGNMENT
+    return gj_util.Q_MATCHES
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline().decode('utf8'))
+            response = handle(message, self.server.db_path)
+        except Exception:
+            if DEBUG:
+                traceback.print_exc()
+            # Let the client run gj by itself, which reports the error if any.
+            response = {'fallback': True}
+        self.wfile.write(json.dumps(response).encode('utf8'))
+
+
+class _Output(io.StringIO):
+    '''
+    Collect the output for the client. The highlighting depends on whether
+    the client's stdout is a terminal.
+    '''
+    def __init__(self, tty):
+        io.StringIO.__init__(self)
+        self._tty = tty
+
+    def isatty(self):
+        return self._tty
+
+
+def _is_serving(socket_path):
+    if not os.path.exists(socket_path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+def _raise_error(msg):
+    raise ValueError(msg)
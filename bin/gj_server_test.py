@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import gj_server
+import gj_text_index
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._root = tempfile.mkdtemp(prefix='gj_server_test_')
+        os.chdir(self._root)
+        with open('id-lang.map', 'w') as fw:
+            fw.write('**  IGNORE\n*.cc  text\n')
+        with open('a.cc', 'w') as fw:
+            fw.write('class Foo {\n};\nFoo foo;\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+        self._db_path = os.path.abspath('ID')
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _handle(self, argv):
+        message = {'argv': argv, 'cwd': self._root, 'tty': False}
+        return gj_server.handle(message, self._db_path)
+
+    def test_handle_batch_query(self):
+        response = self._handle(['-b', 'Foo'])
+        self.assertEqual(0, response['code'])
+        self.assertEqual('a.cc:1:6:class Foo {\na.cc:3:0:Foo foo;\n', response['output'])
+
+        response = self._handle(['-b', '-d', 'Foo'])
+        self.assertEqual('a.cc:1:6:class Foo {\n', response['output'])
+
+        response = self._handle(['-b', '--limit', '1', 'Foo'])
+        self.assertEqual('a.cc:1:6:class Foo {\n', response['output'])
+
+        response = self._handle(['-b', '--unsorted', '--first-file-only', 'Foo'])
+        self.assertEqual('a.cc:1:6:class Foo {\na.cc:3:0:Foo foo;\n', response['output'])
+
+        response = self._handle(['-s', 'fo'])
+        self.assertEqual('Foo\nfoo\n', response['output'])
+
+    def test_handle_json(self):
+        response = self._handle(['-b', '--json', 'Foo'])
+        self.assertEqual([
+            {'filename': 'a.cc', 'line': 1, 'column': 6, 'text': 'class Foo {'},
+            {'filename': 'a.cc', 'line': 3, 'column': 0, 'text': 'Foo foo;'},
+        ], [json.loads(line) for line in response['output'].splitlines()])
+
+        response = self._handle(['-s', '--json', 'fo'])
+        self.assertEqual('{"text": "Foo"}\n{"text": "foo"}\n', response['output'])
+
+    def test_fallback(self):
+        self.assertTrue(self._handle(['-i'])['fallback'])
+        self.assertTrue(self._handle(['Foo'])['fallback'])
+        self.assertTrue(self._handle(['-h'])['fallback'])
+        self.assertTrue(self._handle(['-b', '--db', 'other/ID', 'Foo'])['fallback'])
+
+
+if __name__ == '__main__':
+    unittest.main()
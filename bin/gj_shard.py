@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+Sharded indexes: one text index and one gj.index per subtree.
+
+A large tree can be split into the subtrees listed in the manifest
+"<db>.shards" (e.g., "ID.shards"), one subtree per line relative to the
+directory of the manifest:
+
+    # The lines starting with "#" are comments.
+    base
+    ui/views
+
+Each subtree is an ordinary tree of gj with its own ID, ID.* and gj.index,
+so a team only rebuilds its subtree: run "gj -i" in the subtree, or
+"gj -i --shard SUBTREE" beside the manifest. "gj -i" beside the manifest
+rebuilds all shards in parallel.
+
+The queries of a sharded index run on each shard in a process pool and the
+sorted results are merged. "-p" skips the shards which can't have the path.
+'''
+
+import heapq
+import os
+import sys
+
+
+__author__ = 'fcamel'
+
+SUFFIX = '.shards'
+
+# The pool shared by the queries. It's created at the first query on more
+# than one shard, so "gj --serve" and "gj --bulk" reuse the processes.
+_pool = None
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+class Shard(object):
+    '''
+    |subtree| is the line in the manifest and |path| is the directory of the
+    shard relative to the current directory, like the paths output by gid.
+    '''
+    __slots__ = ('subtree', 'path')
+
+    def __init__(self, subtree, path):
+        self.subtree = subtree
+        self.path = path
+
+    def join(self, filename):
+        return os.path.join(self.path, filename)
+
+    def __repr__(self):
+        return 'Shard(%r, %r)' % (self.subtree, self.path)
+
+
+def get_shards(db_path):
+    '''
+    Return the Shards in the manifest of |db_path|, or None if the index
+    isn't sharded.
+    '''
+    manifest = db_path + SUFFIX
+    try:
+        with open(manifest) as fr:
+            lines = fr.read().split('\n')
+    except (IOError, OSError):
+        return None
+
+    root = os.path.dirname(os.path.abspath(manifest))
+    shards = []
+    for line in lines:
+        subtree = line.strip()
+        if not subtree or subtree.startswith('#'):
+            continue
+        subtree = os.path.normpath(subtree)
+        shards.append(Shard(subtree, os.path.relpath(os.path.join(root, subtree))))
+    return shards
+
+def may_match_path(shard, prefix):
+    '''
+    Return False if no path in |shard| starts with |prefix|. |prefix| is
+    relative to the current directory. None means any path.
+    '''
+    if prefix is None or shard.path == '.':
+        return True
+    path = shard.path + os.sep
+    return prefix.startswith(path) or path.startswith(prefix)
+
+def map_shards(func, tasks, jobs=None):
+    '''
+    Return [func(task) for task in tasks], computed in the shared process
+    pool of |jobs| processes (default: #CPUs). |func| must be a function
+    at the top level of a module.
+    '''
+    global _pool
+
+    if len(tasks) <= 1:
+        return [func(task) for task in tasks]
+    if _pool is None:
+        import atexit
+        import multiprocessing
+
+        _pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count())
+        atexit.register(_pool.terminate)
+    return _pool.map(func, tasks, chunksize=1)
+
+def merge(results, key):
+    '''
+    Return the k-way merge of the sorted lists |results|.
+    '''
+    if len(results) == 1:
+        return results[0]
+    return list(heapq.merge(*results, key=key))
+
+def build(db_path, args, subtrees=None, jobs=None):
+    '''
+    Run "gj |args|" (e.g., "-i -u") in the shards of |db_path| in parallel.
+    Only run in |subtrees| if it's given. Print the output of each shard
+    once it's done. Return True if all runs succeed.
+    '''
+    import multiprocessing
+    import multiprocessing.pool
+
+    shards = get_shards(db_path)
+    if subtrees:
+        subtrees = set(os.path.normpath(s) for s in subtrees)
+        unknown = subtrees - set(s.subtree for s in shards)
+        if unknown:
+            print('Unknown shards: %s. See %s.' % (', '.join(sorted(unknown)), db_path + SUFFIX))
+            return False
+        shards = [s for s in shards if s.subtree in subtrees]
+    if not shards:
+        print('No shard in %s.' % (db_path + SUFFIX))
+        return False
+
+    jobs = jobs or multiprocessing.cpu_count()
+    n_parallel = min(jobs, len(shards))
+    # Share the processes between the shards built at the same time.
+    args = list(args) + ['-j', str(max(1, jobs // n_parallel)),
+                         '--db', os.path.basename(db_path)]
+    pool = multiprocessing.pool.ThreadPool(n_parallel)
+    try:
+        ok = True
+        for shard, code, output in pool.imap_unordered(lambda s: _run(s, args), shards):
+            print('> Shard %s' % shard.subtree)
+            sys.stdout.write(output)
+            if code != 0:
+                print('Failed to index shard %s (exit code: %d).' % (shard.subtree, code))
+                ok = False
+            print('')
+            sys.stdout.flush()
+    finally:
+        pool.close()
+    return ok
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _run(shard, args):
+    import subprocess
+
+    if not os.path.isdir(shard.path):
+        return shard, 1, 'Directory "%s" is not found.\n' % shard.path
+    gj = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gj')
+    process = subprocess.Popen([sys.executable, gj] + args, cwd=shard.path,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return shard, process.returncode, output.decode('utf8', 'replace')
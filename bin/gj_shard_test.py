@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import gj_index
+import gj_shard
+import gj_text_index
+import gj_util
+
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._config = dict(gj_util.config)
+        self._root = tempfile.mkdtemp(prefix='gj_shard_test_')
+        os.chdir(self._root)
+        self._write('ID.shards', '# The shards.\nbase\n\nui/views\nmissing\n')
+        self._write('base/foo.h', 'class Foo {\n  void Run();\n};\n')
+        self._write('ui/views/view.cc', 'void View::Run() {\n  Foo foo;\n}\n')
+        gj_util.config['db_path'] = 'ID'
+
+    def tearDown(self):
+        gj_util.config.clear()
+        gj_util.config.update(self._config)
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fw:
+            fw.write(content)
+
+    def _build(self):
+        lang_map = os.path.abspath('id-lang.map')
+        self._write('id-lang.map', '**  IGNORE\n*.h  text\n*.cc  text\n')
+        for subtree in ('base', 'ui/views'):
+            os.chdir(subtree)
+            gj_text_index.build('ID', lang_map, jobs=1)
+            os.chdir(self._root)
+
+    def _query(self, kind, patterns, **kwargs):
+        return [str(m) for m in gj_util.query(kind, patterns, **kwargs)]
+
+    def test_get_shards(self):
+        shards = gj_shard.get_shards('ID')
+        self.assertEqual(['base', 'ui/views', 'missing'], [s.subtree for s in shards])
+        self.assertEqual('ui/views/ID', shards[1].join('ID'))
+        self.assertTrue(gj_shard.get_shards('base/ID') is None)
+
+        os.chdir('base')
+        self.assertEqual(['.', '../ui/views', '../missing'],
+                         [s.path for s in gj_shard.get_shards('../ID')])
+
+    def test_may_match_path(self):
+        shard = gj_shard.Shard('ui/views', 'ui/views')
+        self.assertTrue(gj_shard.may_match_path(shard, None))
+        self.assertTrue(gj_shard.may_match_path(shard, 'ui/'))
+        self.assertTrue(gj_shard.may_match_path(shard, 'ui/views/a'))
+        self.assertFalse(gj_shard.may_match_path(shard, 'base/'))
+        self.assertFalse(gj_shard.may_match_path(shard, 'ui/viewsx'))
+        self.assertTrue(gj_shard.may_match_path(gj_shard.Shard('.', '.'), 'base/'))
+
+    def test_query(self):
+        self._build()
+        self.assertEqual(['base/foo.h:1:6:class Foo {', 'ui/views/view.cc:2:2:  Foo foo;'],
+                         self._query(gj_util.Q_MATCHES, ['Foo']))
+        self.assertEqual(['base/foo.h:2:7:  void Run();'],
+                         self._query(gj_util.Q_MATCHES, ['Run'], limit=1))
+        self.assertEqual(['ui/views/view.cc:1:11:void View::Run() {'],
+                         self._query(gj_util.Q_MATCHES, ['Run'], path_prefix='ui/'))
+        # "Foo" and "void" are in both shards.
+        self.assertEqual(['Foo', 'foo', 'void'], gj_util.query(gj_util.Q_SYMBOLS, ['o']))
+
+    def test_query_after_one_shard(self):
+        self._build()
+        config = dict(gj_util.config)
+        # Only one shard is queried, in this process.
+        self.assertEqual(['ui/views/view.cc:1:11:void View::Run() {'],
+                         self._query(gj_util.Q_MATCHES, ['Run'], path_prefix='ui/'))
+        self.assertEqual(config, gj_util.config)
+        self.assertEqual(os.path.realpath(self._root), os.path.realpath(os.getcwd()))
+        # "class" is only in base.
+        self.assertEqual(['base/foo.h:1:0:class Foo {'],
+                         self._query(gj_util.Q_MATCHES, ['class']))
+        self.assertEqual(['base/foo.h:1:6:class Foo {', 'ui/views/view.cc:2:2:  Foo foo;'],
+                         self._query(gj_util.Q_MATCHES, ['Foo']))
+
+    def test_skip_shards_by_path(self):
+        self._build()
+        map_shards = gj_shard.map_shards
+        tasks = []
+        def fake_map_shards(func, items):
+            tasks.extend(items)
+            return map_shards(func, items)
+        gj_shard.map_shards = fake_map_shards
+        try:
+            self.assertEqual(['base/foo.h:1:6:class Foo {'],
+                             self._query(gj_util.Q_MATCHES, ['Foo'], path_prefix='base/f.*'))
+        finally:
+            gj_shard.map_shards = map_shards
+        self.assertEqual(['base/ID'], [task[0]['db_path'] for task in tasks])
+
+    def test_find_definition(self):
+        for subtree, line in (('base', 1), ('ui/views', 5)):
+            info = gj_util.SymbolInfo('Foo', 'Foo', gj_util.FileLine('foo.cc', line))
+            gj_index._save_infos([info], os.path.join(subtree, gj_util.DEFINITION_INDEX_FILE))
+        self.assertEqual(['base/foo.cc:1:0:Foo', 'ui/views/foo.cc:5:0:Foo'],
+                         self._query(gj_util.Q_DEFINITION, ['Foo']))
+
+    def test_build(self):
+        self._write('ui/views/view.cc', 'void View::Run() {\n}\n')
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            self.assertTrue(gj_shard.build('ID', ['-i', '--engine', 'native'],
+                                           subtrees=['ui/views/'], jobs=2))
+            self.assertFalse(gj_shard.build('ID', ['-i'], subtrees=['other']))
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(os.path.exists('ui/views/ID'))
+        self.assertFalse(os.path.exists('base/ID'))
+
+
+if __name__ == '__main__':
+    unittest.main()
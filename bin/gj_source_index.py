@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+A definition index built from the source codes at "gj -i" time.
+
+The files listed by id-lang.map are scanned in a process pool by a small
+line-based scanner of each language (C/C++, Objective C, Python, Go and
+Java; see gj_source_scanners). The scanner looks for the lines which declare or define a name,
+e.g., "class Foo {", "#define FOO", "def foo(" or "func (t *T) Foo(".
+
+The result is saved beside the text index as "<db>.defs" in the format of
+gj.index (see gj_definition_index), so "gj -d" looks up the symbol with
+bisect instead of filtering all references of the symbol. The stats of
+the scanned files are saved as well, so an incremental build only scans
+the changed files.
+'''
+
+import os
+from array import array
+
+import gj_definition_index
+import gj_storage
+import gj_text_index
+
+
+__author__ = 'fcamel'
+
+SUFFIX = '.defs'
+
+_CHUNK_SIZE = 64
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def build(db_path, lang_map_file, root='.', jobs=None, incremental=False):
+    '''
+    Scan the files under |root| and save the definitions to "|db_path|.defs".
+    Return the number of scanned files.
+
+    When |incremental| is True, reuse the definitions of the unchanged files.
+    '''
+    lang_map = gj_text_index.load_lang_map(lang_map_file)
+    paths = [p for p in gj_text_index.list_files(root, lang_map, db_path)
+             if get_scanner(p) is not None]
+    stats = [_stat(os.path.join(root, p)) for p in paths]
+
+    old = {}
+    filename = db_path + SUFFIX
+    if incremental and gj_definition_index.is_compact(filename):
+        old = _load_files(filename)
+
+    records = []
+    scanned = []
+    for path, st in zip(paths, stats):
+        if old.get(path, (None, None))[0] == st:
+            records.extend(old[path][1])
+        else:
+            scanned.append(path)
+
+    jobs_args = [(os.path.join(root, p), p) for p in scanned]
+    for definitions in _map(_scan_file, jobs_args, jobs):
+        records.extend(definitions)
+
+    records.sort(key=lambda r: (r[0], r[2], r[3]))
+    path_offsets, path_pool = gj_storage.pack_strings([p.encode('utf8') for p in paths])
+    gj_definition_index.save(filename, records, [
+        ('files_o', path_offsets),
+        ('files', path_pool),
+        ('mtime', array('d', [st[0] for st in stats])),
+        ('size', array('Q', [st[1] for st in stats])),
+    ])
+    return len(scanned)
+
+def find(db_path, symbol):
+    '''
+    Return [(full, path, line)] of |symbol|. The paths are relative to the
+    current directory like gid's. Return None if the index is not built or
+    is older than the text index.
+    '''
+    filename = db_path + SUFFIX
+    if not _is_fresh(filename, db_path) or not gj_definition_index.is_compact(filename):
+        return None
+    index = gj_definition_index.open_index(filename)
+    root = os.path.dirname(os.path.abspath(db_path))
+    base = gj_text_index.get_display_base(root)
+    if base == ('', ''):
+        return index.find(symbol)
+    return [(full, gj_text_index.display_path(root, path, base), line)
+            for full, path, line in index.find(symbol)]
+
+def get_scanner(path):
+    '''
+    Return the scanner of |path|'s language, or None if it is not supported.
+    '''
+    # Compiling the rules takes time. Only load them to build the index.
+    import gj_source_scanners
+
+    return gj_source_scanners.SCANNERS.get(os.path.splitext(path)[1])
+
+def scan(lines, scanner):
+    '''
+    Return [(symbol, line_num, text)] of the definitions in |lines|.
+    '''
+    result = []
+    seen = set()
+    for symbol, i in scanner(lines):
+        if (symbol, i) not in seen:
+            seen.add((symbol, i))
+            result.append((symbol, i + 1, lines[i]))
+    return result
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _scan_file(args):
+    '''
+    Return [(symbol, text, path, line_num)] of the file.
+    '''
+    filename, path = args
+    try:
+        with open(filename, 'rb') as fr:
+            data = fr.read()
+    except (IOError, OSError):
+        return []
+    lines = data.decode('utf8', 'replace').split('\n')
+    return [(symbol, text.rstrip('\r'), path, line_num)
+            for symbol, line_num, text in scan(lines, get_scanner(path))]
+
+def _load_files(filename):
+    '''
+    Return {path: ((mtime, size), [record])} of the previous build.
+    '''
+    index = gj_definition_index.DefinitionIndex(filename)
+    section_file = index.file
+    if not section_file.has_section('files'):
+        return {}
+    paths = section_file.strings('files')
+    mtimes = section_file.array('mtime', 'd')
+    sizes = section_file.array('size', 'Q')
+    result = {}
+    for i in range(len(paths)):
+        result[paths[i].decode('utf8')] = ((mtimes[i], sizes[i]), [])
+    for record in index.records():
+        result[record[2]][1].append(record)
+    return result
+
+def _is_fresh(filename, db_path):
+    '''
+    The index is built after the text index. It's stale if the text index
+    is rebuilt (e.g., by mkid) without it.
+    '''
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError:
+        return False
+    for path in (db_path, db_path + gj_text_index.DELTA_SUFFIX):
+        if os.path.exists(path) and os.stat(path).st_mtime > mtime:
+            return False
+    return True
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (0.0, 0)
+    return (st.st_mtime, st.st_size)
+
+def _map(func, items, jobs):
+    import multiprocessing
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(items) <= _CHUNK_SIZE:
+        return map(func, items)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return list(pool.imap(func, items, _CHUNK_SIZE))
+    finally:
+        pool.close()
+        pool.join()
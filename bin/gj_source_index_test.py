@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import gj_source_index
+import gj_text_index
+import gj_util
+
+
+class ScannerTest(unittest.TestCase):
+    def _scan(self, path, content):
+        lines = content.split('\n')
+        return [(symbol, line_num) for symbol, line_num, _ in
+                gj_source_index.scan(lines, gj_source_index.get_scanner(path))]
+
+    def test_c(self):
+        content = '\n'.join([
+            '#define FOO 1',
+            'class BASE_EXPORT Foo : public Base {',
+            ' public:',
+            '  Foo();',
+            '  ~Foo();',
+            '  int GetName() const;',
+            '};',
+            'typedef struct {',
+            '} Bar;',
+            'typedef void (*Callback)(int);',
+            'using Map = std::map<int, int>;',
+            'Foo::Foo() {',
+            '  if (x) {',
+            '    return GetName(x);',
+            '  }',
+            '  GetName();',
+            '}',
+            'static int Helper(int x)',
+            '// int Comment(int x);',
+        ])
+        self.assertEqual([
+            ('FOO', 1), ('Foo', 2), ('Foo', 5), ('GetName', 6), ('Bar', 9),
+            ('Callback', 10), ('Map', 11), ('Foo', 12), ('Helper', 18),
+        ], self._scan('a.cc', content))
+
+    def test_objc(self):
+        content = '@interface Foo : NSObject\n- (int)getName:(int)x;\n@end\n'
+        self.assertEqual([('Foo', 1), ('getName', 2)], self._scan('a.mm', content))
+
+    def test_python(self):
+        content = 'FOO = 1\nclass Foo(object):\n    def bar(self):\n        x = 1\nif x == 1:\n'
+        self.assertEqual([('FOO', 1), ('Foo', 2), ('bar', 3)], self._scan('a.py', content))
+
+    def test_go(self):
+        content = '\n'.join([
+            'func Foo() {',
+            'func (t *T) Bar(x int) {',
+            'type T struct {',
+            'const (',
+            '    A = 1',
+            '    // B',
+            ')',
+            'var x = Foo()',
+        ])
+        self.assertEqual([('Foo', 1), ('Bar', 2), ('T', 3), ('A', 5), ('x', 8)],
+                         self._scan('a.go', content))
+
+    def test_java(self):
+        content = '\n'.join([
+            'public final class Foo {',
+            '  @Override',
+            '  public String getName(int x) {',
+            '    return format(x);',
+            '  }',
+            '  if (x) {',
+        ])
+        self.assertEqual([('Foo', 1), ('getName', 3)], self._scan('A.java', content))
+
+    def test_unsupported(self):
+        self.assertTrue(gj_source_index.get_scanner('a.txt') is None)
+
+
+class SourceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._config = dict(gj_util.config)
+        self._root = tempfile.mkdtemp(prefix='gj_source_index_test_')
+        os.chdir(self._root)
+        self._write('id-lang.map', '**  IGNORE\n*.h  text\n*.cc  text\n*.py  text\n')
+        self._write('base/foo.h', 'class Foo {\n  void Run();\n};\n')
+        self._write('base/foo.cc', 'void Foo::Run() {\n  Foo foo;\n}\n')
+        self._write('ui/bar.py', 'def run():\n    return Foo()\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+        gj_util.config['db_path'] = 'ID'
+
+    def tearDown(self):
+        gj_util.config.clear()
+        gj_util.config.update(self._config)
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fw:
+            fw.write(content)
+
+    def _build(self, incremental=False):
+        return gj_source_index.build('ID', 'id-lang.map', jobs=1, incremental=incremental)
+
+    def test_find(self):
+        self.assertTrue(gj_source_index.find('ID', 'Foo') is None)
+        self.assertEqual(3, self._build())
+        self.assertEqual([('class Foo {', 'base/foo.h', 1)], gj_source_index.find('ID', 'Foo'))
+        self.assertEqual([('void Foo::Run() {', 'base/foo.cc', 1),
+                          ('  void Run();', 'base/foo.h', 2)],
+                         gj_source_index.find('ID', 'Run'))
+        self.assertEqual([], gj_source_index.find('ID', 'Bar'))
+
+        os.chdir('ui')
+        self.assertEqual([('class Foo {', '../base/foo.h', 1)],
+                         gj_source_index.find('../ID', 'Foo'))
+        # The paths are relative to the current directory like gid's.
+        os.chdir(os.path.join(self._root, 'base'))
+        self.assertEqual([('void Foo::Run() {', 'foo.cc', 1), ('  void Run();', 'foo.h', 2)],
+                         gj_source_index.find('../ID', 'Run'))
+
+    def test_find_declaration_or_definition(self):
+        self._build()
+        matches = gj_util.find_declaration_or_definition('run')
+        self.assertEqual(['ui/bar.py:1:4:def run():'], [str(m) for m in matches])
+        matches = gj_util.find_declaration_or_definition('Run', path_prefix='base/foo.h')
+        self.assertEqual(['base/foo.h:2:7:  void Run();'], [str(m) for m in matches])
+
+        # The index only has single lines. Use the classifier with -e.
+        find = gj_source_index.find
+        gj_source_index.find = lambda *args: self.fail('The index is used with -e.')
+        gj_util.config['search_extended_lines'] = 1
+        try:
+            matches = gj_util.find_declaration_or_definition('run')
+        finally:
+            gj_source_index.find = find
+        self.assertEqual(['ui/bar.py:1:4:def run():'], [str(m) for m in matches])
+
+    def test_incremental_build(self):
+        self._build()
+        # Make sure the mtime changes.
+        time.sleep(0.01)
+        self._write('ui/bar.py', 'def run():\n    return Foo()\n\ndef stop():\n    pass\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1, incremental=True)
+        # The index is stale until it's rebuilt.
+        self.assertTrue(gj_source_index.find('ID', 'stop') is None)
+        matches = gj_util.find_declaration_or_definition('stop')
+        self.assertEqual(['ui/bar.py:4:4:def stop():'], [str(m) for m in matches])
+
+        self.assertEqual(1, self._build(incremental=True))
+        self.assertEqual([('def stop():', 'ui/bar.py', 4)], gj_source_index.find('ID', 'stop'))
+        self.assertEqual([('class Foo {', 'base/foo.h', 1)], gj_source_index.find('ID', 'Foo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+The line-based scanners of gj_source_index.
+
+A scanner yields (symbol, line index) of the lines which declare or define
+the symbol. They are heuristics on single lines and may miss some unusual
+styles. SCANNERS maps the file extensions to the scanners.
+'''
+
+import re
+
+
+__author__ = 'fcamel'
+
+_C_KEYWORDS = frozenset([
+    'if', 'else', 'for', 'while', 'do', 'switch', 'case', 'return', 'goto',
+    'sizeof', 'alignof', 'decltype', 'new', 'delete', 'throw', 'catch',
+    'defined', 'static_assert', 'co_return', 'co_await', 'co_yield',
+])
+_C_TYPE = re.compile(r'^\s*(?:typedef\s+)?(?:template\s*<.*>\s*)?'
+                     r'(?:class|struct|union|enum(?:\s+class|\s+struct)?)\s+'
+                     # An optional export macro, e.g., "class BASE_EXPORT Foo".
+                     r'(?:[A-Z][A-Z0-9_]*\s+)?'
+                     r'(\w+)\s*(?:final\s*)?(?:\{|:(?!:)|$)')
+_C_TYPEDEF = re.compile(r'^\s*typedef\b.*?(?:\(\s*\*\s*(\w+)\s*\)|(\w+)\s*(?:\[[^\]]*\]\s*)*;)')
+_C_TYPEDEF_END = re.compile(r'^\}\s*(\w+)\s*;')
+_C_DEFINE = re.compile(r'^\s*#\s*define\s+(\w+)')
+_C_USING = re.compile(r'^\s*using\s+(\w+)\s*=')
+_C_FUNCTION = re.compile(r'^\s*((?:[\w:<>,]+[\s*&]+)+)?((?:[\w<>,]+::)+)?(~?\w+)\s*\(')
+_OBJC_TYPE = re.compile(r'^\s*@(?:interface|implementation|protocol)\s+(\w+)')
+_OBJC_METHOD = re.compile(r'^[-+]\s*\([^)]*\)\s*(\w+)')
+
+def _scan_c(lines):
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith(('//', '/*', '*')):
+            continue
+
+        m = _C_DEFINE.match(line)
+        if m:
+            yield m.group(1), i
+            continue
+        m = _C_TYPE.match(line)
+        if m:
+            yield m.group(1), i
+            continue
+        m = _C_TYPEDEF.match(line) or _C_TYPEDEF_END.match(line)
+        if m:
+            yield m.group(1) or m.group(2), i
+            continue
+        m = _C_USING.match(line)
+        if m:
+            yield m.group(1), i
+            continue
+        m = _OBJC_TYPE.match(line) or _OBJC_METHOD.match(line)
+        if m:
+            yield m.group(1), i
+            continue
+
+        m = _C_FUNCTION.match(line)
+        if not m:
+            continue
+        type_, qualifier, name = m.groups()
+        if name in _C_KEYWORDS:
+            continue
+        if type_ and type_.split()[0] in _C_KEYWORDS:
+            # E.g., "return Foo(x);" or "delete Foo(x)".
+            continue
+        if stripped.endswith(';'):
+            # A declaration needs the type. Otherwise it's a call.
+            if type_ or name.startswith('~'):
+                yield name.lstrip('~'), i
+        elif type_ or qualifier or name.startswith('~'):
+            # Index the destructors by the class names.
+            yield name.lstrip('~'), i
+
+_PY_KEYWORDS = frozenset(['if', 'elif', 'else', 'for', 'while', 'with', 'try', 'except',
+                          'finally', 'lambda'])
+_PY_DEFINITION = re.compile(r'^\s*(?:(?:async\s+)?def|class)\s+(\w+)')
+_PY_GLOBAL = re.compile(r'^([A-Za-z_]\w*)\s*(?::[^=]*)?=(?!=)')
+
+def _scan_python(lines):
+    for i, line in enumerate(lines):
+        m = _PY_DEFINITION.match(line) or _PY_GLOBAL.match(line)
+        if m and m.group(1) not in _PY_KEYWORDS:
+            yield m.group(1), i
+
+_GO_FUNCTION = re.compile(r'^func\s+(?:\([^)]*\)\s*)?(\w+)\s*[\[(]')
+_GO_DECLARATION = re.compile(r'^(?:type|var|const)\s+(\w+)')
+_GO_BLOCK = re.compile(r'^(?:type|var|const)\s*\(\s*$')
+_GO_BLOCK_ITEM = re.compile(r'^\s+(\w+)\b')
+
+def _scan_go(lines):
+    in_block = False
+    for i, line in enumerate(lines):
+        if in_block:
+            if line.startswith(')'):
+                in_block = False
+                continue
+            m = _GO_BLOCK_ITEM.match(line)
+            if m and not line.lstrip().startswith('//'):
+                yield m.group(1), i
+            continue
+
+        if _GO_BLOCK.match(line):
+            in_block = True
+            continue
+        m = _GO_FUNCTION.match(line) or _GO_DECLARATION.match(line)
+        if m:
+            yield m.group(1), i
+
+_JAVA_KEYWORDS = frozenset(['if', 'else', 'for', 'while', 'do', 'switch', 'case', 'return',
+                            'new', 'throw', 'catch', 'synchronized', 'assert'])
+_JAVA_TYPE = re.compile(r'^\s*(?:[\w@]+\s+)*(?:class|interface|enum|record|@interface)\s+(\w+)')
+_JAVA_METHOD = re.compile(r'^\s*([\w.<>\[\],?]+(?:\s+[\w.<>\[\],?]+)*)\s+(\w+)\s*\(')
+
+def _scan_java(lines):
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith(('//', '/*', '*', '@')):
+            continue
+        m = _JAVA_TYPE.match(line)
+        if m:
+            yield m.group(1), i
+            continue
+        m = _JAVA_METHOD.match(line)
+        if m and m.group(1).split()[0] not in _JAVA_KEYWORDS and m.group(2) not in _JAVA_KEYWORDS:
+            yield m.group(2), i
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+SCANNERS = {}
+for _ext in ('.h', '.hh', '.hpp', '.hxx', '.H', '.c', '.C', '.cc', '.cpp', '.cxx', '.m', '.mm'):
+    SCANNERS[_ext] = _scan_c
+SCANNERS['.py'] = _scan_python
+SCANNERS['.go'] = _scan_go
+SCANNERS['.java'] = _scan_java
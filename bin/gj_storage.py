@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+Helpers to write and read gj's mmap-friendly index files.
+
+A file is a small header followed by named sections:
+
+    magic (8 bytes) | version (u32) | number of sections (u32)
+    [name (8 bytes) | offset (u64) | size (u64)] * number of sections
+    section data (8-byte aligned) ...
+
+Integer arrays are stored in the native byte order, so readers can use the
+mapped memory directly without copying or unpacking.
+'''
+
+import bisect
+import mmap
+import os
+import struct
+from array import array
+
+
+__author__ = 'fcamel'
+
+_HEADER = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<8sQQ')
+_ALIGNMENT = 8
+_NAME_SIZE = 8
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+class FormatError(Exception):
+    pass
+
+
+def has_magic(filename, magic):
+    try:
+        with open(filename, 'rb') as fr:
+            return fr.read(len(magic)) == magic
+    except (IOError, OSError):
+        return False
+
+def write_sections(filename, magic, version, sections):
+    '''
+    Write |sections|, a list of (name, data), to |filename|.
+    data is either bytes or an array.array.
+
+    The data is written to a temporary file first and then renamed,
+    so the readers never see a partial file.
+    '''
+    import tempfile
+
+    dirpath = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.gj_', dir=dirpath)
+    try:
+        with os.fdopen(fd, 'wb') as fw:
+            offset = _align(_HEADER.size + _ENTRY.size * len(sections))
+            entries = []
+            layout = []
+            for name, data in sections:
+                if len(name) > _NAME_SIZE:
+                    raise ValueError('The section name "%s" is too long.' % name)
+                size = _size_of(data)
+                entries.append(_ENTRY.pack(name.encode('ascii'), offset, size))
+                layout.append((offset, data))
+                offset = _align(offset + size)
+
+            fw.write(_HEADER.pack(magic, version, len(sections)))
+            fw.write(b''.join(entries))
+            for offset, data in layout:
+                fw.seek(offset)
+                if isinstance(data, array):
+                    data.tofile(fw)
+                else:
+                    fw.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, filename)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def pack_strings(strings):
+    '''
+    Return (offsets, pool) of a list of byte strings.
+    The i-th string is pool[offsets[i]:offsets[i + 1]].
+    '''
+    offsets = array('Q', [0])
+    total = 0
+    for s in strings:
+        total += len(s)
+        offsets.append(total)
+    return offsets, b''.join(strings)
+
+
+class SectionFile(object):
+    '''
+    A read-only, memory-mapped file written by write_sections().
+    '''
+    def __init__(self, filename, magic):
+        with open(filename, 'rb') as fr:
+            self._mmap = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        if len(self._mmap) < _HEADER.size:
+            raise FormatError('%s is truncated.' % filename)
+        file_magic, self.version, n = _HEADER.unpack_from(self._mmap, 0)
+        if file_magic != magic:
+            raise FormatError('%s is not a %s file.' % (filename, magic.decode('ascii')))
+
+        self._sections = {}
+        for i in range(n):
+            name, offset, size = _ENTRY.unpack_from(self._mmap, _HEADER.size + i * _ENTRY.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, size)
+
+    def has_section(self, name):
+        return name in self._sections
+
+    def section(self, name):
+        offset, size = self._sections[name]
+        return self._view[offset:offset + size]
+
+    def array(self, name, typecode):
+        return self.section(name).cast(typecode)
+
+    def strings(self, name):
+        '''
+        Return the StringTable saved by pack_strings() as sections
+        "<name>" (the pool) and "<name>_o" (the offsets).
+        '''
+        return StringTable(self.array(name + '_o', 'Q'), self.section(name))
+
+
+class StringTable(object):
+    '''
+    A read-only sequence of byte strings backed by (offsets, pool).
+    The strings are expected to be sorted when using find() or prefix_range().
+    '''
+    def __init__(self, offsets, pool):
+        self._offsets = offsets
+        self._pool = pool
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._pool[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def find(self, key):
+        i = bisect.bisect_left(self, key)
+        if i < len(self) and self[i] == key:
+            return i
+        return -1
+
+    def prefix_range(self, prefix):
+        # 0xff never appears in UTF-8 strings.
+        return (bisect.bisect_left(self, prefix),
+                bisect.bisect_left(self, prefix + b'\xff'))
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _align(n):
+    return (n + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def _size_of(data):
+    if isinstance(data, array):
+        return len(data) * data.itemsize
+    return len(data)
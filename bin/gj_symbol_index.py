@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+A symbol-name index of the native text index for "gj -s" and gj_symbol.
+
+lid scans every token to match a case-insensitive substring. This index
+keeps the lowercased tokens sorted in one newline-separated pool and a
+trigram index (trigram -> token ids) of them, both saved beside the text
+index as "<db>.sym":
+
+* substring: intersect the token ids of the pattern's trigrams and check
+  the candidates. Patterns shorter than 3 bytes scan the pool.
+* prefix: bisect the sorted tokens.
+* fuzzy: match the characters in order (e.g., "gtnm" matches "getName")
+  by scanning the pool with one regular expression.
+
+The file ids of the tokens are still read from the text index.
+'''
+
+import bisect
+import os
+import re
+import struct
+from array import array
+
+import gj_storage
+import gj_text_index
+
+
+__author__ = 'fcamel'
+
+MAGIC = b'GJSYMIDX'
+VERSION = 1
+SUFFIX = '.sym'
+
+MODE_SUBSTRING = 'substring'
+MODE_PREFIX = 'prefix'
+MODE_FUZZY = 'fuzzy'
+MODES = (MODE_SUBSTRING, MODE_PREFIX, MODE_FUZZY)
+
+_TRIGRAM = struct.Struct('>I')
+_SEPARATOR = b'\n'
+
+_opened_indexes = {}
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def build(db_path):
+    '''
+    Index the tokens of the native text index |db_path|.
+    Return the number of tokens.
+    '''
+    index = gj_text_index.open_index(db_path)
+    tokens = sorted(index.all_tokens(), key=lambda t: (t.lower(), t))
+    lowers = [t.lower() for t in tokens]
+
+    trigrams = {}
+    for token_id, lower in enumerate(lowers):
+        for key in set(lower[i:i + 3] for i in range(len(lower) - 2)):
+            ids = trigrams.get(key)
+            if ids is None:
+                ids = trigrams[key] = array('I')
+            ids.append(token_id)
+
+    keys = sorted(trigrams)
+    trigram_keys = array('I', (_to_int(k) for k in keys))
+    trigram_offsets = array('Q', [0])
+    postings = array('I')
+    for key in keys:
+        postings.extend(trigrams[key])
+        trigram_offsets.append(len(postings))
+
+    name_offsets, name_pool = gj_storage.pack_strings(tokens)
+    # Keep the separator in each string, so the pool can be scanned at once.
+    lower_offsets, lower_pool = gj_storage.pack_strings([l + _SEPARATOR for l in lowers])
+    gj_storage.write_sections(db_path + SUFFIX, MAGIC, VERSION, [
+        ('names_o', name_offsets),
+        ('names', name_pool),
+        ('lower_o', lower_offsets),
+        ('lower', lower_pool),
+        ('tri', trigram_keys),
+        ('tri_o', trigram_offsets),
+        ('tri_post', postings),
+        ('text_id', b''.join(index.build_ids())),
+    ])
+    return len(tokens)
+
+def open_index(db_path, text_index):
+    '''
+    Return the SymbolIndex of the text index |db_path|, or None if it is
+    not built or is older than |text_index|.
+    '''
+    path = os.path.abspath(db_path) + SUFFIX
+    try:
+        key = os.stat(path)
+        key = (key.st_mtime, key.st_size, key.st_ino)
+    except OSError:
+        return None
+    cached = _opened_indexes.get(path)
+    if cached is None or cached[0] != key:
+        try:
+            cached = _opened_indexes[path] = (key, SymbolIndex(path))
+        except gj_storage.FormatError:
+            return None
+    if cached[1].text_id != b''.join(text_index.build_ids()):
+        return None
+    return cached[1]
+
+def match(token, pattern, mode):
+    '''
+    Return True if |token| matches |pattern| case-insensitively in |mode|.
+    The same as SymbolIndex.find() but for one token.
+    '''
+    token = token.lower()
+    pattern = pattern.lower()
+    if mode == MODE_PREFIX:
+        return token.startswith(pattern)
+    if mode == MODE_FUZZY:
+        return _compile_fuzzy(pattern.encode('utf8')).search(token.encode('utf8')) is not None
+    return pattern in token
+
+
+class SymbolIndex(object):
+    def __init__(self, filename):
+        self._file = gj_storage.SectionFile(filename, MAGIC)
+        self._names = self._file.strings('names')
+        self._lowers = self._file.strings('lower')
+        self._lower_offsets = self._file.array('lower_o', 'Q')
+        self._pool = self._file.section('lower')
+        self._trigrams = self._file.array('tri', 'I')
+        self._trigram_offsets = self._file.array('tri_o', 'Q')
+        self._postings = self._file.array('tri_post', 'I')
+        self.text_id = self._file.section('text_id').tobytes()
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, pattern, mode=MODE_SUBSTRING):
+        '''
+        Return the sorted tokens which match |pattern| case-insensitively.
+        '''
+        key = pattern.lower().encode('utf8')
+        if mode == MODE_PREFIX:
+            ids = range(*self._lowers.prefix_range(key))
+        elif mode == MODE_FUZZY:
+            ids = self._scan(_compile_fuzzy(key))
+        elif len(key) < 3:
+            ids = self._scan(re.compile(re.escape(key)))
+        else:
+            ids = self._find_by_trigrams(key)
+        return sorted(self._names[i].decode('utf8') for i in ids)
+
+    def _find_by_trigrams(self, key):
+        postings = []
+        for trigram in set(key[i:i + 3] for i in range(len(key) - 2)):
+            i = bisect.bisect_left(self._trigrams, _to_int(trigram))
+            if i == len(self._trigrams) or self._trigrams[i] != _to_int(trigram):
+                return []
+            begin, end = self._trigram_offsets[i], self._trigram_offsets[i + 1]
+            postings.append(self._postings[begin:end])
+
+        # Intersect the rarest ones first.
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(ids)
+        return [i for i in candidates if key in self._lowers[i]]
+
+    def _scan(self, regex):
+        '''
+        Yield the ids of the tokens which contain a match of |regex|.
+        '''
+        offsets = self._lower_offsets
+        n = len(self._names)
+        last = -1
+        for m in regex.finditer(self._pool):
+            token_id = bisect.bisect_right(offsets, m.start()) - 1
+            if token_id >= n:
+                # An empty match at the end of the pool.
+                break
+            if token_id != last:
+                last = token_id
+                yield token_id
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+def _to_int(trigram):
+    return _TRIGRAM.unpack(b'\0' + trigram)[0]
+
+def _compile_fuzzy(key):
+    # Don't match across the separators.
+    gap = b'[^' + _SEPARATOR + b']*?'
+    return re.compile(gap.join(re.escape(key[i:i + 1]) for i in range(len(key))))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gj_symbol_index
+import gj_text_index
+import gj_util
+
+
+class SymbolIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._config = dict(gj_util.config)
+        self._root = tempfile.mkdtemp(prefix='gj_symbol_index_test_')
+        os.chdir(self._root)
+        self._write('id-lang.map', '**  IGNORE\n*.cc  text\n')
+        self._write('base/a.cc', 'int getName();\nint get_name;\nGetNameBase x;\n')
+        self._write('ui/b.cc', 'void setName(int gt);\nint GETTER;\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+        gj_symbol_index.build('ID')
+        gj_util.config['db_path'] = 'ID'
+
+    def tearDown(self):
+        gj_util.config.clear()
+        gj_util.config.update(self._config)
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fw:
+            fw.write(content)
+
+    def _open(self):
+        return gj_symbol_index.open_index('ID', gj_text_index.open_index('ID'))
+
+    def test_find(self):
+        index = self._open()
+        tokens = gj_text_index.open_index('ID').find_tokens('', substring=True)
+        for mode in gj_symbol_index.MODES:
+            for pattern in ('name', 'NAME', 'get', 'gt', 'e', 'tn', 'name_', 'xyz', ''):
+                expected = [t for t in tokens if gj_symbol_index.match(t, pattern, mode)]
+                self.assertEqual(expected, index.find(pattern, mode), (pattern, mode))
+
+        self.assertEqual(['GetNameBase', 'getName', 'get_name', 'setName'], index.find('name'))
+        self.assertEqual(['GETTER', 'GetNameBase', 'getName', 'get_name'],
+                         index.find('get', gj_symbol_index.MODE_PREFIX))
+        self.assertEqual(['GetNameBase', 'getName', 'get_name'],
+                         index.find('gtnm', gj_symbol_index.MODE_FUZZY))
+
+    def test_stale_index(self):
+        self.assertTrue(self._open() is not None)
+        self._write('ui/b.cc', 'void setName(int gt);\nint GETTER;\nint NewName;\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1, incremental=True)
+        self.assertTrue(self._open() is None)
+        # Fall back to scanning the tokens.
+        self.assertEqual(['NewName'], gj_util.find_symbols('newn'))
+
+        gj_symbol_index.build('ID')
+        self.assertEqual(['GetNameBase', 'NewName', 'getName', 'get_name', 'setName'],
+                         self._open().find('name'))
+
+    def test_find_symbols(self):
+        self.assertEqual(['GetNameBase', 'getName', 'get_name', 'setName'],
+                         gj_util.find_symbols('name'))
+        self.assertEqual(['GETTER ui/b.cc', 'gt ui/b.cc'],
+                         gj_util.find_symbols('g', path_pattern='ui/',
+                                              mode=gj_symbol_index.MODE_PREFIX))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+A native text index which can be used instead of id-utils (mkid/gid/lid).
+
+The source tree is walked with the rules in id-lang.map and the files are
+tokenized in a process pool. The result is an inverted index (token -> file
+ids) saved in the gj_storage format, so queries only map the file and read
+the parts they need.
+
+The index also records each file's mtime, size and content digest. An
+incremental build only re-tokenizes the added or modified files and saves
+them in a small delta segment ("<db>.delta") beside the base segment. The
+base files which are deleted or modified are masked out by the delta. The
+delta also keeps the new stats of the base files which are only touched
+(e.g., by switching branches), so they aren't hashed again.
+'''
+
+import os
+import re
+from array import array
+
+import gj_storage
+
+
+__author__ = 'fcamel'
+
+MAGIC = b'GJTXTIDX'
+DELTA_MAGIC = b'GJTXTDLT'
+VERSION = 2
+DELTA_SUFFIX = '.delta'
+
+# Same as id-utils' "text" scanner: a token is a run of letters, digits and underscores.
+_TOKEN_RE = re.compile(br'[A-Za-z0-9_]+')
+_WORD_CHARS = br'A-Za-z0-9_'
+_IGNORE = 'IGNORE'
+_DEFAULT_PATTERN = '**'
+# Don't walk into the version control databases. They have no source files.
+_PRUNED_DIRS = frozenset(['.git', '.hg', '.svn'])
+_CHUNK_SIZE = 64
+# The size of SHA-1. hashlib is only imported to build the index, which
+# saves the start-up time of the queries.
+_DIGEST_SIZE = 20
+# Rebuild the whole index when the delta grows larger than this ratio of the base.
+_MAX_DELTA_RATIO = 0.2
+
+_opened_indexes = {}
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def is_native(db_path):
+    return gj_storage.has_magic(db_path, MAGIC)
+
+def load_lang_map(filename):
+    '''
+    Return [(pattern, language)] in id-lang.map. The default rule "**"
+    is always the last one.
+    '''
+    rules = []
+    default = (_DEFAULT_PATTERN, _IGNORE)
+    with open(filename) as fr:
+        for line in fr:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            tokens = line.split()
+            if len(tokens) < 2:
+                continue
+            if tokens[0] == _DEFAULT_PATTERN:
+                default = (tokens[0], tokens[1])
+            else:
+                rules.append((tokens[0], tokens[1]))
+    rules.append(default)
+    return rules
+
+def get_language(path, lang_map):
+    # Only used to build the index. Importing it takes time.
+    import fnmatch
+
+    name = os.path.basename(path)
+    for pattern, language in lang_map:
+        if pattern == _DEFAULT_PATTERN:
+            return language
+        target = path if '/' in pattern else name
+        if fnmatch.fnmatchcase(target, pattern):
+            return language
+    return _IGNORE
+
+def list_files(root, lang_map, db_path=None):
+    '''
+    Return the sorted paths (relative to |root|) of the files to be indexed.
+    The database |db_path| and its side files are skipped.
+    '''
+    db_path = os.path.abspath(db_path) if db_path else None
+    result = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in _PRUNED_DIRS]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if db_path and _is_db_file(os.path.abspath(path), db_path):
+                continue
+            path = os.path.relpath(path, root)
+            if get_language(path, lang_map) != _IGNORE:
+                result.append(path)
+    result.sort()
+    return result
+
+def build(db_path, lang_map_file, root='.', jobs=None, incremental=False):
+    '''
+    Index the files under |root| and save the index to |db_path|.
+    Return the number of tokenized files.
+
+    When |incremental| is True and |db_path| is a native index, only
+    tokenize the files changed since the last full build.
+    '''
+    lang_map = load_lang_map(lang_map_file)
+    paths = list_files(root, lang_map, db_path)
+
+    if incremental and is_native(db_path):
+        base = _Segment(db_path, MAGIC)
+        if base.has_stats():
+            n = _build_delta(db_path, base, root, paths, jobs)
+            if n is not None:
+                return n
+
+    return _build_base(db_path, root, paths, jobs)
+
+def get_display_base(root):
+    '''
+    Return (prefix, cwd_prefix) to display the paths relative to |root|
+    like gid, i.e., relative to the current directory. If the current
+    directory is under |root|, |cwd_prefix| is its path relative to |root|
+    ("" or ending with "/"): the paths with it are displayed without it and
+    the other paths are normalized, e.g., "../b/c.cc" instead of
+    "../../a/b/c.cc". Otherwise |cwd_prefix| is None and the paths are
+    displayed after |prefix|.
+    '''
+    prefix = os.path.relpath(root)
+    if prefix == '.':
+        return '', ''
+    if all(part == '..' for part in prefix.split(os.sep)):
+        return prefix, os.path.relpath(os.getcwd(), root) + '/'
+    return prefix, None
+
+def display_path(root, path, base):
+    '''
+    Return |path| relative to |root| as displayed by gid. |base| is the
+    result of get_display_base(|root|).
+    '''
+    prefix, cwd_prefix = base
+    if cwd_prefix is None:
+        return os.path.join(prefix, path) if prefix else path
+    if path.startswith(cwd_prefix):
+        return path[len(cwd_prefix):]
+    return os.path.relpath(os.path.join(root, path))
+
+def open_index(db_path):
+    '''
+    Return the TextIndex of |db_path|. The opened index is reused until
+    the files are rewritten.
+    '''
+    path = os.path.abspath(db_path)
+    key = (_file_key(path), _file_key(path + DELTA_SUFFIX))
+    cached = _opened_indexes.get(path)
+    if cached is None or cached[0] != key:
+        cached = _opened_indexes[path] = (key, TextIndex(path))
+    return cached[1]
+
+
+class TextIndex(object):
+    '''
+    The base segment plus the optional delta segment.
+
+    The file ids of the delta segment follow the ones of the base segment.
+    '''
+    def __init__(self, db_path):
+        self.root = os.path.dirname(os.path.abspath(db_path))
+        self._base = _Segment(db_path, MAGIC)
+        self._delta = None
+        self._deleted = frozenset()
+        delta_path = db_path + DELTA_SUFFIX
+        if os.path.exists(delta_path):
+            delta = _Segment(delta_path, DELTA_MAGIC)
+            if delta.base_id() == self._base.build_id():
+                self._delta = delta
+                self._deleted = frozenset(delta.deleted())
+        self._n_base = self._base.file_count()
+        # file_id -> content of the recently read files. See cache_files().
+        self._file_cache = None
+        self._file_cache_bytes = 0
+        self._max_file_cache_bytes = 0
+
+    def file_count(self):
+        n = self._n_base
+        if self._delta:
+            n += self._delta.file_count()
+        return n
+
+    def path(self, file_id):
+        '''
+        Return the path relative to the root of the index. None if the file
+        is deleted.
+        '''
+        if file_id < self._n_base:
+            if file_id in self._deleted:
+                return None
+            return self._base.paths[file_id].decode('utf8')
+        return self._delta.paths[file_id - self._n_base].decode('utf8')
+
+    def file_ids(self, token):
+        '''
+        Return the ids of the files which contain |token|.
+        '''
+        key = token.encode('utf8')
+        ids = self._base.file_ids(key)
+        if not self._delta:
+            return ids
+        if self._deleted:
+            ids = [i for i in ids if i not in self._deleted]
+        else:
+            ids = list(ids)
+        ids.extend(self._n_base + i for i in self._delta.file_ids(key))
+        return ids
+
+    def file_ids_with_prefix(self, prefix):
+        '''
+        Return the ids of the files whose paths displayed by grep() start
+        with |prefix|. Only the matched part of the sorted paths is visited.
+        '''
+        base = get_display_base(self.root)
+        display_prefix, cwd_prefix = base
+        if cwd_prefix is not None:
+            if prefix.startswith('.'):
+                # It may be a path outside the current directory (e.g.,
+                # "../a"), which isn't in the order of the sorted paths.
+                return [i for i in self._file_ids()
+                        if self.display_path(i, base).startswith(prefix)]
+            if prefix:
+                prefix = cwd_prefix + prefix
+        elif display_prefix:
+            display_prefix += '/'
+            if prefix.startswith(display_prefix):
+                prefix = prefix[len(display_prefix):]
+            elif display_prefix.startswith(prefix):
+                prefix = ''
+            else:
+                return []
+
+        key = prefix.encode('utf8')
+        begin, end = self._base.paths.prefix_range(key)
+        if self._deleted:
+            result = [i for i in range(begin, end) if i not in self._deleted]
+        else:
+            result = list(range(begin, end))
+        if self._delta:
+            paths = self._delta.paths
+            result.extend(self._n_base + i for i in range(len(paths))
+                          if paths[i].startswith(key))
+        return result
+
+    def file_ids_with_substring(self, substring):
+        '''
+        Return the ids of the files whose paths displayed by grep() contain
+        |substring|.
+        '''
+        base = get_display_base(self.root)
+        return [i for i in self._file_ids() if substring in self.display_path(i, base)]
+
+    def display_path(self, file_id, base=None):
+        '''
+        Return the path of |file_id| relative to the current directory like
+        gid. |base| is the cached result of get_display_base().
+        '''
+        return display_path(self.root, self.path(file_id), base or get_display_base(self.root))
+
+    def grep(self, token, file_ids=None):
+        '''
+        Return the lines containing the word |token| in the same format
+        as gid: "path:line_num:text".
+        '''
+        return list(self.iter_grep(token, file_ids))
+
+    def iter_grep(self, token, file_ids=None):
+        '''
+        The same as grep() but yield the lines file by file, so the caller
+        can stop reading the files once it has enough lines.
+        '''
+        if file_ids is None:
+            file_ids = self.file_ids(token)
+        regex = _compile_word(token)
+        base = get_display_base(self.root)
+        for file_id in file_ids:
+            data = self._read(file_id)
+            if data is None:
+                continue
+            path = self.display_path(file_id, base)
+            for line_num, line in _grep_lines(regex, data):
+                try:
+                    text = line.decode('utf8')
+                except UnicodeDecodeError:
+                    continue
+                yield '%s:%d:%s' % (path, line_num, text)
+
+    def find_tokens(self, pattern, ignore_case=False, substring=False):
+        '''
+        Return the sorted tokens which match |pattern|.
+        '''
+        key = pattern.encode('utf8')
+        if ignore_case:
+            key = key.lower()
+        result = set()
+        for segment in self._segments():
+            if not ignore_case and not substring:
+                if segment.tokens.find(key) >= 0:
+                    result.add(key)
+                continue
+            for i in range(len(segment.tokens)):
+                token = segment.tokens[i]
+                target = token.lower() if ignore_case else token
+                if (key in target) if substring else (key == target):
+                    result.add(token)
+        if self._delta:
+            # The token may only exist in the deleted files.
+            result = [t for t in result if self.file_ids(t.decode('utf8'))]
+        return [t.decode('utf8') for t in sorted(result)]
+
+    def all_tokens(self):
+        '''
+        Return the set of the tokens in bytes. A token may only exist in
+        the deleted files.
+        '''
+        result = set()
+        for segment in self._segments():
+            tokens = segment.tokens
+            result.update(tokens[i] for i in range(len(tokens)))
+        return result
+
+    def build_ids(self):
+        '''
+        Return the ids of the segments, which change after each build.
+        '''
+        return tuple(segment.build_id() for segment in self._segments())
+
+    def lid(self, pattern, ignore_case=False, substring=False, with_paths=True):
+        '''
+        Return the lines in the same format as lid: "token path path ...".
+        '''
+        base = get_display_base(self.root)
+        result = []
+        for token in self.find_tokens(pattern, ignore_case, substring):
+            tokens = [token]
+            if with_paths:
+                tokens.extend(self.display_path(f, base) for f in self.file_ids(token))
+            result.append(' '.join(tokens))
+        return result
+
+    def _segments(self):
+        if self._delta:
+            return (self._base, self._delta)
+        return (self._base,)
+
+    def cache_files(self, max_bytes):
+        '''
+        Keep the contents of the recently read files in memory, up to
+        |max_bytes| bytes in total. Many queries in one process (e.g.,
+        "gj --bulk") often read the same files.
+        '''
+        import collections
+
+        self._file_cache = collections.OrderedDict()
+        self._file_cache_bytes = 0
+        self._max_file_cache_bytes = max_bytes
+
+    def _file_ids(self):
+        return [i for i in range(self.file_count()) if self.path(i) is not None]
+
+    def _read(self, file_id):
+        cache = self._file_cache
+        if cache is not None and file_id in cache:
+            # Move it to the end as the most recently used one.
+            data = cache[file_id] = cache.pop(file_id)
+            return data
+
+        path = self.path(file_id)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(self.root, path), 'rb') as fr:
+                data = fr.read()
+        except (IOError, OSError):
+            return None
+
+        if cache is not None and len(data) <= self._max_file_cache_bytes:
+            cache[file_id] = data
+            self._file_cache_bytes += len(data)
+            while self._file_cache_bytes > self._max_file_cache_bytes:
+                # The first one is the least recently used one.
+                oldest = next(iter(cache))
+                self._file_cache_bytes -= len(cache.pop(oldest))
+        return data
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+class _Segment(object):
+    def __init__(self, filename, magic):
+        self._file = gj_storage.SectionFile(filename, magic)
+        self.paths = self._file.strings('paths')
+        self.tokens = self._file.strings('tokens')
+        self._posting_offsets = self._file.array('post_o', 'Q')
+        self._postings = self._file.array('post', 'I')
+        if self.has_stats():
+            self._mtimes = self._file.array('mtime', 'd')
+            self._sizes = self._file.array('size', 'Q')
+            self._digests = self._file.section('digest')
+
+    def file_count(self):
+        return len(self.paths)
+
+    def file_ids(self, token):
+        i = self.tokens.find(token)
+        if i < 0:
+            return self._postings[0:0]
+        return self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]]
+
+    def has_stats(self):
+        return self._file.has_section('mtime')
+
+    def stat(self, file_id):
+        '''
+        Return (mtime, size, digest) of the file when it was indexed.
+        '''
+        begin = file_id * _DIGEST_SIZE
+        return (self._mtimes[file_id],
+                self._sizes[file_id],
+                self._digests[begin:begin + _DIGEST_SIZE].tobytes())
+
+    def tokens_of_files(self):
+        '''
+        Return {file_id: [token]}. Only used for the small delta segment.
+        '''
+        result = {}
+        for i in range(len(self.tokens)):
+            token = self.tokens[i]
+            for file_id in self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]]:
+                result.setdefault(file_id, []).append(token)
+        return result
+
+    def build_id(self):
+        return self._file.section('build_id').tobytes()
+
+    def base_id(self):
+        return self._file.section('base_id').tobytes()
+
+    def deleted(self):
+        return self._file.array('deleted', 'I')
+
+    def touched(self):
+        '''
+        Return {base file_id: (mtime, size)} of the files in the base segment
+        whose mtimes are changed but the contents are not.
+        '''
+        ids = self._file.array('touched', 'I')
+        mtimes = self._file.array('t_mtime', 'd')
+        sizes = self._file.array('t_size', 'Q')
+        return dict((ids[i], (mtimes[i], sizes[i])) for i in range(len(ids)))
+
+
+def _build_base(db_path, root, paths, jobs):
+    stats = [_stat(os.path.join(root, p)) for p in paths]
+    jobs_args = [(os.path.join(root, p), None) for p in paths]
+    files = []
+    for path, st, (digest, tokens) in zip(paths, stats, _map(_scan, jobs_args, jobs)):
+        if digest is not None:
+            files.append((path, st, digest, tokens))
+
+    _save(db_path, MAGIC, files, [
+        ('build_id', os.urandom(16)),
+    ])
+    if os.path.exists(db_path + DELTA_SUFFIX):
+        os.unlink(db_path + DELTA_SUFFIX)
+    return len(files)
+
+def _build_delta(db_path, base, root, paths, jobs):
+    '''
+    Save the files which differ from |base| to the delta segment.
+    Return the number of tokenized files, or None if the delta is
+    too large and a full build is better.
+    '''
+    base_ids = {}
+    for i in range(base.file_count()):
+        base_ids[base.paths[i].decode('utf8')] = i
+
+    # The files in the previous delta. Reuse their tokens if they are unchanged.
+    old_delta = {}
+    old_touched = {}
+    delta_path = db_path + DELTA_SUFFIX
+    if os.path.exists(delta_path):
+        delta = _Segment(delta_path, DELTA_MAGIC)
+        if delta.base_id() == base.build_id():
+            tokens_of_files = delta.tokens_of_files()
+            for i in range(delta.file_count()):
+                path = delta.paths[i].decode('utf8')
+                old_delta[path] = (delta.stat(i), tokens_of_files.get(i, []))
+            old_touched = delta.touched()
+
+    files = []
+    deleted = set(base_ids.values())
+    # base file_id -> (mtime, size) of the files only touched (e.g., by
+    # switching branches). Save their stats to skip them next time.
+    touched = {}
+    scanned = []
+    for path in paths:
+        st = _stat(os.path.join(root, path))
+        base_id = base_ids.get(path)
+        if base_id is not None:
+            deleted.discard(base_id)
+            mtime, size, digest = base.stat(base_id)
+            if (mtime, size) == st:
+                continue
+            if old_touched.get(base_id) == st:
+                touched[base_id] = st
+                continue
+        else:
+            digest = None
+
+        if path in old_delta:
+            (mtime, size, delta_digest), tokens = old_delta[path]
+            if (mtime, size) == st:
+                files.append((path, st, delta_digest, tokens))
+                if base_id is not None:
+                    deleted.add(base_id)
+                continue
+        scanned.append((path, st, base_id, digest))
+
+    jobs_args = [(os.path.join(root, path), digest) for path, _, _, digest in scanned]
+    for (path, st, base_id, _), (digest, tokens) in zip(scanned, _map(_scan, jobs_args, jobs)):
+        if digest is None:
+            # Failed to read it.
+            if base_id is not None:
+                deleted.add(base_id)
+            continue
+        if tokens is None:
+            # Only the mtime is changed. The base segment is still correct.
+            touched[base_id] = st
+            continue
+        files.append((path, st, digest, tokens))
+        if base_id is not None:
+            deleted.add(base_id)
+
+    if len(files) + len(deleted) > base.file_count() * _MAX_DELTA_RATIO:
+        return None
+
+    if not files and not deleted and not touched:
+        if os.path.exists(delta_path):
+            os.unlink(delta_path)
+        return len(scanned)
+
+    files.sort()
+    touched_ids = sorted(touched)
+    _save(delta_path, DELTA_MAGIC, files, [
+        ('build_id', os.urandom(16)),
+        ('base_id', base.build_id()),
+        ('deleted', array('I', sorted(deleted))),
+        ('touched', array('I', touched_ids)),
+        ('t_mtime', array('d', [touched[i][0] for i in touched_ids])),
+        ('t_size', array('Q', [touched[i][1] for i in touched_ids])),
+    ])
+    return len(scanned)
+
+def _is_db_file(path, db_path):
+    return path == db_path or path.startswith(db_path + '.')
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (0.0, 0)
+    return (st.st_mtime, st.st_size)
+
+def _map(func, items, jobs):
+    import multiprocessing
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(items) <= _CHUNK_SIZE:
+        return map(func, items)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # imap() keeps the order, so the file ids are deterministic.
+        return list(pool.imap(func, items, _CHUNK_SIZE))
+    finally:
+        pool.close()
+        pool.join()
+
+def _scan(args):
+    '''
+    Return (digest, tokens) of the file. tokens is None if the digest
+    equals to the old one. digest is None if the file is unreadable.
+    '''
+    import hashlib
+
+    path, old_digest = args
+    try:
+        with open(path, 'rb') as fr:
+            data = fr.read()
+    except (IOError, OSError):
+        return None, None
+    digest = hashlib.sha1(data).digest()
+    if digest == old_digest:
+        return digest, None
+    return digest, sorted(set(_TOKEN_RE.findall(data)))
+
+def _save(filename, magic, files, extra_sections):
+    '''
+    |files| is a list of (path, (mtime, size), digest, tokens) sorted by path.
+    '''
+    postings = {}
+    for file_id, (_, _, _, tokens) in enumerate(files):
+        for token in tokens:
+            ids = postings.get(token)
+            if ids is None:
+                ids = postings[token] = array('I')
+            ids.append(file_id)
+
+    tokens = sorted(postings)
+    posting_offsets = array('Q', [0])
+    all_postings = array('I')
+    for token in tokens:
+        all_postings.extend(postings[token])
+        posting_offsets.append(len(all_postings))
+
+    path_offsets, path_pool = gj_storage.pack_strings([f[0].encode('utf8') for f in files])
+    token_offsets, token_pool = gj_storage.pack_strings(tokens)
+    gj_storage.write_sections(filename, magic, VERSION, [
+        ('paths_o', path_offsets),
+        ('paths', path_pool),
+        ('tokens_o', token_offsets),
+        ('tokens', token_pool),
+        ('post_o', posting_offsets),
+        ('post', all_postings),
+        ('mtime', array('d', [f[1][0] for f in files])),
+        ('size', array('Q', [f[1][1] for f in files])),
+        ('digest', b''.join(f[2] for f in files)),
+    ] + extra_sections)
+
+def _compile_word(token):
+    word = re.escape(token.encode('utf8'))
+    return re.compile(b'(?<![' + _WORD_CHARS + b'])' + word + b'(?![' + _WORD_CHARS + b'])')
+
+def _grep_lines(regex, data):
+    '''
+    Yield (line_num, line) of the lines in |data| which match |regex|.
+    '''
+    line_num = 1
+    pos = 0
+    line_end = -1
+    for m in regex.finditer(data):
+        begin = m.start()
+        if begin <= line_end:
+            # Already yielded this line.
+            continue
+        line_num += data.count(b'\n', pos, begin)
+        pos = begin
+        line_begin = data.rfind(b'\n', 0, begin) + 1
+        line_end = data.find(b'\n', begin)
+        if line_end < 0:
+            line_end = len(data)
+        yield line_num, data[line_begin:line_end]
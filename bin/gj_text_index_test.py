@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gj_text_index
+
+
+class TextIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._root = tempfile.mkdtemp(prefix='gj_text_index_test_')
+        self._lang_map = os.path.join(self._root, 'id-lang.map')
+        self._write('id-lang.map', '**  IGNORE\n*.cc  text\n*.py  text\n')
+        self._write('src/a.cc', 'int Foo(int x) {\n  return x;\n}\n// Foo and Foo\nFooBar();\n')
+        self._write('src/b.py', 'def Foo():\n    pass\n')
+        self._write('src/c.txt', 'Foo\n')
+        self._write('.git/d.cc', 'Foo\n')
+        os.chdir(self._root)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _write(self, path, content):
+        path = os.path.join(self._root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fw:
+            fw.write(content)
+
+    def _build(self, jobs=1, incremental=False):
+        n = gj_text_index.build('ID', self._lang_map, jobs=jobs, incremental=incremental)
+        return n, gj_text_index.open_index('ID')
+
+    def _paths(self, index):
+        paths = [index.path(i) for i in range(index.file_count())]
+        return [p for p in paths if p is not None]
+
+    def test_load_lang_map(self):
+        lang_map = gj_text_index.load_lang_map(self._lang_map)
+        self.assertEqual([('*.cc', 'text'), ('*.py', 'text'), ('**', 'IGNORE')], lang_map)
+        self.assertEqual('text', gj_text_index.get_language('x/y.cc', lang_map))
+        self.assertEqual('IGNORE', gj_text_index.get_language('x/y.txt', lang_map))
+
+    def test_build(self):
+        n, index = self._build()
+        self.assertEqual(2, n)
+        self.assertTrue(gj_text_index.is_native('ID'))
+        self.assertEqual(['src/a.cc', 'src/b.py'], self._paths(index))
+        self.assertEqual([0, 1], list(index.file_ids('Foo')))
+        self.assertEqual([0], list(index.file_ids('FooBar')))
+        self.assertEqual([], list(index.file_ids('Fo')))
+
+    def test_build_in_parallel(self):
+        for i in range(100):
+            self._write('many/%03d.py' % i, 'token%d = Foo\n' % i)
+        _, expected = self._build(jobs=1)
+        expected = (self._paths(expected), expected.find_tokens('', substring=True),
+                    list(expected.file_ids('Foo')))
+        _, actual = self._build(jobs=2)
+        actual = (self._paths(actual), actual.find_tokens('', substring=True),
+                  list(actual.file_ids('Foo')))
+        self.assertEqual(expected, actual)
+
+    def test_grep(self):
+        _, index = self._build()
+        expected = [
+            'src/a.cc:1:int Foo(int x) {',
+            'src/a.cc:4:// Foo and Foo',
+            'src/b.py:1:def Foo():',
+        ]
+        self.assertEqual(expected, index.grep('Foo'))
+
+        os.chdir('src')
+        self.assertEqual(['a.cc:5:FooBar();'], index.grep('FooBar'))
+
+    def test_query_in_subdirectory(self):
+        self._write('lib/e.py', 'Foo = 1\n')
+        _, index = self._build()
+        # The paths are relative to the current directory like gid.
+        os.chdir('src')
+        self.assertEqual(['../lib/e.py:1:Foo = 1', 'a.cc:1:int Foo(int x) {',
+                          'a.cc:4:// Foo and Foo', 'b.py:1:def Foo():'], index.grep('Foo'))
+        self.assertEqual(['Foo ../lib/e.py a.cc b.py'], index.lid('Foo'))
+        paths = lambda ids: [index.path(i) for i in ids]
+        self.assertEqual(['src/a.cc'], paths(index.file_ids_with_prefix('a')))
+        self.assertEqual(['lib/e.py'], paths(index.file_ids_with_prefix('../l')))
+        self.assertEqual(['lib/e.py', 'src/a.cc', 'src/b.py'],
+                         paths(index.file_ids_with_prefix('')))
+        self.assertEqual(['lib/e.py'], paths(index.file_ids_with_substring('./')))
+
+        os.chdir(os.path.join(self._root, 'lib'))
+        self.assertEqual(['../src/a.cc:5:FooBar();'], index.grep('FooBar'))
+
+    def test_cache_files(self):
+        _, index = self._build()
+        index.cache_files(len('int Foo(int x) {\n  return x;\n}\n// Foo and Foo\nFooBar();\n'))
+        self.assertEqual(3, len(index.grep('Foo')))
+        self._write('src/a.cc', 'Foo();\n')
+        self._write('src/b.py', 'Foo()\n')
+        # b.py is cached but a.cc is evicted to keep the size limit.
+        self.assertEqual(['src/a.cc:1:Foo();', 'src/b.py:1:def Foo():'], index.grep('Foo'))
+
+    def test_lid(self):
+        _, index = self._build()
+        self.assertEqual(['Foo', 'FooBar'], index.lid('foo', ignore_case=True, substring=True,
+                                                      with_paths=False))
+        self.assertEqual(['FooBar src/a.cc'], index.lid('ooB', substring=True))
+        self.assertEqual([], index.lid('foo'))
+
+    def test_incremental_build(self):
+        for i in range(20):
+            self._write('many/%02d.py' % i, 'x%d = 1\n' % i)
+        n, _ = self._build()
+        self.assertEqual(22, n)
+
+        # Nothing changed.
+        n, index = self._build(incremental=True)
+        self.assertEqual(0, n)
+        self.assertFalse(os.path.exists('ID' + gj_text_index.DELTA_SUFFIX))
+
+        # Modify, add and delete files.
+        self._write('src/b.py', 'def Bar():\n    pass\n')
+        self._write('src/e.py', 'Foo = Bar\n')
+        os.unlink(os.path.join(self._root, 'src/a.cc'))
+        n, index = self._build(incremental=True)
+        self.assertEqual(2, n)
+        self.assertTrue(os.path.exists('ID' + gj_text_index.DELTA_SUFFIX))
+        self.assertEqual(['src/e.py:1:Foo = Bar'], index.grep('Foo'))
+        self.assertEqual(['src/b.py:1:def Bar():', 'src/e.py:1:Foo = Bar'],
+                         sorted(index.grep('Bar')))
+        # FooBar only exists in the deleted file.
+        self.assertEqual([], index.find_tokens('foob', ignore_case=True, substring=True))
+        self.assertEqual([], index.find_tokens('FooBar'))
+
+        paths = lambda ids: sorted(index.path(i) for i in ids)
+        self.assertEqual(['src/b.py', 'src/e.py'], paths(index.file_ids_with_prefix('src/')))
+        self.assertEqual(['many/00.py'], paths(index.file_ids_with_prefix('many/00')))
+        os.chdir('src')
+        self.assertEqual(['src/b.py'], paths(index.file_ids_with_prefix('b')))
+        self.assertEqual(20, len(index.file_ids_with_prefix('..')))
+        self.assertEqual([], index.file_ids_with_prefix('../src/b'))
+        os.chdir(self._root)
+
+        # Touch a file without changing it.
+        os.utime(os.path.join(self._root, 'src/e.py'), (1, 1))
+        n, index = self._build(incremental=True)
+        self.assertEqual(1, n)
+        self.assertEqual(['src/e.py:1:Foo = Bar'], index.grep('Foo'))
+        # The new mtime is saved, so it isn't read again.
+        n, index = self._build(incremental=True)
+        self.assertEqual(0, n)
+        self.assertEqual(['src/e.py:1:Foo = Bar'], index.grep('Foo'))
+
+        # A full build removes the delta.
+        n, index = self._build()
+        self.assertFalse(os.path.exists('ID' + gj_text_index.DELTA_SUFFIX))
+        self.assertEqual(['src/e.py:1:Foo = Bar'], index.grep('Foo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+'''
+Opt-in timing of the stages of the queries and indexing.
+
+Enable it by "--profile MODE" of gj and gj_index.py, or by the environment
+variable GJ_PROFILE=MODE:
+
+* table: print the stages in a table to stderr at exit.
+* json: print one JSON object per stage to stderr at exit.
+* cprofile: print the table and run the whole program in cProfile.
+
+GJ_PROFILE_OUTPUT=FILE (or --profile-output) writes the report to FILE
+instead. In the cprofile mode, FILE gets the stats of cProfile, which can be
+read by pstats or snakeviz.
+
+Each stage records the number of calls, the number of items, the wall time
+and the CPU time. The stages may be nested and the times are inclusive; the
+"self" times exclude the nested stages. The stages run in the worker
+processes (e.g., reading the ELF files with -j > 1) are not recorded.
+
+When it's disabled, stage() returns a shared no-op object and iterate()
+and wrap() return their arguments, so the cost is negligible.
+'''
+
+import atexit
+import os
+import sys
+import time
+
+
+__author__ = 'fcamel'
+
+MODE_TABLE = 'table'
+MODE_JSON = 'json'
+MODE_CPROFILE = 'cprofile'
+MODES = (MODE_TABLE, MODE_JSON, MODE_CPROFILE)
+
+_mode = None
+_output = None
+_profiler = None
+# name -> [calls, items, wall, cpu, self wall, self cpu] in the first-seen order.
+_stats = {}
+_order = []
+# The running stages: [name, wall begin, cpu begin, nested wall, nested cpu].
+_stack = []
+
+#------------------------------------------------------------------------------
+# public
+#------------------------------------------------------------------------------
+def start(mode=None, output=None):
+    '''
+    Start tracing in |mode| (default: $GJ_PROFILE) and report at exit.
+    Do nothing if the mode is empty.
+    '''
+    global _mode, _output, _profiler
+
+    mode = mode or os.environ.get('GJ_PROFILE', '')
+    if not mode or _mode:
+        return
+    if mode not in MODES:
+        sys.stderr.write('Unknown profile mode "%s". Use one of %s.\n' % (mode, ', '.join(MODES)))
+        return
+    _mode = mode
+    _output = output or os.environ.get('GJ_PROFILE_OUTPUT', '')
+    if mode == MODE_CPROFILE:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(stop)
+
+def add_options(parser):
+    '''
+    Add --profile and --profile-output to the OptionParser |parser|.
+    '''
+    parser.add_option('--profile', dest='profile',
+                      type='choice', choices=MODES, default=None,
+                      help=('Report the time of each stage to stderr at exit: %s'
+                            ' (default: $GJ_PROFILE).' % ', '.join(MODES)))
+    parser.add_option('--profile-output', dest='profile_output',
+                      type='string', default='',
+                      help=('Write the report of --profile to the file instead'
+                            ' (default: $GJ_PROFILE_OUTPUT).'))
+
+def stop():
+    '''
+    Stop tracing and output the report.
+    '''
+    global _mode, _profiler
+
+    if not _mode:
+        return
+    mode, _mode = _mode, None
+    if _profiler:
+        _profiler.disable()
+
+    if mode == MODE_CPROFILE and _output:
+        _profiler.dump_stats(_output)
+        _write_table(sys.stderr)
+    elif _output:
+        with open(_output, 'w') as fw:
+            _write_report(fw, mode)
+    else:
+        _write_report(sys.stderr, mode)
+
+    if mode == MODE_CPROFILE and not _output:
+        import pstats
+        pstats.Stats(_profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    _profiler = None
+
+def is_enabled():
+    return _mode is not None
+
+def stage(name):
+    '''
+    Return a context manager which records the stage |name|. Set "items"
+    of the returned object to record the number of the processed items.
+    '''
+    if _mode is None:
+        return _NULL_STAGE
+    return _Stage(name)
+
+def iterate(name, iterable):
+    '''
+    Return an iterator of |iterable| which records the time spent in
+    getting the items as the stage |name|.
+    '''
+    if _mode is None:
+        return iterable
+    return _iterate(name, iterable)
+
+def wrap(name, func):
+    '''
+    Return a function which records each call of |func| as the stage |name|.
+    '''
+    if _mode is None:
+        return func
+    def traced(*args, **kwargs):
+        _begin(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _end(1, 1)
+    return traced
+
+def get_stats():
+    '''
+    Return the records of the stages in the first-seen order.
+    '''
+    result = []
+    for name in _order:
+        calls, items, wall, cpu, self_wall, self_cpu = _stats[name]
+        result.append({
+            'stage': name,
+            'calls': calls,
+            'items': items,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'self_wall_seconds': round(self_wall, 6),
+            'self_cpu_seconds': round(self_cpu, 6),
+        })
+    return result
+
+def reset():
+    del _order[:]
+    _stats.clear()
+    del _stack[:]
+
+#------------------------------------------------------------------------------
+# private
+#------------------------------------------------------------------------------
+class _Stage(object):
+    __slots__ = ('name', 'items')
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+
+    def __enter__(self):
+        _begin(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _end(1, self.items)
+        return False
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        # Ignore "items".
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _iterate(name, iterable):
+    iterator = iter(iterable)
+    calls = 1
+    while True:
+        _begin(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            _end(calls, 0)
+            return
+        except:
+            _end(calls, 0)
+            raise
+        _end(calls, 1)
+        calls = 0
+        yield item
+
+def _begin(name):
+    if name not in _stats:
+        _stats[name] = [0, 0, 0.0, 0.0, 0.0, 0.0]
+        _order.append(name)
+    _stack.append([name, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+def _end(calls, items):
+    name, wall_begin, cpu_begin, nested_wall, nested_cpu = _stack.pop()
+    wall = time.perf_counter() - wall_begin
+    cpu = time.process_time() - cpu_begin
+    stats = _stats[name]
+    stats[0] += calls
+    stats[1] += items
+    if not any(frame[0] == name for frame in _stack):
+        # Don't count the recursive calls twice.
+        stats[2] += wall
+        stats[3] += cpu
+    stats[4] += wall - nested_wall
+    stats[5] += cpu - nested_cpu
+    if _stack:
+        _stack[-1][3] += wall
+        _stack[-1][4] += cpu
+
+def _write_report(stream, mode):
+    import json
+
+    if mode == MODE_JSON:
+        for record in get_stats():
+            stream.write(json.dumps(record, sort_keys=True) + '\n')
+    else:
+        _write_table(stream)
+
+def _write_table(stream):
+    stream.write('%-24s %8s %10s %10s %10s %10s %10s\n'
+                 % ('stage', 'calls', 'items', 'wall(s)', 'self(s)', 'cpu(s)', 'self cpu'))
+    for r in get_stats():
+        stream.write('%-24s %8d %10d %10.3f %10.3f %10.3f %10.3f\n'
+                     % (r['stage'], r['calls'], r['items'], r['wall_seconds'],
+                        r['self_wall_seconds'], r['cpu_seconds'], r['self_cpu_seconds']))
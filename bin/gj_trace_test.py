@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- encoding: utf8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import gj_trace
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp(prefix='gj_trace_test_')
+        self._output = os.path.join(self._root, 'report')
+        gj_trace.reset()
+
+    def tearDown(self):
+        gj_trace.stop()
+        gj_trace.reset()
+        shutil.rmtree(self._root)
+
+    def _get_stats(self):
+        return dict((r['stage'], r) for r in gj_trace.get_stats())
+
+    def test_disabled(self):
+        self.assertFalse(gj_trace.is_enabled())
+        items = [1, 2]
+        self.assertTrue(gj_trace.iterate('a', items) is items)
+        self.assertTrue(gj_trace.wrap('b', len) is len)
+        with gj_trace.stage('c') as stage:
+            stage.items = 3
+        self.assertEqual([], gj_trace.get_stats())
+
+    def test_stages(self):
+        gj_trace.start(gj_trace.MODE_JSON, self._output)
+        self.assertTrue(gj_trace.is_enabled())
+        with gj_trace.stage('query') as stage:
+            lines = gj_trace.iterate('read', ['a', 'bb', 'ccc'])
+            length = gj_trace.wrap('length', len)
+            stage.items = sum(length(line) for line in lines)
+
+        stats = self._get_stats()
+        self.assertEqual(['query', 'read', 'length'], [r['stage'] for r in gj_trace.get_stats()])
+        self.assertEqual((1, 6), (stats['query']['calls'], stats['query']['items']))
+        self.assertEqual((1, 3), (stats['read']['calls'], stats['read']['items']))
+        self.assertEqual((3, 3), (stats['length']['calls'], stats['length']['items']))
+        # The nested stages are included in the wall time, but not the self time.
+        query = stats['query']
+        nested = stats['read']['wall_seconds'] + stats['length']['wall_seconds']
+        self.assertAlmostEqual(query['wall_seconds'], query['self_wall_seconds'] + nested, places=5)
+
+        gj_trace.stop()
+        self.assertFalse(gj_trace.is_enabled())
+        with open(self._output) as fr:
+            records = [json.loads(line) for line in fr]
+        self.assertEqual(['query', 'read', 'length'], [r['stage'] for r in records])
+
+    def test_table(self):
+        gj_trace.start(gj_trace.MODE_TABLE, self._output)
+        with gj_trace.stage('sort') as stage:
+            stage.items = 10
+        gj_trace.stop()
+        with open(self._output) as fr:
+            lines = fr.read().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(['sort', '1', '10'], lines[1].split()[:3])
+
+    def test_exception(self):
+        gj_trace.start(gj_trace.MODE_TABLE, self._output)
+        def fail():
+            raise ValueError()
+        self.assertRaises(ValueError, gj_trace.wrap('fail', fail))
+        self.assertEqual(1, self._get_stats()['fail']['calls'])
+        # The failed call doesn't leave its stage running.
+        with gj_trace.stage('query'):
+            pass
+        query = self._get_stats()['query']
+        self.assertEqual(query['wall_seconds'], query['self_wall_seconds'])
+        self.assertEqual(1, self._get_stats()['fail']['items'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 # -*- encoding: utf8 -*-
 
-try:
-    import cPickle as pickle
-except Exception as e:
-    # Python 3 doesn't have cPickle.
-    import pickle
-
+# Only import the modules used by all lookups here. gj and the editor
+# plugins start a new process for each lookup. Import the others (e.g.,
+# subprocess and the indexes) where they are used.
+import bisect
+import heapq
+import itertools
 import os
-import platform
 import re
-import subprocess
 import sys
+from array import array
+
+try:
+    intern
+except NameError:
+    # Python 3 moves intern() to sys.
+    from sys import intern
 
 
 __author__ = 'fcamel'
@@ -21,33 +26,66 @@ __author__ = 'fcamel'
 #------------------------------------------------------------------------------
 
 LANG_MAP_FILE         = "id-lang.map"
+# Engines to build the text index.
+ENGINE_MKID           = 'mkid'
+ENGINE_NATIVE         = 'native'
+ENGINES               = (ENGINE_MKID, ENGINE_NATIVE)
 DEFINITION_INDEX_FILE = 'gj.index'
 CONFIG_FILE           = '.gjconfig'
+# The paths of the commands found in $PATH are cached beside the text index.
+TOOLS_SUFFIX          = '.tools'
 
 # Input mappings
 A_KEEP_STATEMENT       = ';'
 A_CLEAN_STATEMENT      = '!;'
 A_FOLD                 = '.'
 A_RESTART              = '~'
+A_NEXT_PAGE            = '>'
+A_PREV_PAGE            = '<'
+A_JUMP                 = '@'
 
 ENABLE_COLOR_OUTPUT = not sys.stdout.isatty()
 
 DEFAULT_CODE_LENGTH = 80
+# The lines used by the prompt in the interactive mode.
+PROMPT_LINES = 14
+MIN_PAGE_SIZE = 10
+DEFAULT_PAGE_SIZE = 50
+
+# Query kinds.
+Q_MATCHES             = 'matches'
+Q_DECDEF              = 'decdef'
+Q_DEFINITION          = 'definition'
+Q_ASSIGNMENT          = 'assignment'
+Q_SYMBOLS             = 'symbols'
 
 DEBUG = False
 
+# The words indexed by gj_text_index.
+_TOKEN_PATTERN = re.compile('^[A-Za-z0-9_]+$')
+_STATEMENT_PATTERN = ';\\s*$'
+_READ_THREADS = 8
+_MIN_FILES_TO_READ_IN_THREADS = 16
+_REGEX_SPECIAL_CHARS = '.^$*+?{}[]\\()'
+
 config = {
     'search_extended_lines': 0,
     'verbose': False,
     'db_path': 'ID',
+    # The shards of a sharded index have their own gj.index.
+    'definition_index': DEFINITION_INDEX_FILE,
 }
 
 #-----------------------------------------------------------
 # public
 #-----------------------------------------------------------
 class Match(object):
+    __slots__ = ('filename', 'line_num', 'column', 'text')
+
     def __init__(self, tokens, pattern):
         self.filename, self.line_num, self.text = tokens
+        # Many matches are in the same file. Share the string.
+        self.filename = intern(self.filename)
         self.line_num = int(self.line_num)
         self.column = self.text.index(pattern)
 
@@ -58,10 +96,33 @@ class Match(object):
             return None
         return Match(tokens, pattern)
 
+    @staticmethod
+    def from_fields(filename, line_num, column, text):
+        m = Match.__new__(Match)
+        m.filename = filename
+        m.line_num = line_num
+        m.column = column
+        m.text = text
+        return m
+
     @staticmethod
     def sort_key(match):
         return (match.filename, match.line_num)
 
+    def __eq__(self, other):
+        if not isinstance(other, Match):
+            return NotImplemented
+        return (self.filename == other.filename and self.line_num == other.line_num
+                and self.text == other.text)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        # A position has one line. Hashing the text is unnecessary.
+        return hash((self.filename, self.line_num))
+
     def __str__(self):
         tokens = [self.filename, self.line_num, self.column, self.text]
         return ':'.join(map(str, tokens))
@@ -70,12 +131,155 @@ class Match(object):
         return self.filename.endswith('.go')
 
 
+class MatchSet(object):
+    '''
+    A compact, ordered collection of matches used by the interactive mode.
+
+    The filenames are stored once in a file table and each match refers to
+    its file by id. The line numbers and columns are stored in arrays and
+    the Match objects are only created when they are accessed. The filters
+    run the regular expression of the filenames once per file.
+
+    Each match has a number shown to the user. unique_sorted() numbers the
+    matches from 1 and the filters keep the numbers, so the user can
+    select the same match by the same number after filtering.
+    '''
+    def __init__(self, matches=()):
+        self._filenames = []
+        self._file_ids = {}
+        self._files = array('I')
+        self._line_nums = array('I')
+        self._columns = array('I')
+        self._texts = []
+        self._numbers = array('I')
+        for m in matches:
+            self.add(m)
+
+    def add(self, m):
+        file_id = self._file_ids.get(m.filename)
+        if file_id is None:
+            file_id = self._file_ids[m.filename] = len(self._filenames)
+            self._filenames.append(m.filename)
+        self._files.append(file_id)
+        self._line_nums.append(m.line_num)
+        self._columns.append(m.column)
+        self._texts.append(m.text)
+        self._numbers.append(len(self._numbers) + 1)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __getitem__(self, i):
+        return Match.from_fields(self._filenames[self._files[i]], self._line_nums[i],
+                                 self._columns[i], self._texts[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def number(self, i):
+        return self._numbers[i]
+
+    def find_number(self, number):
+        '''
+        Return the index of the match numbered |number|, or -1 if there is none.
+        '''
+        # The numbers are increasing.
+        i = bisect.bisect_left(self._numbers, number)
+        if i < len(self._numbers) and self._numbers[i] == number:
+            return i
+        return -1
+
+    def first_of_files(self):
+        '''
+        Return the indexes of the first match of each file.
+        '''
+        files = self._files
+        return [i for i in range(len(files)) if i == 0 or files[i] != files[i - 1]]
+
+    def unique_sorted(self):
+        '''
+        Return a MatchSet without the duplicated matches, sorted by
+        (filename, line_num).
+        '''
+        ranks = [0] * len(self._filenames)
+        for rank, file_id in enumerate(sorted(range(len(self._filenames)),
+                                              key=self._filenames.__getitem__)):
+            ranks[file_id] = rank
+        files = self._files
+        line_nums = self._line_nums
+        texts = self._texts
+        # Integer keys are much faster to sort than tuples.
+        keys = [(ranks[files[i]] << 32) | line_nums[i] for i in range(len(files))]
+        indexes = sorted(range(len(files)), key=keys.__getitem__)
+
+        unique = []
+        last_key = None
+        seen_texts = None
+        for i in indexes:
+            if keys[i] != last_key:
+                last_key = keys[i]
+                seen_texts = set()
+            elif texts[i] in seen_texts:
+                continue
+            seen_texts.add(texts[i])
+            unique.append(i)
+        result = self._select(unique)
+        result._numbers = array('I', range(1, len(unique) + 1))
+        return result
+
+    def filter_filename(self, pattern, exclude):
+        '''
+        Keep the matches whose filenames match |pattern|, or the ones that
+        don't match if |exclude| is True.
+        '''
+        regex = re.compile(pattern)
+        matched = set(file_id for file_id in set(self._files)
+                      if (regex.search(self._filenames[file_id]) is not None) != exclude)
+        files = self._files
+        return self._select([i for i in range(len(files)) if files[i] in matched])
+
+    def filter_text(self, pattern, exclude):
+        '''
+        Keep the matches whose texts match |pattern|, or the ones that
+        don't match if |exclude| is True.
+        '''
+        regex = re.compile(pattern)
+        texts = self._texts
+        return self._select([i for i in range(len(texts))
+                             if (regex.search(texts[i]) is not None) != exclude])
+
+    def _select(self, indexes):
+        result = MatchSet()
+        # The file table is only appended, so it can be shared.
+        result._filenames = self._filenames
+        result._file_ids = self._file_ids
+        result._files = array('I', (self._files[i] for i in indexes))
+        result._line_nums = array('I', (self._line_nums[i] for i in indexes))
+        result._columns = array('I', (self._columns[i] for i in indexes))
+        result._texts = [self._texts[i] for i in indexes]
+        result._numbers = array('I', (self._numbers[i] for i in indexes))
+        return result
+
+
 # Used by finding definition.
 class FileLine(object):
+    # gj -I creates one per symbol. Don't give each one a __dict__.
+    __slots__ = ('path', 'line')
+
     def __init__(self, path, line):
         self.path = path
         self.line = line
 
+    def __getstate__(self):
+        return (self.path, self.line)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before __slots__ is used (e.g., gj.index in the old format).
+            state = (state['path'], state['line'])
+        self.path, self.line = state
+
     def __eq__(self, other):
         return self.path == other.path and self.line == other.line
 
@@ -91,6 +295,8 @@ class FileLine(object):
 
 # Used by finding definition.
 class SymbolInfo(object):
+    __slots__ = ('symbol', 'full', 'fileline')
+
     @staticmethod
     def sort_key(info):
         return (info.symbol, info.full)
@@ -100,6 +306,15 @@ class SymbolInfo(object):
         self.full = full
         self.fileline = fileline
 
+    def __getstate__(self):
+        return (self.symbol, self.full, self.fileline)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before __slots__ is used.
+            state = (state['symbol'], state['full'], state['fileline'])
+        self.symbol, self.full, self.fileline = state
+
     def __eq__(self, other):
         return (self.symbol == other.symbol and self.full == other.full
                 and self.fileline == other.fileline)
@@ -117,9 +332,38 @@ class SymbolInfo(object):
         return hash(self.full)
 
 
-def check_install():
+def process_args(args):
+    '''
+    Replace special patterns if necessary.
+    '''
+    patterns = []
+    for arg in args:
+        if '::' in arg:  # C++ method.
+            patterns.extend(arg.split('::'))
+        else:
+            patterns.append(arg)
+    return patterns
+
+def check_install(db_path=None, engine=ENGINE_MKID):
+    '''
+    Exit if id-utils is required but not installed. The native text index
+    doesn't need id-utils.
+    '''
+    import gj_shard
+    import gj_text_index
+
+    if engine == ENGINE_NATIVE:
+        return
+    if db_path:
+        shards = gj_shard.get_shards(db_path)
+        # Skip the shards not indexed yet.
+        db_paths = [db_path] if shards is None else [
+            p for p in (s.join(os.path.basename(db_path)) for s in shards) if os.path.exists(p)]
+        if all(gj_text_index.is_native(p) for p in db_paths):
+            return
+
     for cmd in ['mkid', _get_gid_cmd()]:
-        if not _is_cmd_exists(cmd):
+        if not _find_command(cmd, db_path):
             msg = (
                 "The program '%s' is currently not installed.  "
                 "You can install it by typing:\n" % cmd
@@ -133,65 +377,370 @@ def check_install():
             print(msg)
             sys.exit(1)
 
-def build_index(db_path):
+def build_index(db_path, engine=ENGINE_MKID, jobs=None, incremental=False):
+    import gj_source_index
+    import gj_symbol_index
+    import gj_text_index
+    import gj_trace
+
     lang_path = os.path.join(os.path.dirname(__file__), LANG_MAP_FILE)
-    return _mkid(lang_path, db_path)
+    if engine == ENGINE_NATIVE or incremental:
+        with gj_trace.stage('tokenize') as stage:
+            n = stage.items = gj_text_index.build(db_path, lang_path, jobs=jobs,
+                                                  incremental=incremental)
+        print('Tokenize %d files.' % n)
+        with gj_trace.stage('symbol_index') as stage:
+            n = stage.items = gj_symbol_index.build(db_path)
+        print('Index %d symbols.' % n)
+    else:
+        with gj_trace.stage('mkid'):
+            if not _mkid(lang_path, db_path):
+                return False
+    with gj_trace.stage('source_index') as stage:
+        n = stage.items = gj_source_index.build(db_path, lang_path, jobs=jobs,
+                                                incremental=incremental)
+    print('Scan %d files for definitions.' % n)
+    return True
+
+def clear_cache(db_path):
+    '''
+    Remove the cached query results of |db_path|.
+    '''
+    import gj_result_cache
+
+    gj_result_cache.clear(db_path)
+
 
+def _find_matches(pattern, file_ids=None):
+    return list(_iter_matches(pattern, file_ids))
 
-def _find_matches(pattern):
-    lines = _gid(pattern)
+def _iter_matches(pattern, file_ids=None):
+    import gj_trace
+
+    if file_ids is None:
+        lines = _gid(pattern)
+    else:
+        lines = _grep_files(pattern, file_ids)
+    create = gj_trace.wrap('create_match', Match.create)
     # gid may get unmatched pattern when the argument is a number.
     # Don't know the reason. Manually filter unmatched lines.
     # This fix also supports searching "pattern()" or "pattern("
     # which is useful to find all function calls.
-    candidated_lines = []
     for line in lines:
         tokens = line.split(':', 2)
         if len(tokens) == 3 and pattern in tokens[2]:
-            candidated_lines.append(line)
-    matches = [Match.create(line, pattern) for line in candidated_lines]
-    return [m for m in matches if m]
+            m = create(line, pattern)
+            if m:
+                yield m
 
 
 def find_matches(patterns=None, filter_='', path_prefix=''):
+    import gj_trace
+
     if patterns is None:
         patterns = find_matches.original_patterns
-    matches = _find_matches(patterns[0])
-    for pattern in patterns[1:]:
-        matches = _filter_matches(matches, pattern)
 
-    if path_prefix:
-        matches = _filter_filename(matches, '^' + path_prefix, False)
+    with gj_trace.stage('plan'):
+        file_ids, filenames = _narrow_down_files(patterns, filter_, path_prefix)
+    matches = _find_matches(patterns[0], file_ids)
+    with gj_trace.stage('filter') as stage:
+        stage.items = len(matches)
+        matches = _keep_matches(matches, patterns, path_prefix, filenames)
+    with gj_trace.stage('sort') as stage:
+        stage.items = len(matches)
+        return sorted(matches, key=Match.sort_key)
 
-    if filter_:
-        matches_by_filter = _find_matches(filter_)
-        filenames = set(m.filename for m in matches_by_filter)
-        matches = [m for m in matches if m.filename in filenames]
+find_matches.original_patterns = []
 
-    return sorted(matches, key=Match.sort_key)
+def iter_matches(patterns, filter_='', path_prefix=''):
+    '''
+    The same as find_matches() but yield the matches in the order gid
+    outputs them. The matches of each file are filtered as soon as the
+    file is read, so the caller gets the first matches before the search
+    ends. Stop iterating to stop the search.
+    '''
+    import gj_trace
 
-find_matches.original_patterns = []
+    with gj_trace.stage('plan'):
+        file_ids, filenames = _narrow_down_files(patterns, filter_, path_prefix)
+    matches = _iter_matches(patterns[0], file_ids)
+    try:
+        # The lines of a file are consecutive in gid's output.
+        for _, group in itertools.groupby(matches, key=lambda m: m.filename):
+            for m in _keep_matches(list(group), patterns, path_prefix, filenames):
+                yield m
+    finally:
+        matches.close()
+
+def query(kind, patterns, path_prefix='', filter_='', limit=0, first_file_only=False, sort=True,
+          use_cache=False):
+    '''
+    Return the lines for Q_SYMBOLS and the matches for the other kinds.
+
+    Return at most |limit| results if |limit| > 0, and only the matches of
+    the first file if |first_file_only| is True. The matches are sorted by
+    (filename, line_num). For Q_MATCHES, |sort| = False returns an iterator
+    of the matches in the order found instead, which stops the search as
+    soon as enough matches are found.
+
+    If |use_cache| is True, the sorted results are saved in and loaded from
+    the result cache beside the text index (see gj_result_cache).
+
+    If the index is sharded (see gj_shard), the query runs on the shards in
+    parallel and the sorted results are merged.
+    '''
+    import gj_shard
+    import gj_trace
+
+    shards = gj_shard.get_shards(config['db_path'])
+    if shards is not None:
+        with gj_trace.stage('shards') as stage:
+            stage.items = len(shards)
+            return _query_shards(shards, kind, patterns, path_prefix, filter_, limit,
+                                 first_file_only, use_cache)
+    return _query_index(kind, patterns, path_prefix, filter_, limit, first_file_only, sort,
+                        use_cache)
+
+def _query_index(kind, patterns, path_prefix, filter_, limit, first_file_only, sort, use_cache):
+    import gj_result_cache
+    import gj_trace
+
+    if not use_cache or (not sort and kind == Q_MATCHES):
+        with gj_trace.stage('query'):
+            return _query(kind, patterns, path_prefix, filter_, limit, first_file_only, sort)
+
+    find_matches.original_patterns = patterns
+    cache = gj_result_cache.ResultCache(config['db_path'])
+    key = _get_cache_key(kind, patterns, path_prefix, filter_, limit, first_file_only)
+    with gj_trace.stage('cache_get'):
+        data = cache.get(key)
+    if data is not None:
+        if kind == Q_SYMBOLS:
+            return data
+        # The lines of the matches are read from the source files, which
+        # may be edited without re-indexing.
+        matches, generation = data
+        if generation == gj_result_cache.get_generation(matches[0]):
+            return _unpack_matches(matches)
+
+    with gj_trace.stage('query'):
+        result = _query(kind, patterns, path_prefix, filter_, limit, first_file_only, sort)
+    with gj_trace.stage('cache_put'):
+        if kind == Q_SYMBOLS:
+            cache.put(key, result)
+        else:
+            matches = _pack_matches(result)
+            cache.put(key, (matches, gj_result_cache.get_generation(matches[0])))
+    return result
+
+def _query_shards(shards, kind, patterns, path_prefix, filter_, limit, first_file_only,
+                  use_cache):
+    import gj_shard
+
+    if path_prefix and kind in (Q_MATCHES, Q_DECDEF, Q_ASSIGNMENT):
+        # Skip the shards which can't have the path.
+        prefix = _get_literal_prefix(path_prefix)
+        shards = [s for s in shards if gj_shard.may_match_path(s, prefix)]
+
+    db_name = os.path.basename(config['db_path'])
+    tasks = []
+    for shard in shards:
+        shard_config = dict(config, db_path=shard.join(db_name),
+                            definition_index=shard.join(DEFINITION_INDEX_FILE))
+        tasks.append((shard_config, os.getcwd(), kind, patterns, path_prefix, filter_, limit,
+                      first_file_only, use_cache))
+    results = [r for r in gj_shard.map_shards(_query_shard, tasks) if r is not None]
+
+    if kind == Q_SYMBOLS:
+        result = _merge_symbol_lines(results)
+        return result[:limit] if limit > 0 else result
+    result = gj_shard.merge([_unpack_matches(r) for r in results], Match.sort_key)
+    if limit > 0 or first_file_only:
+        return _take_smallest(result, limit, first_file_only)
+    return result
+
+def _query_shard(task):
+    '''
+    Run the query in a shard. Return the result in the form of the result
+    cache, or None if the shard isn't indexed.
+    '''
+    (shard_config, cwd, kind, patterns, path_prefix, filter_, limit, first_file_only,
+     use_cache) = task
+    # The processes in the pool are reused by the queries from other
+    # directories, and the query runs in the caller's process if there is
+    # only one shard. Restore the settings for the later queries.
+    try:
+        saved_cwd = os.getcwd()
+    except OSError:
+        # The last directory of the process in the pool may be removed.
+        saved_cwd = None
+    saved_config = dict(config)
+    os.chdir(cwd)
+    config.update(shard_config)
+    try:
+        index_file = config['definition_index'] if kind == Q_DEFINITION else config['db_path']
+        if not os.path.exists(index_file):
+            return None
+        # Read the files before restoring the current directory.
+        result = list(_query_index(kind, patterns, path_prefix, filter_, limit, first_file_only,
+                                   True, use_cache))
+    finally:
+        config.clear()
+        config.update(saved_config)
+        if saved_cwd is not None:
+            os.chdir(saved_cwd)
+    if kind == Q_SYMBOLS:
+        return result
+    shard_path = os.path.dirname(shard_config['definition_index'])
+    if kind == Q_DEFINITION and shard_path:
+        # The paths in gj.index are relative to the shard.
+        for m in result:
+            if not os.path.isabs(m.filename):
+                m.filename = os.path.join(shard_path, m.filename)
+    return _pack_matches(result)
+
+def _merge_symbol_lines(results):
+    '''
+    Merge the lines of find_symbols() of the shards by the symbols. A long
+    line is wrapped and the rest lines start with spaces.
+    '''
+    import gj_shard
+
+    entries = []
+    for lines in results:
+        shard_entries = []
+        for line in lines:
+            if line.startswith(' ') and shard_entries:
+                shard_entries[-1].append(line)
+            else:
+                shard_entries.append([line])
+        entries.append(shard_entries)
+
+    result = []
+    previous = None
+    for entry in gj_shard.merge(entries, lambda entry: entry[0].split(' ', 1)[0]):
+        # Without -v, a symbol in several shards has the same line.
+        if entry != previous:
+            result.extend(entry)
+        previous = entry
+    return result
+
+def _query(kind, patterns, path_prefix, filter_, limit, first_file_only, sort):
+    if kind == Q_SYMBOLS:
+        result = find_symbols(patterns[0], path_pattern=path_prefix)
+        return result[:limit] if limit > 0 else result
+
+    find_matches.original_patterns = patterns
+    if kind == Q_DECDEF:
+        result = find_declaration_or_definition(patterns[0], path_prefix=path_prefix)
+    elif kind == Q_DEFINITION:
+        result = find_definition(patterns[0])
+    elif kind == Q_ASSIGNMENT:
+        result = find_assignment(patterns[0], path_prefix=path_prefix)
+    elif not sort:
+        result = iter_matches(patterns, path_prefix=path_prefix, filter_=filter_)
+        return _take_first(result, limit, first_file_only)
+    elif limit > 0 or first_file_only:
+        result = iter_matches(patterns, path_prefix=path_prefix, filter_=filter_)
+    else:
+        return find_matches(patterns, path_prefix=path_prefix, filter_=filter_)
+    return _take_smallest(result, limit, first_file_only)
+
+def print_result(kind, result, json_lines=False):
+    '''
+    Print the result of query() in batch mode. See format_result() for
+    |json_lines|.
+    '''
+    import gj_trace
+
+    if kind == Q_SYMBOLS:
+        for line in result:
+            print(format_result(kind, line, json_lines))
+        return
+
+    # Let the reader (e.g., Vim) get each match once it is found.
+    stream = not isinstance(result, (list, tuple, set))
+    if stream:
+        # Don't count the time to find the matches.
+        result = gj_trace.iterate('search', result)
+    for m in gj_trace.iterate('render', result):
+        print(format_result(kind, m, json_lines))
+        if stream:
+            sys.stdout.flush()
+
+def format_result(kind, item, json_lines=False, tag=None):
+    '''
+    Return the output line of |item|, a line of Q_SYMBOLS or a match of the
+    other kinds. If |json_lines| is True, return a JSON object for the editor
+    plugins: {"filename": ..., "line": ..., "column": ..., "text": ...} for
+    the matches, where "column" starts from 0, and {"text": ...} for the
+    symbols. If |tag| is not None, it's added as "query" or before a tab.
+    '''
+    global config
+
+    if kind == Q_SYMBOLS:
+        fields = {'text': item}
+        line = item
+    else:
+        fields = {'filename': item.filename, 'line': item.line_num,
+                  'column': item.column, 'text': item.text}
+        # |item| may be shared by the result cache. Don't truncate its text.
+        text = item.text
+        if not config['verbose'] and len(text) > DEFAULT_CODE_LENGTH:
+            text = text[:DEFAULT_CODE_LENGTH] + " ..."
+        line = '%s:%s:%s:%s' % (item.filename, item.line_num, item.column, text)
+
+    if json_lines:
+        import json
+
+        if tag is not None:
+            fields['query'] = tag
+        return json.dumps(fields, sort_keys=True)
+    if tag is not None:
+        return '%s\t%s' % (tag, line)
+    return line
 
 def choose_matches_interactively(matches, patterns):
-    matches = matches[:]  # Make a clone.
+    '''
+    Show the matches page by page and let the user filter or select them.
+    Pass the returned matches back to keep the numbers and the page.
+    '''
+    if not isinstance(matches, MatchSet):
+        matches = MatchSet(matches).unique_sorted()
+        choose_matches_interactively.page = 0
 
     if not hasattr(choose_matches_interactively, 'fold'):
         choose_matches_interactively.fold = False
 
     if not hasattr(choose_matches_interactively, 'selections'):
-        choose_matches_interactively.selections = []
+        choose_matches_interactively.selections = set()
+
+    if not hasattr(choose_matches_interactively, 'page'):
+        choose_matches_interactively.page = 0
 
     # Enter the interactive mode.
+    visible = None
     while True:
         if not matches:
             print('No file matched.')
             return [], matches, patterns
 
-        matches = sorted(set(matches), key=Match.sort_key)
-        index_mapping = _show_list(matches,
-                                   patterns,
-                                   choose_matches_interactively.selections,
-                                   choose_matches_interactively.fold)
+        # Only format the matches in the current page.
+        if visible is None:
+            if choose_matches_interactively.fold:
+                visible = matches.first_of_files()
+            else:
+                visible = range(len(matches))
+        page_size = _get_page_size()
+        n_pages = (len(visible) + page_size - 1) // page_size
+        page = min(max(choose_matches_interactively.page, 0), n_pages - 1)
+        choose_matches_interactively.page = page
+        _show_list(matches,
+                   visible[page * page_size:(page + 1) * page_size],
+                   patterns,
+                   choose_matches_interactively.selections,
+                   page,
+                   n_pages)
         global input
         try:
             input = raw_input
@@ -210,32 +759,48 @@ def choose_matches_interactively(matches, patterns):
         if re.match('\d+', response):
             break
 
-        # Clean/Keep statements
-        if response in [A_CLEAN_STATEMENT, A_KEEP_STATEMENT]:
-            matches = _filter_statement(matches, response == A_CLEAN_STATEMENT)
+        if response == A_NEXT_PAGE:
+            choose_matches_interactively.page += 1
             continue
 
-        if response == A_FOLD:
-            choose_matches_interactively.fold = not choose_matches_interactively.fold
+        if response == A_PREV_PAGE:
+            choose_matches_interactively.page -= 1
+            continue
+
+        if response[0] == A_JUMP:
+            try:
+                i = matches.find_number(int(response[1:]))
+            except ValueError:
+                i = -1
+            if i >= 0:
+                # Go to the page of the match or its folded file.
+                choose_matches_interactively.page = (
+                    max(bisect.bisect_right(visible, i) - 1, 0) // page_size)
             continue
 
-        if response[0] == A_RESTART:
+        # Clean/Keep statements
+        if response in [A_CLEAN_STATEMENT, A_KEEP_STATEMENT]:
+            matches = matches.filter_text(_STATEMENT_PATTERN, response == A_CLEAN_STATEMENT)
+        elif response == A_FOLD:
+            choose_matches_interactively.fold = not choose_matches_interactively.fold
+        elif response[0] == A_RESTART:
             if len(response) == 1:
-                matches = find_matches()
+                matches = MatchSet(find_matches())
             else:
                 patterns = response[1:].split()
-                matches = find_matches(patterns)
-            continue
-
-        # Clean/Keep based on filename
-        if response[0] == '!':
-            exclude = True
-            response = response[1:]
+                matches = MatchSet(find_matches(patterns))
+            matches = matches.unique_sorted()
+            choose_matches_interactively.selections = set()
         else:
-            exclude = False
-        matches = _filter_filename(matches, response, exclude)
-
-    matches.sort(key=Match.sort_key)
+            # Clean/Keep based on filename
+            if response[0] == '!':
+                exclude = True
+                response = response[1:]
+            else:
+                exclude = False
+            matches = matches.filter_filename(response, exclude)
+        visible = None
+        choose_matches_interactively.page = 0
 
     # Parse the selected number
     input_numbers = parse_number(response)
@@ -243,106 +808,114 @@ def choose_matches_interactively(matches, patterns):
         print('Invalid input.')
         return None, matches, patterns
 
-    numbers = []
+    indexes = []
     for n in input_numbers:
-        n = index_mapping.get(n, -1)
-        if n < 0 or n >= len(matches):
+        i = matches.find_number(n)
+        if i < 0:
             print('Invalid input.')
             return None, matches, patterns
-        numbers.append(n)
+        indexes.append(i)
 
-    choose_matches_interactively.selections = numbers
+    choose_matches_interactively.selections = set(input_numbers)
 
-    return [matches[n] for n in numbers], matches, patterns
+    return [matches[i] for i in indexes], matches, patterns
 
 def find_declaration_or_definition(pattern, path_prefix=''):
+    import gj_source_index
+    import gj_trace
+
     if pattern.startswith('m_') or pattern.startswith('s_'):
         # For non-static member fields or static member fields,
         # find symobls in header files.
         matches = find_matches([pattern])
         return _filter_filename(matches, '\.h$', False)
 
-    matches = tuple(find_matches([pattern]))
-
-    if path_prefix:
-        matches = _filter_filename(matches, '^' + path_prefix, False)
-
-    # Find declaration if possible.
-    result = set()
-    types = (
-        'class',
-        'struct',
-        'enum',
-        'interface',  # Java, Objective C
-    )
-    for type_ in types:
-        tmp = _filter_matches(matches, type_)
-        tmp = _filter_statement(tmp, True)
-        result.update(tmp)
-    result.update(_filter_matches(matches, 'typedef'))
-    result.update(_filter_matches(matches, 'define'))
-    result.update(_filter_matches(matches, 'using'))
-    # Find definition if possible.
-    result.update(_keep_possible_definition(matches, pattern))
-
-    # Special handling for Golang.
-    # 1. Remove all matches from the general rules.
-    result = set(r for r in result if not r.is_golang())
-
-    # 2. Apply customized rules.
-    result.update(_filter_declaration_or_definitions_for_golang(matches, pattern))
+    definitions = None
+    if not config['search_extended_lines']:
+        # The index only has the definitions found in single lines.
+        with gj_trace.stage('definition_index'):
+            definitions = gj_source_index.find(config['db_path'], pattern)
+    if definitions is not None:
+        # Look up the definitions found by "gj -i".
+        result = [Match.create('%s:%d:%s' % (path, line, full), pattern)
+                  for full, path, line in definitions]
+        result = [m for m in result if m]
+        if path_prefix:
+            result = _filter_filename(result, '^' + path_prefix, False)
+        return sorted(set(result), key=Match.sort_key)
+
+    matches = find_matches([pattern], path_prefix=path_prefix)
+
+    # Classify each match once. The rules are chosen by the file extension.
+    texts = _read_extended_texts(matches)
+    with gj_trace.stage('classify') as stage:
+        stage.items = len(matches)
+        classifier = _DecDefClassifier(pattern)
+        result = set()
+        for m in matches:
+            text = texts[(m.filename, m.line_num)] if texts is not None else m.text
+            if classifier.match(m, text):
+                result.add(m)
 
     return sorted(result, key=Match.sort_key)
 
 def find_definition(symbol):
-    result = []
-    with open(DEFINITION_INDEX_FILE, 'rb') as fr:
-        # format: [(symbol, offset)]
-        info_index = pickle.load(fr)
-        begin = 0
-        end = len(info_index)
-        index_offset = fr.tell()
-        for i, (s, offset) in enumerate(info_index):
-            if s > symbol:
-                end = i
-                break
-        for i in range(end - 1, 0, -1):
-            if info_index[i][0] < symbol:
-                begin = i
-                break
+    import gj_definition_index
+    import gj_trace
 
-        for i in range(begin, end):
-            fr.seek(index_offset + info_index[i][1])
-            infos = pickle.load(fr)
-            for info in infos:
-                if info.symbol == symbol:
-                    string = '%s:%d:%s' % (info.fileline.path, info.fileline.line, info.full)
-                    match = Match.create(string, symbol)
-                    result.append(match)
+    filename = config['definition_index']
+    if not gj_definition_index.is_compact(filename):
+        return _find_definition_in_pickle(symbol)
 
+    result = []
+    with gj_trace.stage('definition_index'):
+        index = gj_definition_index.open_index(filename)
+        records = index.find(symbol)
+    for full, path, line in records:
+        string = '%s:%d:%s' % (path, line, full)
+        result.append(Match.create(string, symbol))
     return sorted(result, key=Match.sort_key)
 
 # Experimental feature for Go.
 def find_assignment(symbol, path_prefix=''):
-    matches = tuple(find_matches([symbol]))
-
-    if path_prefix:
-        matches = _filter_filename(matches, '^' + path_prefix, False)
+    matches = tuple(find_matches([symbol], path_prefix=path_prefix))
 
     # Find Go assignments. Assume the code is well-formatted.
     return sorted(_filter_assignment(matches, symbol), key=Match.sort_key)
 
-def find_symbols(pattern, path_pattern=''):
+def find_symbols(pattern, path_pattern='', mode=None):
+    '''
+    Return the lines of the symbols which match |pattern| case-insensitively.
+    |mode| is one of gj_symbol_index.MODES (default: MODE_SUBSTRING).
+    '''
     global config
 
+    import gj_symbol_index
+    import gj_text_index
+    import gj_trace
+
+    if mode is None:
+        mode = gj_symbol_index.MODE_SUBSTRING
     verbose = config['verbose']
     if path_pattern:
         verbose = True
 
-    args = ['-lis']
-    if not verbose:
-        args.extend(('-R', 'none'))
-    lines = _lid(pattern, args)
+    if gj_text_index.is_native(config['db_path']):
+        with gj_trace.stage('symbol_index'):
+            lines = _find_symbols_in_native_index(pattern, path_pattern, mode, verbose)
+    else:
+        if mode == gj_symbol_index.MODE_SUBSTRING:
+            args = ['-lis']
+            lid_pattern = pattern
+        elif mode == gj_symbol_index.MODE_PREFIX:
+            args = ['-ri']
+            lid_pattern = '^' + re.escape(pattern)
+        else:
+            args = ['-ri']
+            lid_pattern = '.*'.join(re.escape(c) for c in pattern)
+        if not verbose:
+            args.extend(('-R', 'none'))
+        lines = _lid(lid_pattern, args)
     result = []
     max_width = 120
     indent = 8
@@ -385,15 +958,19 @@ def find_symbols(pattern, path_pattern=''):
             prefix = '' if first_line else ' ' * indent
             result.append(prefix + ' '.join(ts))
 
-    tmp =  [_highlight(pattern, line) for line in result if line]
+    highlighter = _Highlighter([pattern])
+    tmp = [highlighter.highlight(line) for line in result if line]
     if path_pattern:
-        tmp = [_highlight(path_pattern, line, level=1) for line in tmp if line]
+        highlighter = _Highlighter([path_pattern], level=1)
+        tmp = [highlighter.highlight(line) for line in tmp if line]
     return tmp
 
 #-----------------------------------------------------------
 # private
 #-----------------------------------------------------------
 def _mkid(lang_file, db_path):
+    import subprocess
+
     cmd = ['mkid', '-m', lang_file, '-f', db_path]
     process = subprocess.Popen(cmd,
                                stdout=subprocess.PIPE,
@@ -406,19 +983,120 @@ def _mkid(lang_file, db_path):
         print(stderr)
     return True
 
-def _is_cmd_exists(cmd):
-    return 0 == subprocess.call(['which', cmd],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
+def _find_definition_in_pickle(symbol):
+    '''
+    Find the definition in gj.index saved in the old pickle format.
+    '''
+    import pickle
+
+    result = []
+    # format: [(symbol, offset)]
+    filename = config['definition_index']
+    info_index, index_offset = _load_definition_index_header(filename)
+    with open(filename, 'rb') as fr:
+        begin = 0
+        end = len(info_index)
+        for i, (s, offset) in enumerate(info_index):
+            if s > symbol:
+                end = i
+                break
+        for i in range(end - 1, 0, -1):
+            if info_index[i][0] < symbol:
+                begin = i
+                break
+
+        for i in range(begin, end):
+            fr.seek(index_offset + info_index[i][1])
+            infos = pickle.load(fr)
+            for info in infos:
+                if info.symbol == symbol:
+                    string = '%s:%d:%s' % (info.fileline.path, info.fileline.line, info.full)
+                    match = Match.create(string, symbol)
+                    result.append(match)
+
+    return sorted(result, key=Match.sort_key)
+
+def _load_definition_index_header(filename):
+    '''
+    Return (info_index, data offset) of the definition index. The header is
+    cached until the file is rewritten, which saves time for the long-running
+    processes (e.g., "gj --serve").
+    '''
+    import pickle
+
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size, st.st_ino)
+    cache = _load_definition_index_header.cache
+    if cache is None or cache[0] != key:
+        with open(filename, 'rb') as fr:
+            info_index = pickle.load(fr)
+            cache = (key, info_index, fr.tell())
+        _load_definition_index_header.cache = cache
+    return cache[1], cache[2]
+
+_load_definition_index_header.cache = None
+
+def _find_command(cmd, db_path=None):
+    '''
+    Return the path of |cmd| in $PATH, or None if it's not found. Search
+    $PATH in this process instead of running "which". If |db_path| is
+    given, the found paths are cached in "|db_path|.tools" for the later
+    runs. The commands not found are not cached, so installing them later
+    takes effect immediately.
+    '''
+    tools = _load_tools(db_path) if db_path else {}
+    path = tools.get(cmd)
+    if path and os.access(path, os.X_OK):
+        return path
+
+    path = None
+    for dirpath in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(dirpath or '.', cmd)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            path = candidate
+            break
+    if path and db_path:
+        tools[cmd] = path
+        _save_tools(db_path, tools)
+    return path
+
+def _load_tools(db_path):
+    '''
+    Return {command: path} saved in "|db_path|.tools". The first line is
+    $PATH when the file is saved. Return {} if $PATH is changed.
+    '''
+    try:
+        with open(db_path + TOOLS_SUFFIX) as fr:
+            lines = fr.read().split('\n')
+    except (IOError, OSError):
+        return {}
+    if lines[0] != os.environ.get('PATH', os.defpath):
+        return {}
+    tools = {}
+    for line in lines[1:]:
+        tokens = line.split('\t')
+        if len(tokens) == 2:
+            tools[tokens[0]] = tokens[1]
+    return tools
+
+def _save_tools(db_path, tools):
+    lines = [os.environ.get('PATH', os.defpath)]
+    lines.extend('%s\t%s' % (cmd, path) for cmd, path in sorted(tools.items()))
+    try:
+        with open(db_path + TOOLS_SUFFIX, 'w') as fw:
+            fw.write('\n'.join(lines) + '\n')
+    except (IOError, OSError):
+        # E.g., the directory is read-only. Search $PATH next time.
+        pass
 
 def _get_idutils_install_cmd():
-    if platform.system() == 'Darwin':
+    if sys.platform == 'darwin':
         mgrs = {
                'port': "sudo port install idutils", # MacPorts
                'brew': "brew install idutils",      # Homebrew
             }
         for mgr, cmd in mgrs.items():
-            if _is_cmd_exists(mgr):
+            if _find_command(mgr):
                 return cmd
         return ""
     else:
@@ -426,18 +1104,23 @@ def _get_idutils_install_cmd():
 
 def _get_gid_cmd():
     gid = 'gid'
-    if platform.system() == 'Darwin':
-        if _is_cmd_exists('gid32'):
+    if sys.platform == 'darwin':
+        if _find_command('gid32', config['db_path']):
             gid = 'gid32'
     return gid
 
 def _execute(args):
-    process = subprocess.Popen(args,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    text = process.stdout.read()
+    import subprocess
+    import gj_trace
+
+    with gj_trace.stage('subprocess'):
+        process = subprocess.Popen(args,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        text = process.stdout.read()
     try:
-        text = text.decode('utf8')
+        with gj_trace.stage('decode'):
+            text = text.decode('utf8')
     except Exception as e:
         if DEBUG:
             print('-' * 80)
@@ -456,72 +1139,374 @@ def _execute(args):
         return result
     return text.split('\n')
 
+def _iter_output(args):
+    '''
+    Yield the lines of the output of |args| while the command is running.
+    Skip the non-utf8 lines. The command is killed if the caller stops
+    iterating before the end.
+    '''
+    import subprocess
+    import gj_trace
+
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=devnull)
+    decode = gj_trace.wrap('decode', bytes.decode)
+    try:
+        for line in gj_trace.iterate('subprocess', process.stdout):
+            try:
+                line = decode(line, 'utf8')
+            except Exception as e:
+                if DEBUG:
+                    print('-' * 80)
+                    print('%s: skip <%s>' % (e, line))
+                    print('-' * 80)
+                continue
+            yield line.rstrip('\n')
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
 def _gid(pattern):
+    '''
+    Return an iterator of the lines "path:line_num:text" which contain |pattern|.
+    '''
     global config
 
+    import gj_text_index
+    import gj_trace
+
+    pattern = _strip_call(pattern)
+    if gj_text_index.is_native(config['db_path']):
+        index = gj_text_index.open_index(config['db_path'])
+        return gj_trace.iterate('native_grep', index.iter_grep(pattern))
+    cmd = [_get_gid_cmd(), '-f', config['db_path'], pattern]
+    return _iter_output(cmd)
+
+def _grep_files(pattern, file_ids):
+    '''
+    The same as _gid() but only search the files |file_ids| of the native index.
+    '''
+    import gj_text_index
+    import gj_trace
+
+    index = gj_text_index.open_index(config['db_path'])
+    return gj_trace.iterate('native_grep', index.iter_grep(_strip_call(pattern), sorted(file_ids)))
+
+def _narrow_down_files(patterns, filter_, path_prefix):
+    '''
+    Return (file_ids, filenames). Only the files |file_ids| may have the
+    matches of |patterns| (None means all files). If |filenames| is not
+    None, only keep the matches in |filenames|.
+    '''
+    # Narrow down the files by the index first if possible.
+    file_ids = _find_candidate_files(patterns)
+    if file_ids is None and (path_prefix or filter_):
+        # Without the other conditions, _gid() only reads the files of
+        # patterns[0]. Don't read more files with them.
+        file_ids = _find_files_by_word(_strip_call(patterns[0]))
+    if path_prefix:
+        file_ids = _intersect(file_ids, _find_files_by_path(path_prefix))
+    filenames = None
+    if filter_:
+        filter_ids = _find_files_by_word(filter_)
+        if filter_ids is not None:
+            file_ids = _intersect(file_ids, filter_ids)
+        else:
+            filenames = set(m.filename for m in _iter_matches(filter_, file_ids))
+    return file_ids, filenames
+
+def _keep_matches(matches, patterns, path_prefix, filenames):
+    '''
+    Keep the matches of patterns[0] which also match the other conditions.
+    '''
+    texts = _read_extended_texts(matches) if len(patterns) > 1 else None
+    for pattern in patterns[1:]:
+        matches = _filter_matches(matches, pattern, texts)
+
+    if path_prefix:
+        matches = _filter_filename(matches, '^' + path_prefix, False)
+
+    if filenames is not None:
+        matches = [m for m in matches if m.filename in filenames]
+    return matches
+
+def _get_cache_key(kind, patterns, path_prefix, filter_, limit, first_file_only):
+    import gj_result_cache
+    import gj_source_index
+    import gj_symbol_index
+    import gj_text_index
+
+    db_path = config['db_path']
+    # The results depend on the indexes and the paths are relative to the
+    # current directory.
+    index_files = [db_path, db_path + gj_text_index.DELTA_SUFFIX,
+                   db_path + gj_symbol_index.SUFFIX, db_path + gj_source_index.SUFFIX,
+                   config['definition_index']]
+    return (kind, tuple(patterns), path_prefix, filter_, limit, first_file_only,
+            config['search_extended_lines'], config['verbose'], os.getcwd(),
+            gj_result_cache.get_generation(index_files))
+
+def _pack_matches(matches):
+    '''
+    Return the matches in a compact form for the result cache: the file
+    table, the arrays of the file ids, line numbers and columns, and the texts.
+    '''
+    filenames = []
+    file_ids = {}
+    files = array('I')
+    line_nums = array('I')
+    columns = array('I')
+    texts = []
+    for m in matches:
+        file_id = file_ids.get(m.filename)
+        if file_id is None:
+            file_id = file_ids[m.filename] = len(filenames)
+            filenames.append(m.filename)
+        files.append(file_id)
+        line_nums.append(m.line_num)
+        columns.append(m.column)
+        texts.append(m.text)
+    return (filenames, files.tobytes(), line_nums.tobytes(), columns.tobytes(), texts)
+
+def _unpack_matches(data):
+    filenames, files, line_nums, columns, texts = data
+    files, line_nums, columns = [array('I', b) for b in (files, line_nums, columns)]
+    return [Match.from_fields(filenames[files[i]], line_nums[i], columns[i], texts[i])
+            for i in range(len(texts))]
+
+def _take_first(matches, limit, first_file_only):
+    '''
+    Yield the first |limit| matches (all if |limit| is 0) of the iterator
+    |matches|, or the ones in the first file if |first_file_only| is True.
+    '''
+    first_filename = None
+    try:
+        for i, m in enumerate(matches):
+            if limit > 0 and i >= limit:
+                break
+            if first_file_only:
+                if first_filename is None:
+                    first_filename = m.filename
+                elif m.filename != first_filename:
+                    break
+            yield m
+    finally:
+        if hasattr(matches, 'close'):
+            matches.close()
+
+def _take_smallest(matches, limit, first_file_only):
+    '''
+    The same as _take_first() but take the smallest matches by
+    (filename, line_num). Only keep the matches which may be returned,
+    so the memory usage is bounded by |limit| or the first file.
+    '''
+    if first_file_only:
+        first_filename = None
+        kept = []
+        for m in matches:
+            if first_filename is None or m.filename < first_filename:
+                first_filename = m.filename
+                kept = [m]
+            elif m.filename == first_filename:
+                kept.append(m)
+        matches = kept
+    if limit > 0:
+        return heapq.nsmallest(limit, matches, key=Match.sort_key)
+    return sorted(matches, key=Match.sort_key)
+
+def _strip_call(pattern):
     # Support searching "FUNCTION(" or "FUNCTION()".
     # () has special meaning for gid. Do not pass it to gid.
     if pattern.endswith('('):
-        pattern = pattern[:-1]
-    elif pattern.endswith('()'):
-        pattern = pattern[:-2]
-    cmd = [_get_gid_cmd(), '-f', config['db_path'], pattern]
-    return _execute(cmd)
+        return pattern[:-1]
+    if pattern.endswith('()'):
+        return pattern[:-2]
+    return pattern
+
+def _find_candidate_files(patterns):
+    '''
+    Return the ids of the files which contain all the positive words in
+    |patterns|. Intersect the files of the rarest word first, so the lines
+    are only read from the files which may match. Return None if there is
+    nothing to narrow down, or the index is not the native one.
+    '''
+    global config
+
+    import gj_text_index
+
+    if len(patterns) < 2 or not gj_text_index.is_native(config['db_path']):
+        return None
+
+    # The other patterns are regular expressions matched with "\b" (see
+    # _filter_matches()). A word must be a token of the file to match.
+    words = set()
+    for i, pattern in enumerate(patterns):
+        if i == 0:
+            pattern = _strip_call(pattern)
+        if _TOKEN_PATTERN.match(pattern):
+            words.add(pattern)
+    if len(words) < 2:
+        return None
+
+    index = gj_text_index.open_index(config['db_path'])
+    result = None
+    for ids in sorted((index.file_ids(w) for w in words), key=len):
+        if result is None:
+            result = set(ids)
+        else:
+            result.intersection_update(ids)
+        if not result:
+            break
+    return result
+
+def _find_files_by_word(word):
+    '''
+    Return the ids of the files which contain |word| in the native index.
+    Return None if |word| is not a plain word or the index is not the native one.
+    '''
+    global config
+
+    import gj_text_index
+
+    if not _TOKEN_PATTERN.match(word) or not gj_text_index.is_native(config['db_path']):
+        return None
+    return set(gj_text_index.open_index(config['db_path']).file_ids(word))
+
+def _find_files_by_path(path_prefix):
+    '''
+    Return the ids of the files which may match the regular expression
+    "^|path_prefix|" in the native index, or None if the index is not the
+    native one. The result is a superset; the caller still filters the matches.
+    '''
+    global config
+
+    import gj_text_index
+
+    if not gj_text_index.is_native(config['db_path']):
+        return None
+    prefix = _get_literal_prefix(path_prefix)
+    if prefix is None:
+        return None
+    return set(gj_text_index.open_index(config['db_path']).file_ids_with_prefix(prefix))
+
+def _get_literal_prefix(pattern):
+    '''
+    Return the literal prefix of the strings matched by the regular
+    expression "^|pattern|", or None if there is no such prefix.
+    '''
+    if '|' in pattern:
+        return None
+    for i, c in enumerate(pattern):
+        if c in _REGEX_SPECIAL_CHARS:
+            if c in '*?{':
+                # The previous character is optional.
+                i -= 1
+            return pattern[:max(i, 0)] or None
+    return pattern
+
+def _intersect(file_ids, other_ids):
+    '''
+    Intersect two sets of file ids. None means all files.
+    '''
+    if file_ids is None:
+        return other_ids
+    if other_ids is None:
+        return file_ids
+    return file_ids & other_ids
+
+def _find_symbols_in_native_index(pattern, path_pattern, mode, verbose):
+    '''
+    Return the lines in the same format as lid. Use the symbol index if it
+    is built. Only the paths which contain |path_pattern| are listed.
+    '''
+    global config
+
+    import gj_symbol_index
+    import gj_text_index
+
+    index = gj_text_index.open_index(config['db_path'])
+    symbol_index = gj_symbol_index.open_index(config['db_path'], index)
+    if symbol_index is not None:
+        tokens = symbol_index.find(pattern, mode)
+    else:
+        tokens = [t for t in index.find_tokens('', substring=True)
+                  if gj_symbol_index.match(t, pattern, mode)]
+
+    file_ids = None
+    if path_pattern:
+        # Match the path of each file once instead of once per symbol.
+        file_ids = set(index.file_ids_with_substring(path_pattern))
+
+    lines = []
+    for token in tokens:
+        ids = index.file_ids(token)
+        if file_ids is not None:
+            ids = [i for i in ids if i in file_ids]
+        if not len(ids):
+            # Only in the deleted files or not under |path_pattern|.
+            continue
+        if verbose:
+            lines.append(' '.join([token] + [index.display_path(i) for i in ids]))
+        else:
+            lines.append(token)
+    return lines
 
 def _lid(pattern, args):
     global config
 
+    import gj_text_index
+
+    if gj_text_index.is_native(config['db_path']):
+        # Only support the arguments used in this file: "-lis" and "-R none".
+        flags = ''.join(a[1:] for a in args if a.startswith('-') and a != '-R')
+        index = gj_text_index.open_index(config['db_path'])
+        return index.lid(pattern,
+                         ignore_case='i' in flags,
+                         substring='s' in flags,
+                         with_paths='none' not in args)
     cmd = ['lid', '-f', config['db_path']] + args + [pattern]
     return _execute(cmd)
 
-def _highlight(pattern, text, level=2):
-    def red(text):
-        if sys.stdout.isatty():
-            return '\033[1;31m%s\033[m' % text
+class _Highlighter(object):
+    '''
+    Highlight the case-insensitive occurrences of |patterns| in one pass
+    with a precompiled regular expression.
+    '''
+    def __init__(self, patterns, level=2):
+        # Prefer the longer one when the patterns overlap.
+        words = sorted(set(p for p in patterns if p), key=len, reverse=True)
+        if words:
+            self._regex = re.compile('|'.join(re.escape(w) for w in words), re.IGNORECASE)
         else:
-            return text
+            self._regex = None
+        self._color = '1;31' if level >= 2 else '1;32'
 
-    def green(text):
-        if sys.stdout.isatty():
-            return '\033[1;32m%s\033[m' % text
-        else:
+    def highlight(self, text):
+        if self._regex is None or not sys.stdout.isatty():
             return text
+        return self._regex.sub(self._colorize, text)
 
-    # Find all begin indexes of case-insensitive substring.
-    begins = []
-    base = 0
-    pl = pattern.lower()
-    tl = text.lower()
-    while True:
-        try:
-            offset = tl.index(pl)
-            begins.append(base + offset)
-            tl = tl[offset + len(pl):]
-            base += offset + len(pl)
-        except Exception as e:
-            break
-
-    if not begins:
-        return text
+    def _colorize(self, match):
+        return '\033[%sm%s\033[m' % (self._color, match.group(0))
 
-    # Highlight matched case-insensitive substrings.
-    result = []
-    last_end = 0
-    for begin in begins:
-        if begin > last_end:
-            result.append(text[last_end:begin])
-        end = begin + len(pattern)
-        if level >= 2:
-            result.append(red(text[begin:end]))
-        else:
-            result.append(green(text[begin:end]))
-        last_end = end
-    if last_end < len(text):
-        result.append(text[last_end:])
 
-    return ''.join(result)
+def _get_page_size():
+    '''
+    Return the number of matches fitting in the terminal with the prompt.
+    '''
+    try:
+        rows = os.get_terminal_size(sys.stdout.fileno()).lines
+    except (AttributeError, ValueError, OSError):
+        # Python 2 or not a terminal.
+        return DEFAULT_PAGE_SIZE
+    return max(rows - PROMPT_LINES, MIN_PAGE_SIZE)
 
-def _show_list(matches, patterns, selections, fold):
+def _show_list(matches, indexes, patterns, selections, page, n_pages):
+    '''
+    Show the matches of |indexes| in |matches|, which are in the page |page|.
+    '''
     def yellow(text):
         if sys.stdout.isatty():
             return '\033[1;33m%s\033[m' % text
@@ -548,35 +1533,21 @@ def _show_list(matches, patterns, selections, fold):
 
     global config
 
+    highlighter = _Highlighter(p for p in patterns if not p.startswith('~'))
     os.system('clear')
-    last_filename = ''
-    index_mapping = {}
-    user_index = 1
-    for i, m in enumerate(matches):
-        if fold and m.filename == last_filename:
-            continue
-
-        last_filename = m.filename
-        if i in selections:
-            print(black('(%s) %s:%s:%s' % (user_index, m.line_num, m.filename, m.text)))
+    for i in indexes:
+        m = matches[i]
+        number = matches.number(i)
+        if number in selections:
+            print(black('(%s) %s:%s:%s' % (number, m.line_num, m.filename, m.text)))
         else:
             code = m.text
             if not config['verbose'] and len(code) > DEFAULT_CODE_LENGTH:
                 code = code[:DEFAULT_CODE_LENGTH] + " ..."
-            for pattern in patterns:
-                code = _highlight(pattern, code)
-            print('(%s) %s:%s:%s' % (red(user_index), yellow(m.line_num), green(m.filename), code))
-
-        index_mapping[user_index] = i
-        user_index += 1
-
-    return index_mapping
-
-def _filter_statement(all_, exclude):
-    matches = [m for m in all_ if re.search(';\s*$', m.text)]
-    if not exclude:
-        return matches
-    return _subtract_list(all_, matches)
+            code = highlighter.highlight(code)
+            print('(%s) %s:%s:%s' % (red(number), yellow(m.line_num), green(m.filename), code))
+    if n_pages > 1:
+        print('-- Page %d/%d (%d matches) --' % (page + 1, n_pages, len(matches)))
 
 def _filter_assignment(all_, symbol):
     patterns = [
@@ -590,27 +1561,26 @@ def _filter_assignment(all_, symbol):
         result.update((m for m in all_ if re.search(p, m.text)))
     return result
 
-def _filter_matches(matches, pattern):
+def _filter_matches(matches, pattern, texts=None):
+    '''
+    |texts| is the result of _read_extended_texts(). Pass it to filter
+    the same matches several times without reading the files again.
+    '''
     global config
 
     negative_symbol = '~'
 
+    if texts is None:
+        texts = _read_extended_texts(matches)
+
     new_matches = []
     new_pattern = pattern[1:] if pattern.startswith(negative_symbol) else pattern
     for m in matches:
-        # Special case: find the assignment operation and exclude equality operators.
-        if config['search_extended_lines'] > 0:
-            lines = []
-            with open(m.filename) as fr:
-                i = 0
-                for line in fr:
-                    i += 1
-                    if abs(i - m.line_num) > config['search_extended_lines']:
-                        continue
-                    lines.append(line.strip())
-            text = '\n'.join(lines)
+        if texts is not None:
+            text = texts[(m.filename, m.line_num)]
         else:
             text = m.text
+        # Special case: find the assignment operation and exclude equality operators.
         if new_pattern == '=':
             matched = not not re.search('[^=]=[^=]', text)
             if not matched:
@@ -628,54 +1598,130 @@ def _filter_matches(matches, pattern):
 
     return new_matches
 
-def _filter_declaration_or_definitions_for_golang(matches, pattern):
-    new_matches = []
+def _read_extended_texts(matches):
+    '''
+    Return {(filename, line_num): text} where text is the lines around the
+    match when searching the extended lines (-e), or None otherwise.
+    Each file is read once for all its matches. Read the files in
+    threads, which helps when the files are on a slow file system.
+    '''
+    global config
+
+    import gj_trace
+
+    extended = config['search_extended_lines']
+    if extended <= 0:
+        return None
+
+    line_nums = {}
     for m in matches:
-        if not m.is_golang():
-            continue
+        line_nums.setdefault(m.filename, set()).add(m.line_num)
+    tasks = [(filename, sorted(nums), extended) for filename, nums in line_nums.items()]
 
-        text = m.text.strip()
-        if re.match('func (\(.+\) )?%s\(.*{(.*})?$' % pattern, text):
-            new_matches.append(m)
-        elif re.match('func (\(.+\) )?%s\(.*,$' % pattern, text):
-            # arguments too long, end with some argument.
-            new_matches.append(m)
-        elif re.match('func \(.+ \*?%s\) [a-zA-Z][a-zA-Z0-9]*\(.*$' % pattern, text):
-            # |pattern|'s methods
-            new_matches.append(m)
-        elif text.endswith(pattern + ' struct {'):
-            new_matches.append(m)
-        elif text.endswith(pattern + ' interface {'):
-            new_matches.append(m)
-        elif text.startswith('var ' + pattern) or text.startswith('const ' + pattern):
-            new_matches.append(m)
-    return new_matches
+    with gj_trace.stage('read_extended') as stage:
+        stage.items = len(tasks)
+        if len(tasks) < _MIN_FILES_TO_READ_IN_THREADS:
+            results = list(map(_read_windows, tasks))
+        else:
+            import multiprocessing.pool
+            pool = multiprocessing.pool.ThreadPool(_READ_THREADS)
+            try:
+                results = pool.map(_read_windows, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+    texts = {}
+    for (filename, _, _), windows in zip(tasks, results):
+        for line_num, text in windows:
+            texts[(filename, line_num)] = text
+    return texts
+
+def _read_windows(task):
+    '''
+    Return [(line_num, text)] where text is the stripped lines within
+    |extended| lines of line_num, joined by "\\n".
+    '''
+    filename, line_nums, extended = task
+    with open(filename) as fr:
+        lines = fr.read().split('\n')
+    if lines[-1] == '':
+        # The file ends with a newline.
+        lines.pop()
+    result = []
+    for line_num in line_nums:
+        begin = max(line_num - extended, 1) - 1
+        end = max(line_num + extended, 0)
+        result.append((line_num, '\n'.join(line.strip() for line in lines[begin:end])))
+    return result
 
 def _filter_filename(all_, pattern, exclude):
-    matched = [m for m in all_ if re.search(pattern, m.filename)]
+    # Only search each filename once.
+    regex = re.compile(pattern)
+    matched_files = set(f for f in set(m.filename for m in all_) if regex.search(f))
+    matched = [m for m in all_ if m.filename in matched_files]
     if not exclude:
         return matched
     return _subtract_list(all_, matched)
 
 def _subtract_list(kept, removed):
+    removed = set(removed)
     return [e for e in kept if e not in removed]
 
-def _keep_possible_definition(all_, pattern):
-    result = set()
-
-    # C++: "::METHOD(...)"
-    new_pattern = '::%s(' % pattern
-    result.update(m for m in all_ if new_pattern in m.text)
-
-    # C++: "METHOD() { ... }"
-    new_pattern = pattern + ' *\(.*{.*}.*$'
-    result.update(m for m in all_ if re.search(new_pattern, m.text))
-
-    # Python: "def METHOD"
-    new_pattern = 'def +' + pattern
-    result.update(m for m in all_ if re.search(new_pattern, m.text))
-
-    return result
+class _DecDefClassifier(object):
+    '''
+    Tell whether a match of |pattern| is a possible declaration or
+    definition. The rules of each language are compiled once into a few
+    combined regular expressions.
+    '''
+    # Declarations. The types are not statements (e.g., "class A;").
+    _TYPES = re.compile(r'\b(?:class|struct|enum|interface)\b')  # interface: Java, Objective C
+    _KEYWORDS = re.compile(r'\b(?:typedef|define|using)\b')
+    _STATEMENT = re.compile(_STATEMENT_PATTERN)
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+        self._method = '::%s(' % pattern
+        self._definition = re.compile(
+            # C++: "METHOD() { ... }"
+            '(?:%s *\\(.*{.*}.*$)'
+            # Python: "def METHOD"
+            '|(?:def +%s)' % (pattern, pattern))
+
+        self._go_definition = re.compile(
+            # Functions. The arguments may be too long and end with some argument.
+            '(?:func (?:\\(.+\\) )?%s\\((?:.*{(?:.*})?|.*,)$)'
+            # |pattern|'s methods.
+            '|(?:func \\(.+ \\*?%s\\) [a-zA-Z][a-zA-Z0-9]*\\(.*$)' % (pattern, pattern))
+        self._go_suffixes = (pattern + ' struct {', pattern + ' interface {')
+        self._go_prefixes = ('var ' + pattern, 'const ' + pattern)
+
+        self._rules = {
+            '.go': self._match_go,
+        }
+
+    def match(self, m, text):
+        '''
+        |text| is the text of |m| or the lines around it with -e.
+        '''
+        rule = self._rules.get(os.path.splitext(m.filename)[1], self._match_general)
+        return rule(m, text)
+
+    def _match_general(self, m, text):
+        if self._TYPES.search(text) and not self._STATEMENT.search(m.text):
+            return True
+        if self._KEYWORDS.search(text):
+            return True
+        # C++: "::METHOD(...)"
+        if self._method in m.text:
+            return True
+        return self._definition.search(m.text) is not None
+
+    def _match_go(self, m, text):
+        text = m.text.strip()
+        return (self._go_definition.match(text) is not None
+                or text.endswith(self._go_suffixes)
+                or text.startswith(self._go_prefixes))
 
 def _find_possible_filename(pattern):
     def to_camelcase(word):
@@ -707,10 +1753,12 @@ def _get_prompt_help():
         'the matched filename: '
         '\n* Type %s[PATTERN1 PATTERN2 ~PATTERN3 ...] to start over. '
         '\n  Type only "%s" to use the patterns from the command line.'
+        '\n* Type "%s" / "%s" to go to the next / previous page. Type "%sN" to go to the page of N.'
         '\n* Type ENTER to exit.'
         '\n'
         '\n>> ' % (A_KEEP_STATEMENT, A_CLEAN_STATEMENT,
-                   A_FOLD, A_RESTART, A_RESTART)
+                   A_FOLD, A_RESTART, A_RESTART,
+                   A_NEXT_PAGE, A_PREV_PAGE, A_JUMP)
     )
     return msg
 
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 # -*- encoding: utf8 -*-
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
+import gj_text_index
 import gj_util
 
 class GJUtilTest(unittest.TestCase):
@@ -107,6 +112,387 @@ class GJUtilTest(unittest.TestCase):
         expected = 'path/to/a.go:456:6:  var f foo'
         self.assertEquals(expected, str(actual[0]))
 
+    def testFindDeclarationOrDefinitionByExtension(self):
+        self._input = [
+            'a.cc:1: class Foo;',
+            'a.cc:2: class Foo : public Base {',
+            'a.cc:3: #define Foo Bar',
+            'a.cc:4: void A::Foo(int x) {',
+            'a.cc:5: Foo(1);',
+            'b.py:1: def Foo(self):',
+            'b.py:2: x = Foo()',
+            'c.go:1: type Foo struct {',
+            'c.go:2: // class Foo',
+            'c.go:3: var Foo int',
+        ]
+
+        actual = [str(m) for m in gj_util.find_declaration_or_definition('Foo')]
+        expected = [
+            'a.cc:2:7: class Foo : public Base {',
+            'a.cc:3:9: #define Foo Bar',
+            'a.cc:4:9: void A::Foo(int x) {',
+            'b.py:1:5: def Foo(self):',
+            'c.go:1:6: type Foo struct {',
+            'c.go:3:5: var Foo int',
+        ]
+        self.assertEqual(expected, actual)
+
+    def testFormatResultKeepsText(self):
+        text = 'int foo = ' + 'x' * 100 + ';'
+        m = gj_util.Match.from_fields('a.cc', 1, 4, text)
+        verbose = gj_util.config['verbose']
+        gj_util.config['verbose'] = False
+        try:
+            line = gj_util.format_result(gj_util.Q_MATCHES, m)
+            fields = json.loads(gj_util.format_result(gj_util.Q_MATCHES, m, json_lines=True))
+        finally:
+            gj_util.config['verbose'] = verbose
+        self.assertEqual('a.cc:1:4:' + text[:gj_util.DEFAULT_CODE_LENGTH] + ' ...', line)
+        self.assertEqual(text, fields['text'])
+        self.assertEqual(text, m.text)
+
+
+class FindMatchesTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._config = dict(gj_util.config)
+        self._root = tempfile.mkdtemp(prefix='gj_util_test_')
+        os.chdir(self._root)
+        with open('id-lang.map', 'w') as fw:
+            fw.write('**  IGNORE\n*.cc  text\n')
+        files = {
+            'a.cc': 'void Start();\nStart(); // MySuperThread\nx = Start;\n',
+            'b.cc': 'MySuperThread::Start() {\n  Start();\n}\nif (Start == y) {}\n',
+            'c.cc': 'Start();\nStart(MySuperThreadX);\n',
+            'd.cc': 'MySuperThread t;\n',
+            'sub/e.cc': 'Start(); // MySuperThread\n',
+            'sub-2/f.cc': 'Start(); // MySuperThread\nStop();\n',
+        }
+        for name, content in files.items():
+            if os.path.dirname(name) and not os.path.exists(os.path.dirname(name)):
+                os.makedirs(os.path.dirname(name))
+            with open(name, 'w') as fw:
+                fw.write(content)
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+        gj_util.config['db_path'] = 'ID'
+
+    def tearDown(self):
+        gj_util.config.clear()
+        gj_util.config.update(self._config)
+        os.chdir(self._cwd)
+        shutil.rmtree(self._root)
+
+    def _find(self, patterns, filter_='', path_prefix=''):
+        return [str(m) for m in gj_util.find_matches(patterns, filter_=filter_,
+                                                     path_prefix=path_prefix)]
+
+    def _find_without_planning(self, patterns, filter_='', path_prefix=''):
+        functions = (gj_util._find_candidate_files,
+                     gj_util._find_files_by_word,
+                     gj_util._find_files_by_path)
+        gj_util._find_candidate_files = lambda patterns: None
+        gj_util._find_files_by_word = lambda word: None
+        gj_util._find_files_by_path = lambda path_prefix: None
+        try:
+            return self._find(patterns, filter_, path_prefix)
+        finally:
+            (gj_util._find_candidate_files,
+             gj_util._find_files_by_word,
+             gj_util._find_files_by_path) = functions
+
+    def test_find_candidate_files(self):
+        index = gj_text_index.open_index('ID')
+        ids = gj_util._find_candidate_files(['Start', 'MySuperThread'])
+        self.assertEqual(['a.cc', 'b.cc', 'sub-2/f.cc', 'sub/e.cc'],
+                         sorted(index.path(i) for i in ids))
+        self.assertEqual(set(), gj_util._find_candidate_files(['Start(', 'NotExist']))
+        # Nothing to narrow down.
+        self.assertEqual(None, gj_util._find_candidate_files(['Start']))
+        self.assertEqual(None, gj_util._find_candidate_files(['Start', '~MySuperThread']))
+        self.assertEqual(None, gj_util._find_candidate_files(['Start', 'My.*Thread']))
+
+    def test_same_result(self):
+        for patterns in (['Start', 'MySuperThread'],
+                         ['Start(', 'MySuperThread'],
+                         ['Start', '~MySuperThread'],
+                         ['Start', '=', 'x'],
+                         ['Start', '{', 'MySuperThread'],
+                         ['Start', 'MySuperThread', 'NotExist'],
+                         ['MySuperThread', 'Start', 't']):
+            self.assertEqual(self._find_without_planning(patterns), self._find(patterns))
+        self.assertEqual(['a.cc:2:0:Start(); // MySuperThread',
+                          'b.cc:1:15:MySuperThread::Start() {',
+                          'sub-2/f.cc:1:0:Start(); // MySuperThread',
+                          'sub/e.cc:1:0:Start(); // MySuperThread'],
+                         self._find(['Start', 'MySuperThread']))
+
+    def test_get_literal_prefix(self):
+        self.assertEqual('sub/', gj_util._get_literal_prefix('sub/'))
+        self.assertEqual('sub', gj_util._get_literal_prefix('sub.*/'))
+        self.assertEqual('su', gj_util._get_literal_prefix('sub?/'))
+        self.assertEqual(None, gj_util._get_literal_prefix('(sub|a)'))
+        self.assertEqual(None, gj_util._get_literal_prefix('a|sub'))
+        self.assertEqual(None, gj_util._get_literal_prefix('.*'))
+
+    def test_same_result_with_path_and_filter(self):
+        for patterns, filter_, path_prefix in ((['Start'], '', 'sub'),
+                                               (['Start'], '', 'sub/'),
+                                               (['Start'], '', 'sub.*/'),
+                                               (['Start'], '', '[ab]'),
+                                               (['Start'], '', 'x'),
+                                               (['Start'], 'Stop', ''),
+                                               (['Start'], 'Stop(', ''),
+                                               (['Start'], 'MySuperThread', 'sub'),
+                                               (['Start', 'MySuperThread'], 'y', '')):
+            self.assertEqual(self._find_without_planning(patterns, filter_, path_prefix),
+                             self._find(patterns, filter_, path_prefix))
+        self.assertEqual(['sub-2/f.cc:1:0:Start(); // MySuperThread',
+                          'sub/e.cc:1:0:Start(); // MySuperThread'],
+                         self._find(['Start'], path_prefix='sub'))
+        self.assertEqual(['sub-2/f.cc:1:0:Start(); // MySuperThread'],
+                         self._find(['Start'], filter_='Stop'))
+
+    def test_read_only_files_of_pattern(self):
+        index = gj_text_index.open_index('ID')
+        read = index._read
+        paths = []
+        def fake_read(file_id):
+            paths.append(index.path(file_id))
+            return read(file_id)
+        index._read = fake_read
+        try:
+            # d.cc has MySuperThread but not Start.
+            self.assertEqual([], self._find(['Start'], path_prefix='d'))
+            self.assertEqual(8, len(self._find(['Start'], filter_='MySuperThread')))
+        finally:
+            del index._read
+        self.assertEqual(['a.cc', 'b.cc', 'sub-2/f.cc', 'sub/e.cc'], sorted(paths))
+
+    def test_read_extended_texts(self):
+        def read_window(filename, line_num, extended):
+            # The old way: read the file for each match.
+            lines = []
+            with open(filename) as fr:
+                i = 0
+                for line in fr:
+                    i += 1
+                    if abs(i - line_num) <= extended:
+                        lines.append(line.strip())
+            return '\n'.join(lines)
+
+        with open('g.cc', 'w') as fw:
+            fw.write('\n'.join('  line %d  ' % i for i in range(1, 11)))
+        with open('h.cc', 'wb') as fw:
+            fw.write(b'a\r\nb\r\n\r\nc\r\n')
+        matches = [gj_util.Match.create('%s:%d:x' % (f, n), 'x')
+                   for f in ('g.cc', 'h.cc') for n in (1, 2, 4, 10, 11)]
+        min_files = gj_util._MIN_FILES_TO_READ_IN_THREADS
+        for extended in (1, 3, 20):
+            gj_util.config['search_extended_lines'] = extended
+            for min_files_in_threads in (min_files, 1):
+                gj_util._MIN_FILES_TO_READ_IN_THREADS = min_files_in_threads
+                try:
+                    texts = gj_util._read_extended_texts(matches)
+                finally:
+                    gj_util._MIN_FILES_TO_READ_IN_THREADS = min_files
+                for m in matches:
+                    self.assertEqual(read_window(m.filename, m.line_num, extended),
+                                     texts[(m.filename, m.line_num)])
+
+        gj_util.config['search_extended_lines'] = 0
+        self.assertEqual(None, gj_util._read_extended_texts(matches))
+
+    def test_same_result_with_extended_lines(self):
+        gj_util.config['search_extended_lines'] = 1
+        patterns = ['Start', 'x']
+        self.assertEqual(self._find_without_planning(patterns), self._find(patterns))
+        # "x" is in the next line of the first one.
+        self.assertEqual(['a.cc:2:0:Start(); // MySuperThread', 'a.cc:3:4:x = Start;'],
+                         self._find(patterns))
+
+    def _query(self, patterns, **kwargs):
+        return [str(m) for m in gj_util.query(gj_util.Q_MATCHES, patterns, **kwargs)]
+
+    def test_query_with_limit(self):
+        expected = self._find(['Start'])
+        self.assertEqual(expected[:3], self._query(['Start'], limit=3))
+        self.assertEqual(expected[:3], self._query(['Start'], filter_='MySuperThread', limit=3))
+        self.assertEqual([m for m in expected if m.startswith('a.cc:')],
+                         self._query(['Start'], first_file_only=True))
+        self.assertEqual(expected[:1], self._query(['Start'], limit=1, first_file_only=True))
+
+        unsorted = self._query(['Start'], sort=False)
+        self.assertEqual(expected, sorted(unsorted, key=lambda s: s.split(':')[:2]))
+        self.assertEqual(unsorted[:2], self._query(['Start'], limit=2, sort=False))
+        first = unsorted[0].split(':')[0]
+        self.assertEqual([m for m in unsorted if m.startswith(first + ':')],
+                         self._query(['Start'], first_file_only=True, sort=False))
+
+    def test_query_with_cache(self):
+        expected = self._query(['Start'])
+        self.assertEqual(expected, self._query(['Start'], use_cache=True))
+        self.assertTrue(os.path.isdir('ID.cache'))
+
+        query = gj_util._query
+        gj_util._query = lambda *args: self.fail('The result is not cached.')
+        try:
+            self.assertEqual(expected, self._query(['Start'], use_cache=True))
+        finally:
+            gj_util._query = query
+
+        # Editing a source file without re-indexing invalidates the results.
+        with open('b.cc', 'w') as fw:
+            fw.write('\n\nMySuperThread::Start() {\n  Start();\n}\n')
+        result = self._query(['Start'], use_cache=True)
+        self.assertEqual(['b.cc:3:15:MySuperThread::Start() {', 'b.cc:4:2:  Start();'],
+                         [m for m in result if m.startswith('b.cc:')])
+
+        # Rebuilding the index invalidates the results.
+        with open('a.cc', 'w') as fw:
+            fw.write('Start();\n')
+        gj_text_index.build('ID', 'id-lang.map', jobs=1)
+        result = self._query(['Start'], use_cache=True)
+        self.assertEqual(['a.cc:1:0:Start();'], [m for m in result if m.startswith('a.cc:')])
+
+        gj_util.clear_cache('ID')
+        self.assertFalse(os.path.exists('ID.cache'))
+
+    def test_find_command(self):
+        os.makedirs('tools')
+        tool = os.path.abspath('tools/gj_fake_tool')
+        with open(tool, 'w') as fw:
+            fw.write('#!/bin/sh\n')
+        os.chmod(tool, 0o755)
+        path = os.environ.get('PATH')
+        os.environ['PATH'] = os.path.abspath('tools')
+        try:
+            self.assertEqual(tool, gj_util._find_command('gj_fake_tool', 'ID'))
+            self.assertEqual({'gj_fake_tool': tool}, gj_util._load_tools('ID'))
+            # The commands not found are not cached.
+            self.assertTrue(gj_util._find_command('gj_missing_tool', 'ID') is None)
+            self.assertEqual({'gj_fake_tool': tool}, gj_util._load_tools('ID'))
+
+            # Use the cached path without searching $PATH.
+            isfile = os.path.isfile
+            os.path.isfile = lambda path: self.fail('The path is not cached.')
+            try:
+                self.assertEqual(tool, gj_util._find_command('gj_fake_tool', 'ID'))
+            finally:
+                os.path.isfile = isfile
+
+            # Changing $PATH invalidates the cache.
+            os.environ['PATH'] = os.pathsep.join([os.path.abspath('tools'), '/nonexistent'])
+            self.assertEqual({}, gj_util._load_tools('ID'))
+        finally:
+            if path is None:
+                del os.environ['PATH']
+            else:
+                os.environ['PATH'] = path
+
+    def test_iter_output(self):
+        lines = gj_util._iter_output(['yes', 'a.cc:1:x'])
+        self.assertEqual(['a.cc:1:x'] * 3, [next(lines) for _ in range(3)])
+        # Stop the endless command.
+        lines.close()
+
+
+class MatchSetTest(unittest.TestCase):
+    def _create(self, filename, line_num, text):
+        return gj_util.Match((filename, str(line_num), text), 'x')
+
+    def setUp(self):
+        self._matches = [
+            self._create('b.cc', 3, 'int x = 1;'),
+            self._create('a.h', 10, 'void x();'),
+            self._create('b.cc', 3, 'int x = 1;'),
+            self._create('a.cc', 12, 'x = 2;'),
+            self._create('a.cc', 2, 'if (x) {'),
+            self._create('b.cc', 1, 'x++;'),
+        ]
+
+    def _to_list(self, matches):
+        return [str(m) for m in matches]
+
+    def test_hash(self):
+        m = self._create('a.cc', 12, 'x = 2;')
+        self.assertEqual(self._matches[3], m)
+        self.assertEqual(hash(self._matches[3]), hash(m))
+        self.assertNotEqual(self._matches[4], m)
+        self.assertEqual(5, len(set(self._matches)))
+
+    def test_unique_sorted(self):
+        expected = self._to_list(sorted(set(self._matches), key=gj_util.Match.sort_key))
+        matches = gj_util.MatchSet(self._matches)
+        self.assertEqual(6, len(matches))
+        actual = matches.unique_sorted()
+        self.assertEqual(expected, self._to_list(actual))
+        self.assertEqual('b.cc', actual[-1].filename)
+        self.assertEqual(3, actual[-1].line_num)
+
+    def test_filter(self):
+        matches = gj_util.MatchSet(self._matches).unique_sorted()
+        self.assertEqual(self._to_list(gj_util._filter_filename(list(matches), 'a\\.', False)),
+                         self._to_list(matches.filter_filename('a\\.', False)))
+        self.assertEqual(self._to_list(gj_util._filter_filename(list(matches), '\\.cc$', True)),
+                         self._to_list(matches.filter_filename('\\.cc$', True)))
+        self.assertEqual(['a.cc:2:4:if (x) {'],
+                         self._to_list(matches.filter_text(gj_util._STATEMENT_PATTERN, True)))
+        self.assertEqual(['a.h:10:5:void x();'],
+                         self._to_list(matches.filter_filename('h$', False)
+                                       .filter_text(gj_util._STATEMENT_PATTERN, False)))
+
+
+class ChooseMatchesTest(unittest.TestCase):
+    def setUp(self):
+        self._functions = (gj_util._get_page_size, gj_util._show_list, gj_util.os.system)
+        self._pages = []
+        self._responses = []
+        gj_util._get_page_size = lambda: 3
+        gj_util._show_list = self._show_list
+        gj_util.os.system = lambda cmd: 0
+        gj_util.input = lambda prompt: self._responses.pop(0)
+        for name in ('fold', 'selections', 'page'):
+            if hasattr(gj_util.choose_matches_interactively, name):
+                delattr(gj_util.choose_matches_interactively, name)
+
+        self._matches = [gj_util.Match((f, str(n), 'x'), 'x')
+                         for f, n in (('b.cc', 1), ('a.cc', 1), ('a.cc', 2), ('a.cc', 3),
+                                      ('b.cc', 2), ('c.h', 7), ('c.h', 9))]
+
+    def tearDown(self):
+        (gj_util._get_page_size, gj_util._show_list, gj_util.os.system) = self._functions
+        del gj_util.input
+
+    def _show_list(self, matches, indexes, patterns, selections, page, n_pages):
+        self._pages.append([(matches.number(i), str(matches[i])) for i in indexes])
+
+    def _choose(self, matches, responses):
+        self._responses = responses
+        self._pages = []
+        return gj_util.choose_matches_interactively(matches, ['x'])
+
+    def test_pages(self):
+        selections, matches, _ = self._choose(self._matches, ['>', '>', '>', '<', '@2', '5'])
+        numbers = [[n for n, _ in page] for page in self._pages]
+        self.assertEqual([[1, 2, 3], [4, 5, 6], [7], [7], [4, 5, 6], [1, 2, 3]], numbers)
+        self.assertEqual(['b.cc:2:0:x'], [str(m) for m in selections])
+
+        # Keep the page and the numbers after returning.
+        selections, matches, _ = self._choose(matches, ['>', ''])
+        selections, matches, _ = self._choose(matches, ['h$', '7'])
+        self.assertEqual([[(4, 'b.cc:1:0:x'), (5, 'b.cc:2:0:x'), (6, 'c.h:7:0:x')],
+                          [(6, 'c.h:7:0:x'), (7, 'c.h:9:0:x')]], self._pages)
+        self.assertEqual(['c.h:9:0:x'], [str(m) for m in selections])
+        self.assertEqual(set([7]), gj_util.choose_matches_interactively.selections)
+
+        selections, matches, _ = self._choose(matches, ['1'])
+        self.assertEqual(None, selections)
+
+    def test_fold(self):
+        self._choose(self._matches, ['.', '@5', ''])
+        self.assertEqual([[1, 2, 3], [1, 4, 6], [1, 4, 6]],
+                         [[n for n, _ in page] for page in self._pages])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -14,6 +14,26 @@ let g:loaded_gj_vim = 1
 
 let g:gjprg = get(g:, "gj#gj_path", expand("<sfile>:p:h") . "/../bin/gj_without_interaction")
 let g:gj_db_name = get(g:, "gj#db_name", "ID")
+" Extra arguments of each search. E.g., "--unsorted --limit 200".
+let g:gj_args = get(g:, "gj#args", "")
+" Run gj in a job and fill the quickfix list while it's searching.
+let g:gj_async = get(g:, "gj#async", has("nvim") || (has("job") && has("timers")))
+" Add the matches to the quickfix list once N of them arrive ...
+let g:gj_batch_size = get(g:, "gj#batch_size", 200)
+" ... or N milliseconds after the first one of them arrives.
+let g:gj_flush_interval = get(g:, "gj#flush_interval", 100)
+
+" The state of the async search. The callbacks of the stopped searches have
+" the older generations and are ignored.
+let s:generation = 0
+let s:job = 0
+let s:running = 0
+let s:qf_id = 0
+let s:pending = []
+let s:partial = ""
+let s:count = 0
+let s:timer = -1
+let s:jump = 0
 
 function! s:FindDbPath(db_name) abort
   let curr_dir = expand("%:p:h")
@@ -23,7 +43,8 @@ function! s:FindDbPath(db_name) abort
   let db_path = curr_dir . "/" . a:db_name
   while curr_dir != "/"
     let db_path = curr_dir . "/" . a:db_name
-    if filereadable(db_path)
+    " The manifest of a sharded index.
+    if filereadable(db_path) || filereadable(db_path . ".shards")
         return db_path
     endif
     let curr_dir = fnamemodify(curr_dir, ":h")
@@ -32,6 +53,11 @@ function! s:FindDbPath(db_name) abort
 endfunction
 
 function! s:Gj(cmd, args)
+  if g:gj_async
+    call s:GjAsync(a:cmd !~ "!$", a:args)
+    return
+  endif
+
   redraw
   echo "Searching ..."
 
@@ -42,12 +68,17 @@ function! s:Gj(cmd, args)
     let &grepprg=g:gjprg
     let &grepformat="%f:%l:%c:%m"
     let db_path = s:FindDbPath(g:gj_db_name)
-    silent execute a:cmd . " --db " . escape(db_path, '|') . " " . escape(l:grepargs, '|')
+    silent execute a:cmd . " --db " . escape(db_path, '|') . " " . g:gj_args . " " . escape(l:grepargs, '|')
   finally
     let &grepprg=grepprg_bak
     let &grepformat=grepformat_bak
   endtry
 
+  call s:OpenQuickfix()
+  redraw!
+endfunction
+
+function! s:OpenQuickfix()
   botright copen
 
   exec "nnoremap <silent> <buffer> q :ccl<CR>"
@@ -59,11 +90,153 @@ function! s:Gj(cmd, args)
   exec "nnoremap <silent> <buffer> H <C-W><CR><C-W>K<C-W>b"
   exec "nnoremap <silent> <buffer> v <C-W><CR><C-W>H<C-W>b<C-W>J<C-W>t"
   exec "nnoremap <silent> <buffer> gv <C-W><CR><C-W>H<C-W>b<C-W>J"
+endfunction
 
-  redraw!
+"-----------------------------------------------------------------------------
+" Async search: gj outputs one JSON object per match (--json) and the matches
+" are added to the quickfix list in batches. A new search stops the running one.
+
+function! s:GjAsync(jump, args)
+  call s:GjStop()
+  let s:pending = []
+  let s:partial = ""
+  let s:count = 0
+  let s:jump = a:jump
+
+  let db_path = s:FindDbPath(g:gj_db_name)
+  let cmd = g:gjprg . " --json --db " . shellescape(db_path) . " " . g:gj_args . " " . a:args
+  let argv = [&shell, &shellcmdflag, cmd]
+  call setqflist([], " ", {"title": "gj " . a:args})
+  let s:qf_id = getqflist({"id": 0}).id
+
+  if has("nvim")
+    let s:job = jobstart(argv, {
+          \ "on_stdout": function("s:OnNvimOutput", [s:generation]),
+          \ "on_exit": function("s:OnExit", [s:generation]),
+          \ })
+    let s:running = s:job > 0
+  else
+    let s:job = job_start(argv, {
+          \ "in_io": "null",
+          \ "err_io": "null",
+          \ "out_mode": "nl",
+          \ "out_cb": function("s:OnVimOutput", [s:generation]),
+          \ "close_cb": function("s:OnExit", [s:generation]),
+          \ })
+    let s:running = job_status(s:job) == "run"
+  endif
+  if !s:running
+    echoerr "Failed to run " . g:gjprg
+    return
+  endif
+
+  call s:OpenQuickfix()
+  redraw
+  echo "Searching ..."
+endfunction
+
+function! s:GjStop()
+  let s:generation += 1
+  if s:timer != -1
+    call timer_stop(s:timer)
+    let s:timer = -1
+  endif
+  if !s:running
+    return
+  endif
+  let s:running = 0
+  if has("nvim")
+    call jobstop(s:job)
+  else
+    call job_stop(s:job)
+  endif
+endfunction
+
+function! s:OnVimOutput(generation, channel, line)
+  if a:generation == s:generation
+    call s:AddLine(a:line)
+  endif
+endfunction
+
+function! s:OnNvimOutput(generation, job, data, event)
+  if a:generation != s:generation
+    return
+  endif
+  " The last item is the incomplete line.
+  let lines = copy(a:data)
+  let lines[0] = s:partial . lines[0]
+  let s:partial = remove(lines, -1)
+  for line in lines
+    call s:AddLine(line)
+  endfor
+endfunction
+
+function! s:OnExit(generation, ...)
+  if a:generation != s:generation
+    return
+  endif
+  call s:AddLine(s:partial)
+  let s:partial = ""
+  call s:Flush()
+  let s:running = 0
+  call s:GjStop()
+
+  if s:jump && s:count > 0 && getqflist({"id": 0}).id == s:qf_id
+    cfirst
+  endif
+  redraw
+  echo "gj: " . s:count . " matches"
+endfunction
+
+function! s:OnTimer(generation, timer)
+  let s:timer = -1
+  if a:generation == s:generation
+    call s:Flush()
+  endif
+endfunction
+
+function! s:AddLine(line)
+  if empty(a:line)
+    return
+  endif
+  call add(s:pending, a:line)
+  if len(s:pending) >= g:gj_batch_size
+    call s:Flush()
+  elseif s:timer == -1
+    let s:timer = timer_start(g:gj_flush_interval, function("s:OnTimer", [s:generation]))
+  endif
+endfunction
+
+function! s:Flush()
+  if empty(s:pending)
+    return
+  endif
+  let items = []
+  for line in s:pending
+    try
+      let m = json_decode(line)
+    catch
+      " E.g., the error messages.
+      let m = {"text": line}
+    endtry
+    if type(m) != type({})
+      let m = {"text": line}
+    endif
+    if has_key(m, "filename")
+      " gj's columns start from 0.
+      call add(items, {"filename": m.filename, "lnum": m.line, "col": m.column + 1, "text": m.text})
+      let s:count += 1
+    else
+      call add(items, {"text": get(m, "text", line)})
+    endif
+  endfor
+  let s:pending = []
+  call setqflist([], "a", {"id": s:qf_id, "items": items})
 endfunction
 
 command! -bang -nargs=* -complete=file Gj call s:Gj('grep<bang>', <q-args>)
+" Stop the running async search.
+command! GjStop call s:GjStop()
 
 "-----------------------------------------------------------------------------
 